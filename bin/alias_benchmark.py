@@ -0,0 +1,116 @@
+#!/bin/python
+# measures how long local nodes need to reserve their aliases, and to recover from alias collisions
+# all participants share a virtual CAN bus in one asyncio loop, frames are delivered instantly
+import io
+import time
+import asyncio
+import argparse
+from contextlib import redirect_stdout
+from lcc_browser.can.connection import Connection, CanFrame
+from lcc_browser.lcc.lcc_protocol import LccProtocol
+from lcc_browser.lcc.bus_statistics import frame_overhead_bits
+
+class VirtualBus:
+    def __init__(self):
+        self.connections = []
+        self.frames = 0
+        self.bits = 0
+
+    def reset_counters(self):
+        self.frames = 0
+        self.bits = 0
+
+class VirtualConnection(Connection):
+    # delivers every frame to all other participants, in order
+    name = "Virtual bus"
+
+    def __init__(self, bus, protocol):
+        super().__init__(protocol)
+        self.threaded = False
+        self.bus = bus
+        bus.connections.append(self)
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+
+    def send(self, can_frame):
+        super().send(can_frame)
+        self.bus.frames += 1
+        self.bus.bits += frame_overhead_bits + 8 * len(can_frame.data or b"")
+        for connection in self.bus.connections:
+            if connection is not self:
+                self.loop.call_soon(connection.deliver, can_frame)
+
+    def deliver(self, frame):
+        if self.protocol: self.protocol.parse_frame(frame)
+
+def make_node_ids(participant, count):
+    # node ids of one participant, 02.pp.0D.00.nn.nn, every participant has its own range like devices of different vendors
+    return [bytes([0x02, participant, 0x0d, 0x00, i >> 8, i & 0xff]) for i in range(count)]
+
+def all_permitted(participants, count):
+    return all(len(lcc.reservations) == count and
+        all(x.state == "permitted" for x in lcc.reservations.values()) for lcc in participants)
+
+async def wait_permitted(participants, count, timeout=60):
+    start = time.perf_counter()
+    while not all_permitted(participants, count):
+        if time.perf_counter() - start > timeout: raise TimeoutError("Reservations didn't finish")
+        await asyncio.sleep(.001)
+    return time.perf_counter() - start
+
+async def run_scenario(participant_count, node_count, bitrate):
+    bus = VirtualBus()
+    participants = []
+    for p in range(participant_count):
+        lcc = LccProtocol()
+        node_ids = make_node_ids(p + 1, node_count)
+        lcc.update_node_id(node_ids[0])
+        connection = VirtualConnection(bus, lcc)
+        lcc.set_connection(connection)
+        connection.start()
+        participants.append((lcc, node_ids))
+    protocols = [lcc for lcc, node_ids in participants]
+
+    # startup, all participants reserve all their aliases at the same time
+    for lcc, node_ids in participants:
+        lcc.reserve_aliases(node_ids)
+    startup = await wait_permitted(protocols, node_count)
+    startup_frames, startup_bits = bus.frames, bus.bits
+    collisions = sum(x.collisions for lcc in protocols for x in lcc.reservations.values())
+
+    # recovery, an intruder sends a frame with every alias of the first participant
+    bus.reset_counters()
+    intruder = VirtualConnection(bus, None)
+    intruder.start()
+    for reservation in list(protocols[0].reservations.values()):
+        intruder.send(CanFrame((0b11 << 27) | (1 << 24) | (0x100 << 12) | reservation.alias, bytes(6), True, False))
+    await asyncio.sleep(0)
+    recovery = await wait_permitted(protocols, node_count)
+
+    for lcc in protocols: lcc.join()
+    return {
+        "participants": participant_count,
+        "nodes": node_count,
+        "startup": startup,
+        "startup_frames": startup_frames,
+        "startup_wire": startup_bits / bitrate,
+        "collisions": collisions,
+        "recovery": recovery,
+        "recovery_frames": bus.frames,
+    }
+
+async def main(args):
+    print(f"{'participants':>12} {'nodes':>6} {'startup':>9} {'frames':>7} {'on wire':>9} {'collisions':>10} {'recovery':>9} {'frames':>7}")
+    for participant_count in args.participants:
+        for node_count in args.nodes:
+            with redirect_stdout(io.StringIO()):
+                result = await run_scenario(participant_count, node_count, args.bitrate)
+            print(f"{result['participants']:>12} {result['nodes']:>6} {result['startup'] * 1000:>7.0f}ms {result['startup_frames']:>7} "
+                f"{result['startup_wire'] * 1000:>7.0f}ms {result['collisions']:>10} {result['recovery'] * 1000:>7.0f}ms {result['recovery_frames']:>7}")
+
+parser = argparse.ArgumentParser(description="Benchmark of CAN alias reservation on a virtual bus")
+parser.add_argument("--nodes", type=int, nargs="+", default=[1, 10, 100, 250], help="local node ids per participant")
+parser.add_argument("--participants", type=int, nargs="+", default=[1, 4], help="participants that start at the same time")
+parser.add_argument("--bitrate", type=int, default=125000, help="bit rate used to estimate the time the frames need on a real bus")
+asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,335 @@
+""" Local HTTP and WebSocket API that streams LCC events and node state to dashboards."""
+import json
+import base64
+import struct
+import asyncio
+import hashlib
+import hmac
+from urllib.parse import urlsplit, parse_qs
+from lcc_browser.node_inventory import inventory, snip_fields
+
+websocket_guid = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+max_message_size = 0x10000 # larger client messages close the connection
+max_header_size = 0x4000
+
+# websocket opcodes, see RFC 6455
+op_continuation = 0x0
+op_text = 0x1
+op_binary = 0x2
+op_close = 0x8
+op_ping = 0x9
+op_pong = 0xa
+
+local_hosts = {"localhost", "127.0.0.1", "::1"}
+
+# binary event messages: type, event id, source node id (zero if unknown)
+binary_event_type = 0x01
+
+class WebSocketError(Exception):
+    pass
+
+def encode_frame(opcode, payload):
+    # server frames are never masked or fragmented
+    header = bytearray([0x80 | opcode])
+    if len(payload) < 126:
+        header.append(len(payload))
+    elif len(payload) < 0x10000:
+        header.append(126)
+        header += struct.pack(">H", len(payload))
+    else:
+        header.append(127)
+        header += struct.pack(">Q", len(payload))
+    return bytes(header) + payload
+
+async def read_frame(reader):
+    # returns (fin, opcode, payload) of a masked client frame
+    b0, b1 = await reader.readexactly(2)
+    if not b1 & 0x80: raise WebSocketError("Client frame isn't masked")
+    size = b1 & 0x7f
+    if size == 126:
+        size = struct.unpack(">H", await reader.readexactly(2))[0]
+    elif size == 127:
+        size = struct.unpack(">Q", await reader.readexactly(8))[0]
+    if size > max_message_size: raise WebSocketError("Message too large")
+    mask = await reader.readexactly(4)
+    payload = bytearray(await reader.readexactly(size))
+    for i in range(size):
+        payload[i] ^= mask[i % 4]
+    return bool(b0 & 0x80), b0 & 0x0f, bytes(payload)
+
+def is_local_origin(origin):
+    # pages of other sites must not reach the bus through the browser, clients without origin aren't browsers
+    # "null" is sent by local files, but also by sandboxed frames of any site
+    if origin is None: return True
+    url = urlsplit(origin)
+    return url.scheme in ("http", "https") and url.hostname in local_hosts
+
+def normalize_event_id(event_id):
+    # hex digits without dots, e.g. "0102030405060708"
+    return str(event_id).replace(".", "").upper()
+
+class EventFilter:
+    # events a client subscribed to, by event id or event id prefix
+    # no subscription passes all events
+    def __init__(self):
+        self.prefixes = {} # prefix length -> {prefix}, full event ids have length 16
+
+    def set(self, event_ids=(), prefixes=()):
+        self.prefixes = {}
+        for key in [normalize_event_id(x) for x in list(event_ids) + list(prefixes)]:
+            self.prefixes.setdefault(len(key), set()).add(key)
+
+    def matches(self, event_id):
+        # event_id is normalized
+        if not self.prefixes: return True
+        return any(event_id[:length] in keys for length, keys in self.prefixes.items())
+
+class ApiClient:
+    # a websocket client with its own bounded send queue
+    # when the client doesn't keep up, the oldest messages are dropped and it's told how many
+    def __init__(self, server, reader, writer, binary=False, queue_size=1000):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.binary = binary
+        self.queue = asyncio.Queue(queue_size)
+        self.filter = EventFilter()
+        self.dropped = 0
+
+    def send(self, message):
+        # message is a dict, or bytes for a binary message
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    def send_event(self, event_id, source_node_id):
+        if self.binary:
+            source = bytes.fromhex(source_node_id.replace(".", "")) if source_node_id else bytes(6)
+            self.send(bytes([binary_event_type]) + bytes.fromhex(event_id) + source)
+        else:
+            self.send({"type": "event", "event_id": event_id[:12] + "." + event_id[12:], "source": source_node_id})
+
+    async def run(self):
+        writer_task = asyncio.create_task(self.write_messages())
+        try:
+            await self.read_messages()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except WebSocketError as e:
+            print("API client error:", e)
+        finally:
+            writer_task.cancel()
+            self.writer.close()
+
+    async def write_messages(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                if self.dropped:
+                    self.writer.write(encode_frame(op_text, json.dumps({"type": "dropped", "count": self.dropped}).encode()))
+                    self.dropped = 0
+                if isinstance(message, bytes):
+                    self.writer.write(encode_frame(op_binary, message))
+                else:
+                    self.writer.write(encode_frame(op_text, json.dumps(message).encode()))
+                # only this client waits for its socket
+                await self.writer.drain()
+        except ConnectionError:
+            self.reader.feed_eof()
+
+    async def read_messages(self):
+        fragments = []
+        while True:
+            fin, opcode, payload = await read_frame(self.reader)
+            if opcode == op_close:
+                self.writer.write(encode_frame(op_close, payload[:2]))
+                return
+            if opcode == op_ping:
+                self.writer.write(encode_frame(op_pong, payload))
+                continue
+            if opcode == op_pong:
+                continue
+            fragments.append(payload)
+            if sum(len(x) for x in fragments) > max_message_size:
+                raise WebSocketError("Message too large")
+            if not fin: continue
+            data = b"".join(fragments)
+            fragments = []
+            try:
+                self.handle_command(json.loads(data))
+            except (ValueError, KeyError, TypeError) as e:
+                self.send({"type": "error", "message": f"{type(e).__name__}: {e}"})
+
+    def handle_command(self, command):
+        # commands mirror the browser page's LCC object
+        lcc = self.server.lcc
+        command_type = command["type"]
+        if command_type == "raw-event":
+            event_id = normalize_event_id(command["id"])
+            if len(event_id) != 16: raise ValueError(f"Invalid event id {command['id']}")
+            lcc.emit_event(event_id)
+            self.server.publish_event(event_id, self.server.own_node_id(), exclude=self)
+        elif command_type == "register-consumer":
+            lcc.register_consumer(command["id"])
+        elif command_type == "register-producer":
+            lcc.register_producer(command["id"])
+        elif command_type == "subscribe":
+            event_ids = [normalize_event_id(x) for x in command.get("event_ids", [])]
+            prefixes = [normalize_event_id(x) for x in command.get("prefixes", [])]
+            # producers on the bus only send events that somebody consumes
+            for event_id in event_ids: lcc.register_consumer(event_id)
+            for prefix in prefixes: lcc.register_consumer_range(prefix)
+            self.filter.set(event_ids, prefixes)
+        elif command_type == "nodes":
+            self.send({"type": "nodes", "nodes": self.server.node_states()})
+        else:
+            raise ValueError(f"Unknown command {command_type}")
+
+class ApiServer:
+    # runs in the connection loop, listeners feed the client queues without waiting for any client
+    def __init__(self, lcc, host="127.0.0.1", port=8765, queue_size=1000, token=None):
+        self.lcc = lcc
+        self.host = host
+        self.port = port
+        self.token = token # if set, clients pass it as ?token=...
+        self.queue_size = queue_size
+        self.server = None
+        self.clients = set()
+
+    def get_listeners(self):
+        return [
+            ("ProducerConsumerReport", self.on_event_report),
+            ("VerifiedNodeId", self.on_node_seen),
+            ("InitializationComplete", self.on_node_seen),
+            ("InitializationCompleteSimple", self.on_node_seen),
+            ("AliasMapResetFrame", self.on_alias_map_reset),
+        ]
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        for frame_type, func in self.get_listeners():
+            self.lcc.add_listener(frame_type, func)
+        print(f"API server listening on http://{self.host}:{self.port}")
+
+    def stop(self):
+        # may be called from any thread
+        connection = self.lcc.connection
+        if connection and connection.loop and connection.loop.is_running():
+            self.lcc.call_soon(self.close)
+
+    def close(self):
+        for frame_type, func in self.get_listeners():
+            self.lcc.remove_listener(frame_type, func)
+        if self.server:
+            self.server.close()
+            self.server = None
+        for client in self.clients:
+            client.writer.close()
+        self.clients = set()
+
+    def own_node_id(self):
+        return ".".join([f"{x:02X}" for x in self.lcc.node_id])
+
+    def node_state(self, node_id, online=None):
+        alias = self.lcc.node_id_to_alias.get(node_id)
+        info = inventory.get(node_id) or {}
+        state = {"type": "node", "node_id": node_id, "alias": alias, "online": alias is not None if online is None else online}
+        for key in snip_fields:
+            state[key] = info.get(key)
+        return state
+
+    def node_states(self):
+        return [self.node_state(node_id) for node_id in list(self.lcc.node_id_to_alias)]
+
+    def publish_event(self, event_id, source_node_id, exclude=None):
+        for client in self.clients:
+            if client is not exclude and client.filter.matches(event_id):
+                client.send_event(event_id, source_node_id)
+
+    def publish(self, message):
+        for client in self.clients:
+            client.send(message)
+
+    def on_event_report(self, frame):
+        event_id = normalize_event_id(frame.inner.inner.inner.event_id)
+        self.publish_event(event_id, self.lcc.alias_to_node_id.get(frame.source_alias))
+
+    def on_node_seen(self, frame):
+        if self.clients:
+            self.publish(self.node_state(frame.inner.inner.inner.node_id, True))
+
+    def on_alias_map_reset(self, frame):
+        if self.clients:
+            self.publish(self.node_state(frame.inner.inner.node_id, False))
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        if len(request) > max_header_size:
+            writer.close()
+            return
+        lines = request.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            self.send_http(writer, 400, {"error": "Bad request"})
+            return
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        origin = headers.get("origin")
+        if not is_local_origin(origin) and not (origin == "null" and self.token):
+            self.send_http(writer, 403, {"error": "Origin not allowed"})
+            return
+        if self.token and not hmac.compare_digest(query.get("token", [""])[0], self.token):
+            self.send_http(writer, 403, {"error": "Invalid token"})
+            return
+
+        if headers.get("upgrade", "").lower() == "websocket":
+            key = headers.get("sec-websocket-key")
+            if not key or method != "GET":
+                self.send_http(writer, 400, {"error": "Bad websocket request"})
+                return
+            accept = base64.b64encode(hashlib.sha1((key + websocket_guid).encode()).digest()).decode()
+            writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+            client = ApiClient(self, reader, writer, query.get("format") == ["binary"], self.queue_size)
+            self.clients.add(client)
+            try:
+                await client.run()
+            finally:
+                self.clients.discard(client)
+            return
+
+        if method != "GET":
+            self.send_http(writer, 405, {"error": "Method not allowed"})
+        elif url.path == "/nodes":
+            self.send_http(writer, 200, self.node_states())
+        elif url.path == "/":
+            self.send_http(writer, 200, {
+                "node_id": self.own_node_id(),
+                "websocket": f"ws://{self.host}:{self.port}/events",
+                "clients": len(self.clients),
+            })
+        else:
+            self.send_http(writer, 404, {"error": "Not found"})
+
+    def send_http(self, writer, status, body):
+        reasons = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed"}
+        body = json.dumps(body).encode()
+        writer.write((f"HTTP/1.1 {status} {reasons[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n").encode() + body)
+        writer.close()
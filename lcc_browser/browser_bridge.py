@@ -0,0 +1,35 @@
+""" Delivery of LCC events to the browser page, batched into one script call per frame."""
+import wx
+import json
+import time
+
+class BrowserBridge:
+    # events are queued in the GUI thread and handed to LCC.receiveEvents as one array
+    # the page dispatches them on its next animation frame
+    def __init__(self, browser, interval=1/60):
+        self.browser = browser
+        self.interval = interval
+        self.pending = []
+        self.flush_scheduled = False
+        self.last_flush = 0
+
+    def post(self, event_id):
+        self.pending.append(event_id)
+        if self.flush_scheduled: return
+        self.flush_scheduled = True
+        delay = self.last_flush + self.interval - time.monotonic()
+        if delay > 0:
+            wx.CallLater(int(delay * 1000) + 1, self.flush)
+        else:
+            wx.CallAfter(self.flush)
+
+    def clear(self):
+        self.pending = []
+
+    def flush(self):
+        self.flush_scheduled = False
+        self.last_flush = time.monotonic()
+        if not self.pending: return
+        events = self.pending
+        self.pending = []
+        self.browser.RunScriptAsync(f"LCC.receiveEvents({json.dumps(events)});")
@@ -0,0 +1,90 @@
+from lcc_browser.templates.bus_statistics import BusStatisticsTemplate
+from lcc_browser.lcc.tracing import tracer
+import wx
+
+sparkline_characters = " ▁▂▃▄▅▆▇█"
+
+def sparkline(values):
+    top = max(values) or 1
+    return "".join([sparkline_characters[round(x / top * (len(sparkline_characters) - 1))] for x in values])
+
+def format_seconds(seconds):
+    if seconds is None: return "-"
+    return f"{seconds * 1000:.0f} ms" if seconds < 1 else f"{seconds:.1f} s"
+
+class BusStatisticsViewer(BusStatisticsTemplate):
+    # shows the protocol's bus statistics, refreshed every second while the window is shown
+    max_rows = 20
+
+    def __init__(self, parent, lcc):
+        super().__init__(parent)
+        self.lcc = lcc
+        self.summary_text.SetFont(wx.Font(wx.FontInfo().Family(wx.FONTFAMILY_MODERN)))
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
+        self.Bind(wx.EVT_SHOW, self.on_show)
+
+    def on_show(self, evt):
+        if evt.IsShown():
+            self.refresh()
+            self.timer.Start(1000)
+        else:
+            self.timer.Stop()
+        evt.Skip()
+
+    def on_timer(self, evt):
+        self.refresh()
+
+    def refresh(self):
+        stats = self.lcc.statistics.snapshot()
+        self.summary_text.SetLabel(
+f"""Bus load {stats['bus_load'] * 100:.1f} % (last {stats['rate_window']:.0f} s)
+Received {stats['frames_rx']:.1f} frames/s, {stats['bytes_rx']:.0f} bytes/s
+Sent {stats['frames_tx']:.1f} frames/s, {stats['bytes_tx']:.0f} bytes/s
+Datagram round trip mean {format_seconds(stats['latency_mean'])}, 95 % below {format_seconds(stats['latency_p95'])}
+Frames per second, last {stats['window']} s: {sparkline(stats['frames_series'])}""")
+
+        self.fill_list(self.type_list, [(key, f"{rate:.1f}") for key, rate in stats["types"] if rate])
+        alias_to_node_id = self.lcc.alias_to_node_id
+        self.fill_list(self.source_list, [(f"0x{alias:03X}", alias_to_node_id.get(alias, ""), f"{rate:.1f}")
+            for alias, rate in stats["sources"] if rate])
+        rows = []
+        previous = 0
+        for bound, count in stats["latency"]:
+            label = f"{format_seconds(previous)} - {format_seconds(bound)}" if bound else f"> {format_seconds(previous)}"
+            rows.append((label, str(count)))
+            previous = bound
+        self.fill_list(self.latency_list, rows)
+        self.fill_list(self.error_list, [(kind, str(count)) for kind, count in stats["errors"] if count])
+        self.panel_1.Layout()
+
+    def on_record_trace(self, evt):
+        # protocol operations are traced while recording, starting again discards the previous trace
+        if self.record_trace.GetValue():
+            tracer.start()
+            self.trace_text.SetLabel("Recording")
+        else:
+            tracer.stop()
+            self.trace_text.SetLabel(f"{len(tracer.events)} trace events recorded")
+
+    def on_save_trace(self, evt):
+        dialog = wx.FileDialog(self, "Save trace", wildcard="Chrome trace files (*.json)|*.json",
+            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        if dialog.ShowModal() == wx.ID_CANCEL: return
+        try:
+            count = tracer.export(dialog.GetPath())
+        except OSError as e:
+            wx.MessageDialog(self, f"Couldn't save trace: {e}", "Error", wx.OK|wx.ICON_ERROR).ShowModal()
+            return
+        self.trace_text.SetLabel(f"Saved {count} trace events, open them in chrome://tracing or ui.perfetto.dev")
+
+    def fill_list(self, list_ctrl, rows):
+        rows = rows[:self.max_rows]
+        while list_ctrl.GetItemCount() > len(rows):
+            list_ctrl.DeleteItem(list_ctrl.GetItemCount() - 1)
+        for i, row in enumerate(rows):
+            if i >= list_ctrl.GetItemCount():
+                list_ctrl.Append(row)
+            else:
+                for column, text in enumerate(row):
+                    list_ctrl.SetItem(i, column, text)
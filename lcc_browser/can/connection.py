@@ -12,6 +12,10 @@ class Connection(Thread, ABC):
         self.loop = None
         self.protocol = protocol
         self.frame_callback = None
+        self.threaded = True # False runs the connection on the asyncio loop of the caller, see wx_asyncio
+        self.tasks = set() # tasks of a connection without thread
+        self.readable = None # set when the driver's file descriptor is readable
+        self.reader_fileno = None
 
     def set_protocol(self, protocol):
         self.protocol = protocol
@@ -32,6 +36,10 @@ class Connection(Thread, ABC):
     def receive(self):
         pass
 
+    def fileno(self):
+        # file descriptor that becomes readable when data arrives, None if the driver has to be polled
+        return None
+
     def disconnect(self):
         pass
 
@@ -39,26 +47,86 @@ class Connection(Thread, ABC):
         self.frame_callback = func
 
     async def receive_can_task(self):
-        while 1:
-            frame = self.receive()
-            if frame:
-                if self.frame_callback:
-                    self.frame_callback(frame, False)
-                self.protocol.parse_frame(frame)
-            else:
-                try:
-                    await asyncio.sleep(.01)
-                except asyncio.CancelledError:
-                    return
+        try:
+            count = 0
+            while 1:
+                frame = self.receive()
+                if frame:
+                    self.protocol.statistics.count_frame(frame, False)
+                    if self.frame_callback:
+                        self.frame_callback(frame, False)
+                    self.protocol.parse_frame(frame)
+                    count += 1
+                    if count % 32 == 0:
+                        # let other tasks run during long bursts
+                        await asyncio.sleep(0)
+                else:
+                    await self.wait_readable()
+        except asyncio.CancelledError:
+            return
+        finally:
+            self.remove_reader()
+
+    async def wait_readable(self):
+        # waits for the driver's file descriptor, polls if there's none
+        fileno = self.fileno()
+        if self.readable is None and fileno is not None:
+            readable = asyncio.Event()
+            try:
+                self.loop.add_reader(fileno, readable.set)
+                self.readable = readable
+                self.reader_fileno = fileno
+            except NotImplementedError:
+                # e.g. the proactor loop on Windows
+                pass
+        if self.readable:
+            self.readable.clear()
+            await self.readable.wait()
+        else:
+            await asyncio.sleep(.01)
+
+    def remove_reader(self):
+        if self.readable is None: return
+        self.loop.remove_reader(self.reader_fileno)
+        self.readable = None
+        self.reader_fileno = None
 
     async def run_async(self):
         self.loop = asyncio.get_running_loop()
         await asyncio.create_task(self.receive_can_task())
         
     def run(self):
-        asyncio.run(self.run_async())
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.run_async())
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    def start(self):
+        if self.threaded:
+            # the loop exists before the thread runs it, so calls can be scheduled right after start
+            self.loop = asyncio.new_event_loop()
+            super().start()
+            return
+        # the caller's loop runs the connection, no thread is started
+        self.loop = asyncio.get_running_loop()
+        self.create_task(self.receive_can_task())
+
+    def create_task(self, coroutine):
+        # task in the caller's loop that is canceled by join
+        task = self.loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
 
     def join(self, timeout=None):
+        if not self.threaded:
+            # the driver may be disconnected before the tasks handle the cancellation
+            self.remove_reader()
+            for task in list(self.tasks):
+                task.cancel()
+            return
         if self.loop:
             for task in asyncio.all_tasks(self.loop):
                 task.cancel()
@@ -14,6 +14,7 @@ class UsbcanZhouLigong(Connection):
         self.devices = []
         self.parameters_panel = None
         self.ser = None
+        self.rx_buffer = bytearray() # start of a frame whose remaining bytes haven't arrived yet
 
     def create_parameters_panel(self, parent):
         """ generates a GUI for the user to select connection parameters """
@@ -76,6 +77,7 @@ class UsbcanZhouLigong(Connection):
 
         #empty buffer for sync
         self.ser.read(4096)
+        self.rx_buffer = bytearray()
         return True
 
     def disconnect(self):
@@ -95,24 +97,31 @@ class UsbcanZhouLigong(Connection):
         buffer += bytes(16-len(buffer))
         self.ser.write(buffer)
 
+    def fileno(self):
+        # serial ports have a file descriptor on POSIX systems only
+        try:
+            return self.ser.fileno()
+        except (AttributeError, serial.serialutil.SerialException):
+            return None
+
     def receive(self):
         # tries to receive one can frame
+        # the serial port is non-blocking, a partial frame is kept until the next call
         try:
-            buffer = self.ser.read(16)
+            self.rx_buffer += self.ser.read(16 - len(self.rx_buffer))
         except serial.serialutil.SerialException as e:
             print("Could not read from serial port:", e)
             return None
-        if len(buffer) == 0: return None
-        if buffer[0] != 0xaa:
-            print('lost sync?', hex(buffer[0]))
+        if len(self.rx_buffer) == 0: return None
+        if self.rx_buffer[0] != 0xaa:
+            print('lost sync?', hex(self.rx_buffer[0]))
+            # continue at the next start byte
+            start = self.rx_buffer.find(0xaa, 1)
+            self.rx_buffer = self.rx_buffer[start:] if start >= 0 else bytearray()
             return None
-        if len(buffer) < 16:
-            # partial data: give data some more time to arrive, then give up
-            sleep(.05)
-            buffer += self.ser.read(16 - len(buffer))
-            if len(buffer) < 16:
-                print(f"CAN buffer length {len(buffer)} should be at least 16. Ignoring data")
-                return None
+        if len(self.rx_buffer) < 16: return None
+        buffer = bytes(self.rx_buffer)
+        self.rx_buffer = bytearray()
         is_extended = buffer[1]
         is_remote = buffer[2]
         data_len = buffer[3]
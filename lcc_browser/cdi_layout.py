@@ -0,0 +1,442 @@
+""" Compiles CDI XML into a flat memory layout that doesn't depend on wx."""
+import hashlib
+from lxml import etree
+from lcc_browser.xml_to_dict import etree_to_dict
+
+def get_integer(d, name):
+    res = d.get(name)
+    if res is not None:
+        try:
+            res = int(res)
+        except:
+            print(f"Could not convert {res} to integer.")
+            res = None
+    return res
+
+def get_map(element):
+    map = element.get("map")
+    if not map: return None
+    relations = map.get("relation", [])
+    if type(relations) != list: relations = [relations]
+    return {x.get("property"): x.get("value") for x in relations}
+
+class CdiField:
+    # a CDI leaf (int, string or eventid) at a fixed location in node memory
+    __slots__ = (
+        "type", # int, string or eventid
+        "name", "description",
+        "heading", # hierarchical number shown to the user, unique within a CDI
+        "path", # names of enclosing segment and groups, unique within a CDI
+        "space",
+        "address", # absolute address of the first replication
+        "size",
+        "replications", # (group index, count, stride) of enclosing replicated groups, outermost first
+        "map", "min", "max", "default",
+        "group", # index of enclosing group
+    )
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+    def get_address(self, indices=None):
+        # absolute address for a vector of replication indices, outermost group first
+        address = self.address
+        if indices:
+            for (group, count, stride), i in zip(self.replications, indices):
+                address += i * stride
+        return address
+
+    def replication_indices(self):
+        # all index vectors of this field in memory order
+        vectors = [()]
+        for group, count, stride in self.replications:
+            vectors = [v + (i,) for v in vectors for i in range(count)]
+        return vectors
+
+    def key(self, indices=None):
+        # CDI path of a single replication, numbers count from 1 like in the GUI
+        if not indices: return self.path
+        return self.path + "[" + ",".join([str(i + 1) for i in indices]) + "]"
+
+    def addresses(self):
+        # absolute address of every replication of this field
+        return [self.get_address(v) for v in self.replication_indices()]
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class CdiGroup:
+    # a CDI segment or group
+    __slots__ = (
+        "name", "description", "repnames",
+        "replication", # None if the group doesn't have a replication attribute
+        "heading", "path", "level",
+        "space",
+        "address", # absolute address of the first replication
+        "size", # size of a single replication
+        "parent", # index of enclosing group, None for segments
+        "children", # list of ("group", index) and ("field", index)
+    )
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class CdiLayout:
+    # flat, serialisable table of a node's configuration memory
+    def __init__(self):
+        self.groups = []
+        self.fields = []
+        self.segments = [] # indices of <segment> groups in document order
+        self.acdi = [] # indices of groups generated for <acdi>
+        self.identification = {}
+        self.digest = None
+        self.dtypes = {} # group index -> numpy dtype, built on demand
+
+    def iter_fields(self, group_index):
+        # all fields below a group, depth first
+        for kind, index in self.groups[group_index].children:
+            if kind == "field":
+                yield index
+            else:
+                yield from self.iter_fields(index)
+
+    def group_dtype(self, group_index):
+        # numpy structured dtype of a single replication of a group
+        # ints are big-endian, strings fixed-size bytes, event ids 8-byte integers
+        # nested replicated groups are sub-arrays, numpy is only needed when this is called
+        dtype = self.dtypes.get(group_index)
+        if dtype is not None: return dtype
+        import numpy as np
+        group = self.groups[group_index]
+        names, formats, offsets = [], [], []
+        def add(name, format, address):
+            name = name or f"_{len(names)}"
+            if name in names: name = f"{name}_{len(names)}"
+            names.append(name)
+            formats.append(format)
+            offsets.append(address - group.address)
+        for kind, index in group.children:
+            if kind == "field":
+                field = self.fields[index]
+                if field.type == "string":
+                    format = f"S{field.size}"
+                elif field.size in (1, 2, 4, 8):
+                    format = f">u{field.size}"
+                else:
+                    format = f"V{field.size}" # unusual integer sizes stay raw bytes
+                add(field.name, format, field.address)
+            else:
+                child = self.groups[index]
+                shape = child.replication if child.replication is not None else 1
+                format = (self.group_dtype(index), (shape,)) if shape != 1 else self.group_dtype(index)
+                add(child.name, format, child.address)
+        dtype = np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": group.size})
+        self.dtypes[group_index] = dtype
+        return dtype
+
+    def group_block(self, group_index):
+        # (space, address, size) of the memory of all replications of a group
+        group = self.groups[group_index]
+        count = group.replication if group.replication is not None else 1
+        return group.space, group.address, group.size * count
+
+    def decode_group(self, group_index, data):
+        # decodes the memory block of a group, all replications at once, into a structured array
+        import numpy as np
+        group = self.groups[group_index]
+        dtype = self.group_dtype(group_index)
+        count = min(group.replication if group.replication is not None else 1, len(data) // dtype.itemsize)
+        return np.frombuffer(data, dtype=dtype, count=count)
+
+    def space_extents(self):
+        # space -> (lowest address, end address) of the memory described by the CDI
+        extents = {}
+        for field in self.fields:
+            end = field.address + field.size
+            for group, count, stride in field.replications:
+                end += (count - 1) * stride
+            lowest, highest = extents.get(field.space, (field.address, end))
+            extents[field.space] = (min(lowest, field.address), max(highest, end))
+        return extents
+
+    def to_dict(self):
+        return {
+            "groups": [x.to_dict() for x in self.groups],
+            "fields": [x.to_dict() for x in self.fields],
+            "segments": self.segments,
+            "acdi": self.acdi,
+            "identification": self.identification,
+            "digest": self.digest,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        layout = cls()
+        for g in d["groups"]:
+            group = CdiGroup(**g)
+            group.children = [tuple(x) for x in group.children]
+            layout.groups.append(group)
+        for f in d["fields"]:
+            field = CdiField(**f)
+            field.replications = tuple(tuple(x) for x in field.replications)
+            layout.fields.append(field)
+        layout.segments = d["segments"]
+        layout.acdi = d["acdi"]
+        layout.identification = d["identification"]
+        layout.digest = d["digest"]
+        return layout
+
+class CdiCompiler:
+    # turns CDI xml elements into a CdiLayout
+    # segments can be added one at a time, e.g. while the CDI is still being downloaded
+    def __init__(self):
+        self.layout = CdiLayout()
+        self.root_child_count = 0
+        self.paths = set()
+        self.stack = [] # open groups, each [group index, child count, size, replications]
+
+    def heading(self, next=False):
+        numbers = [self.root_child_count] + [x[1] for x in self.stack]
+        if next: numbers[-1] += 1
+        return ".".join([str(x) for x in numbers])
+
+    def unique_path(self, name, heading):
+        parent = self.layout.groups[self.stack[-1][0]].path + "/" if self.stack else ""
+        path = parent + (name if name else heading)
+        if path in self.paths:
+            path += f" ({heading})"
+        self.paths.add(path)
+        return path
+
+    def begin_group(self, name, description, repnames, replication, space, address):
+        if self.stack:
+            self.stack[-1][1] += 1
+            parent = self.stack[-1][0]
+            level = len(self.stack) + 1
+            replications = self.stack[-1][3]
+        else:
+            self.root_child_count += 1
+            parent = None
+            level = 1
+            replications = ()
+        heading = self.heading()
+        group = CdiGroup(name=name, description=description, repnames=repnames, replication=replication,
+            heading=heading, path=None, level=level, space=space, address=address, size=0,
+            parent=parent, children=[])
+        index = len(self.layout.groups)
+        self.layout.groups.append(group)
+        group.path = self.unique_path(name, heading)
+        count = replication if replication else 1
+        if count > 1:
+            replications = replications + ((index, count, 0),) # stride is known at end of group
+        self.stack.append([index, 0, 0, replications])
+        return index
+
+    def end_group(self):
+        index, child_count, size, replications = self.stack.pop()
+        group = self.layout.groups[index]
+        group.size = size
+        if replications and replications[-1][0] == index:
+            # now that the stride is known, fix up all fields of this group
+            fixed = replications[-1][:2] + (size,)
+            for i in self.layout.iter_fields(index):
+                field = self.layout.fields[i]
+                r = list(field.replications)
+                r[len(replications)-1] = fixed
+                field.replications = tuple(r)
+        count = group.replication if group.replication else 1
+        if self.stack:
+            self.stack[-1][2] += size * count
+        if child_count == 0:
+            # remove empty group from numbering system, it doesn't contain any fields
+            if self.stack:
+                self.stack[-1][1] -= 1
+            else:
+                self.root_child_count -= 1
+            del self.layout.groups[index:]
+            return None
+        if self.stack:
+            self.layout.groups[self.stack[-1][0]].children.append(("group", index))
+        return index
+
+    def add_field(self, type, name, description, offset, size, map=None, min=None, max=None, default=None):
+        current = self.stack[-1]
+        if offset: current[2] += offset
+        group = self.layout.groups[current[0]]
+        address = group.address + current[2]
+        current[2] += size
+        heading = self.heading(next=True)
+        current[1] += 1
+        field = CdiField(type=type, name=name, description=description, heading=heading,
+            path=self.unique_path(name, heading), space=group.space, address=address, size=size,
+            replications=current[3], map=map, min=min, max=max, default=default, group=current[0])
+        index = len(self.layout.fields)
+        self.layout.fields.append(field)
+        group.children.append(("field", index))
+        return index
+
+    def add_segment(self, segment_xml):
+        # compiles a <segment> element, returns the group index or None if it's empty
+        space = get_integer(segment_xml.attrib, "space")
+        origin = get_integer(segment_xml.attrib, "origin")
+        return self.add_group(segment_xml, space, origin if origin else 0)
+
+    def add_group(self, group_xml, space, address=None):
+        # address is only given for segments, groups are placed after their predecessor
+        replication = get_integer(group_xml.attrib, "replication")
+        if replication == 0:
+            print("CDI replication is set to 0. Ignoring this section.")
+            return None
+        if address is None:
+            current = self.stack[-1]
+            offset = get_integer(group_xml.attrib, "offset")
+            if offset: current[2] += offset
+            address = self.layout.groups[current[0]].address + current[2]
+        children = list(group_xml)
+        name = None
+        description = None
+        repnames = []
+        for element in children:
+            if element.tag == "name":
+                name = element.text
+            elif element.tag == "description":
+                description = element.text
+            elif element.tag == "repname":
+                repnames.append(element.text)
+        self.begin_group(name, description, repnames, replication, space, address)
+
+        for element in children:
+            tag = element.tag
+            if tag == "group":
+                self.add_group(element, space)
+            elif tag in ["int", "string", "eventid"]:
+                self.add_leaf(element)
+
+        return self.end_group()
+
+    def add_leaf(self, element):
+        tag = element.tag
+        d = etree_to_dict(element)[tag]
+        if type(d) != dict: d = {}
+        offset = get_integer(d, "@offset")
+        size = get_integer(d, "@size")
+        name = d.get("name")
+        description = d.get("description")
+        if tag == "string":
+            assert size, "CDI string without size"
+            return self.add_field("string", name, description, offset, size, get_map(d))
+        elif tag == "int":
+            if size is None: size = 1
+            return self.add_field("int", name, description, offset, size, get_map(d),
+                get_integer(d, "min"), get_integer(d, "max"), get_integer(d, "default"))
+        elif tag == "eventid":
+            return self.add_field("eventid", name, description, offset, 8)
+
+    def add_acdi(self, acdi_xml):
+        # abbreviated default CDI, see ACDI standard
+        # acdi groups aren't part of the segment numbering
+        root_child_count = self.root_child_count
+        self.root_child_count = 0
+        first_field = len(self.layout.fields)
+        first_group = len(self.layout.groups)
+        fixed = get_integer(acdi_xml.attrib, "fixed")
+        if fixed is None or fixed >= 4:
+            self.begin_group("Manufacturer information", None, [], None, 252, 0)
+            self.add_field("int", "Version of fixed fields", None, 0, 1)
+            self.add_field("string", "Manufacturer", None, 0, 41)
+            self.add_field("string", "Model", None, 0, 41)
+            self.add_field("string", "Hardware version", None, 0, 21)
+            self.add_field("string", "Software version", None, 0, 21)
+            self.layout.acdi.append(self.end_group())
+
+        var = get_integer(acdi_xml.attrib, "var")
+        if var is None or var >= 2:
+            self.begin_group("User information", None, [], None, 251, 0)
+            self.add_field("int", "Version of variable fields", None, 0, 1)
+            self.add_field("string", "User-supplied name", None, 0, 63)
+            self.add_field("string", "User-supplied description", None, 0, 64)
+            self.layout.acdi.append(self.end_group())
+
+        for record in self.layout.fields[first_field:] + self.layout.groups[first_group:]:
+            record.heading = "ID." + record.heading
+        self.root_child_count = root_child_count
+
+    def add_element(self, element):
+        # compiles one top level CDI element
+        if element.tag == "identification":
+            identification = etree_to_dict(element).get("identification")
+            if type(identification) == dict:
+                self.layout.identification = identification
+        elif element.tag == "acdi":
+            self.add_acdi(element)
+        elif element.tag == "segment":
+            index = self.add_segment(element)
+            if index is not None:
+                self.layout.segments.append(index)
+            return index
+
+class CdiStreamCompiler(CdiCompiler):
+    # compiles CDI xml while it's being downloaded
+    # top level elements are compiled as soon as they are closed
+    def __init__(self):
+        super().__init__()
+        self.parser = etree.XMLPullParser(events=("start", "end"))
+        self.depth = 0
+        self.hash = hashlib.sha1()
+        self.is_complete = False # set when the terminating null byte was received
+
+    def feed(self, data):
+        # returns the group indices of segments that were completed by this chunk of data
+        if self.is_complete: return []
+        idx = data.find(b"\0")
+        if idx >= 0:
+            data = data[:idx]
+            self.is_complete = True
+        self.hash.update(data)
+        self.parser.feed(data)
+        return self.compile_events()
+
+    def compile_events(self):
+        segments = []
+        for event, element in self.parser.read_events():
+            if event == "start":
+                self.depth += 1
+                continue
+            self.depth -= 1
+            if self.depth != 1: continue
+            index = self.add_element(element)
+            if element.tag == "segment" and index is not None:
+                segments.append(index)
+            # drop the xml of compiled elements
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+        return segments
+
+    def close(self):
+        # returns the completed layout
+        self.parser.close()
+        self.compile_events()
+        self.layout.digest = self.hash.hexdigest()
+        layout_cache[self.layout.digest] = self.layout
+        return self.layout
+
+def cdi_digest(cdi):
+    return hashlib.sha1(cdi.split(b"\0")[0]).hexdigest()
+
+layout_cache = {} # CDI digest -> CdiLayout
+
+def compile_cdi(cdi):
+    # compiles CDI xml bytes, layouts of identical CDIs are shared
+    # this doesn't touch wx and may run in any thread
+    layout = layout_cache.get(cdi_digest(cdi))
+    if layout: return layout
+
+    compiler = CdiStreamCompiler()
+    compiler.feed(cdi)
+    return compiler.close()
@@ -1,32 +1,25 @@
 import traceback
+from lcc_browser.cdi_layout import CdiField
+from lcc_browser.ui_bridge import ui_bridge
 
 class CdiEntry:
-    # linked list of hierarchical CDI groups & fields
-    def __init__(self, registry, name, space, offset, size=0, parent=None, window=None):
-        self.space = space
-        self.offset = offset # this is an absolute address for root, and for other entries an offset relative to parent
-        self.size = size # field size for leaves or group / size of a single replication of group
+    # binds a compiled CDI record (group or field) to its wx control
+    def __init__(self, registry, record, parent=None, window=None):
+        self.record = record
+        self.space = record.space
+        self.size = record.size # field size for leaves or group / size of a single replication of group
+        self.name = record.heading
         self.window = window # data entry control for value, or replication entry control in case of group
-        self.parent = parent # None if this is root
-        self.child_count = 0 # used to calculate hieararchical headings
+        self.parent = parent # None if this is a segment
         self.children = []
-        self.name = name
         self.registry = registry
 
+    def is_leaf(self):
+        return isinstance(self.record, CdiField)
+
     def get_address(self):
-        # of first replication
-        address = 0
-        group = self.parent
-        while group:
-            if group.window:
-                replication_idx = group.window.GetValue()
-                if replication_idx is None: return
-                replication_idx = int(replication_idx)
-            else:
-                replication_idx = 0
-            address += group.offset + replication_idx * group.size
-            group = group.parent 
-        return address + self.offset
+        # absolute address of the replications that are currently selected
+        return self.registry.get_address(self)
 
     def read(self):
         self.registry.read_memory(self)
@@ -35,95 +28,67 @@ class CdiEntry:
         self.registry.write_memory(self, value)
 
 class CdiRegistry:
-    def __init__(self, lcc, node_alias, status_callback=None):
-        self.entries = []
+    # memory locations of a node, generated from a compiled CDI layout
+    def __init__(self, lcc, node_alias, layout, status_callback=None):
         self.lcc = lcc
         self.node_alias = node_alias
-        self.set_status = lambda: None
+        self.layout = layout
+        self.set_status = lambda status: None
         if status_callback: self.set_status = status_callback
 
-        # used during parsing
-        root = CdiEntry(self, "Root", 0, 0) # dummy element
-        self.current_groups = [root]
-
-
-    def begin_group(self, offset, space):
-        parent = self.current_group()
-        name = self.current_heading()
-        parent.child_count += 1
-        if space is None: space = self.current_space()
-
-        if space == parent.space:
-            # group element
-            if offset: parent.size += offset
-            offset_in_group = self.current_groups[-1].size
-        else:
-            # segment root element
-            offset_in_group = offset
-
-        entry = CdiEntry(self, name, space, offset_in_group, parent=parent)
-        self.current_groups.append(entry)
-        parent.children.append(entry)
-    
-    def end_group(self, replication):
-        if replication is None: replication = 1
-        group = self.current_groups[-1]
-        if group.child_count == 0:
-            # remove empty group from numbering system
-            self.current_groups[-2].child_count -= 1
-            self.current_groups[-2].children.pop()
-        self.current_groups[-2].size += group.size * replication
-        self.current_groups.pop()
-
-    def level(self):
-        return len(self.current_groups) - 1
-
-    def parent_heading(self):
-        parents = self.current_groups[:-1]
-        numbers = [x.child_count for x in parents]
-        return ".".join([str(x) for x in numbers])
-
-    def next_heading(self):
-        parents = self.current_groups
-        numbers = [x.child_count for x in parents]
-        numbers[-1] += 1
-        return ".".join([str(x) for x in numbers])
-
-    def current_heading(self):
-        parents = self.current_groups
-        numbers = [x.child_count for x in parents]
-        return ".".join([str(x) for x in numbers])
-
-    def current_group(self):
-        return self.current_groups[-1]
-
-    def current_space(self):
-        return self.current_groups[-1].space
-
-    def current_offset(self):
-        return self.current_groups[-1].size
-
-    def add_leaf(self, offset, size, ctrl=None, name=None):
-        # both offset and size affect group size
-        if offset: self.current_groups[-1].size += offset
-        offset_in_group = self.current_groups[-1].size
-        if size: self.current_groups[-1].size += size
-
-        parent = self.current_groups[-1]
-        if name is None:
-            name = self.next_heading()
-        parent.child_count += 1
-        entry = CdiEntry(self, name, self.current_space(), offset_in_group, size, parent, ctrl)
-        self.entries.append(entry)
-        parent.children.append(entry)
-        return entry
+        self.replication_selection = {} # group index -> selected replication index
+        self.addresses = {} # leaf -> address of currently selected replications
+        self.address_cache = {} # (leaf, replication index vector) -> address
+        self.groups = {} # group index -> entry
+        self.fields = {} # field index -> entry
+        self.entries = [] # leaves in document order
+        self.update_entries(len(layout.groups), len(layout.fields))
+
+    def update_entries(self, group_count, field_count):
+        # adds entries for groups and fields that were compiled since the last update
+        # the layout may still be growing while the CDI is downloaded
+        new_groups = range(len(self.groups), group_count)
+        for index in new_groups:
+            group = self.layout.groups[index]
+            self.groups[index] = CdiEntry(self, group, self.groups.get(group.parent))
+        for index in range(len(self.fields), field_count):
+            field = self.layout.fields[index]
+            entry = CdiEntry(self, field, self.groups[field.group])
+            self.fields[index] = entry
+            self.entries.append(entry)
+        lookup = {"group": self.groups, "field": self.fields}
+        for index in new_groups:
+            group = self.layout.groups[index]
+            self.groups[index].children = [lookup[kind][i] for kind, i in group.children]
+
+    def get_address(self, entry):
+        # resolved without touching any controls, so it's safe to call from the connection thread
+        address = self.addresses.get(entry)
+        if address is not None: return address
+        record = entry.record
+        if not entry.is_leaf(): return record.address
+        indices = tuple(self.replication_selection.get(group, 0) for group, count, stride in record.replications)
+        key = (entry, indices)
+        address = self.address_cache.get(key)
+        if address is None:
+            address = record.get_address(indices)
+            self.address_cache[key] = address
+        self.addresses[entry] = address
+        return address
+
+    def set_replication(self, group_index, replication_idx):
+        # called when a replication selector changes
+        if self.replication_selection.get(group_index, 0) == replication_idx: return
+        self.replication_selection[group_index] = replication_idx
+        for i in self.layout.iter_fields(group_index):
+            self.addresses.pop(self.fields[i], None)
 
     async def read_memory_async(self, entry):
         try:
             result = await self.lcc.read_memory_configuration(self.node_alias, entry.space, entry.get_address(), entry.size)
             if len(result) != entry.size:
                 print(f"Error: Node returned invalid data for field {entry.name} (actual size {len(result)}, expected {entry.size})")
-            entry.window.set_raw_value(result)
+            if entry.window: ui_bridge.call(entry.window, entry.window.set_raw_value, result)
             return result
         except Exception as e:
             print(e)
@@ -137,7 +102,7 @@ class CdiRegistry:
     async def write_memory_async(self, entry, data):
         try:
             await self.lcc.write_memory_configuration(self.node_alias, entry.space, entry.get_address(), data)
-            entry.window.set_raw_value(data)
+            if entry.window: ui_bridge.call(entry.window, entry.window.set_raw_value, data)
         except Exception as e:
             print(e)
             print(traceback.format_exc())
@@ -147,15 +112,32 @@ class CdiRegistry:
         async_func = self.write_memory_async(entry, data)
         self.lcc.run_future(async_func)
 
+    def visible_entries(self, entry=None):
+        # leaves below a group (or all leaves) that have a control
+        if entry is None:
+            return [x for x in self.entries if x.window]
+        result = []
+        children = [*entry.children]
+        while children:
+            child = children.pop(0)
+            if child.is_leaf():
+                if child.window: result.append(child)
+            else:
+                children = child.children + children
+        return result
+
     async def read_group_memory_async(self, entry):
         # traverse group tree and read currently selected memory
-        children = [*entry.children]
-        while child := children.pop():
-            children += child.children
-            if child.child_count == 0:
-                # it's a leaf
-                await self.read_memory_async(child)
+        for child in self.visible_entries(entry):
+            await self.read_memory_async(child)
 
     def read_group_memory(self, entry):
         async_func = self.read_group_memory_async(entry)
         self.future, self.cancel_future = self.lcc.run_future(async_func)
+
+    def read_visible_memory(self, entry):
+        # reads the values of newly created controls, if there's a connection
+        try:
+            self.lcc.run_future(self.read_group_memory_async(entry))
+        except RuntimeError as e:
+            self.set_status(str(e))
@@ -0,0 +1,187 @@
+""" Configuration templates, captured from one node and applied to many nodes with the same CDI."""
+import json
+import string
+from lcc_browser.cdi_layout import compile_cdi
+from lcc_browser.node_inventory import inventory
+from lcc_browser.layout_backup import diff_ranges, run_per_node, merge_gap
+
+template_format = 1
+
+def decode_value(field, data):
+    if field.type == "int":
+        return int.from_bytes(data, "big")
+    if field.type == "eventid":
+        return ".".join([f"{x:02X}" for x in data])
+    return bytes(data).split(b"\0")[0].decode("utf-8", errors="replace")
+
+def encode_value(field, value):
+    if field.type == "int":
+        return int(value).to_bytes(field.size, "big")
+    if field.type == "eventid":
+        data = bytearray.fromhex(str(value).replace(".", ""))
+        if len(data) != 8: raise ValueError(f"Invalid event id {value} for {field.path}")
+        return bytes(data)
+    data = str(value).encode("utf-8")[:field.size - 1]
+    return data + bytes(field.size - len(data))
+
+def template_fields(layout, paths=None):
+    # fields of the configuration segments, optionally only those below the given paths
+    acdi = set()
+    for group_index in layout.acdi:
+        acdi.update(layout.iter_fields(group_index))
+    for index, field in enumerate(layout.fields):
+        if index in acdi: continue
+        if paths and not any(field.path == p or field.path.startswith(p + "/") for p in paths): continue
+        yield field
+
+def space_spans(fields):
+    # space -> (lowest address, end address) of all replications of the fields
+    spans = {}
+    for field in fields:
+        for address in field.addresses():
+            lowest, end = spans.get(field.space, (address, address + field.size))
+            spans[field.space] = (min(lowest, address), max(end, address + field.size))
+    return spans
+
+class CdiTemplate:
+    # field values keyed by CDI path
+    # values may contain placeholders that are substituted per node, e.g. {node_id} or {name}
+    # event ids that start with the captured node's id are stored as {node_id}.xx.xx
+    def __init__(self, cdi_digest, values, parameters=None):
+        self.cdi_digest = cdi_digest
+        self.values = values # key -> int, str or event id
+        self.parameters = parameters or {} # node id -> {name: value}
+
+    def to_dict(self):
+        return {"format": template_format, "cdi_digest": self.cdi_digest, "values": self.values, "parameters": self.parameters}
+
+    @classmethod
+    def from_dict(cls, d):
+        if d.get("format") != template_format:
+            raise ValueError(f"Unsupported template format {d.get('format')}")
+        return cls(d["cdi_digest"], d["values"], d.get("parameters"))
+
+    def save(self, filename):
+        with open(filename, "w") as stream:
+            json.dump(self.to_dict(), stream, indent=2)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r") as stream:
+            return cls.from_dict(json.load(stream))
+
+    def render(self, layout, node_id, parameters=None):
+        # space -> {address: bytes} for a node
+        mapping = {"node_id": node_id} | self.parameters.get(node_id, {}) | (parameters or {})
+        formatter = string.Formatter()
+        patches = {}
+        for field in template_fields(layout):
+            for indices in field.replication_indices():
+                value = self.values.get(field.key(indices))
+                if value is None: continue
+                if isinstance(value, str):
+                    value = formatter.vformat(value, (), mapping)
+                patches.setdefault(field.space, {})[field.get_address(indices)] = encode_value(field, value)
+        return patches
+
+async def read_images(lcc, node_alias, spans):
+    # space -> (address, data) for the given spans
+    images = {}
+    for space, (lowest, end) in spans.items():
+        images[space] = (lowest, await lcc.read_memory_configuration(node_alias, space, lowest, end - lowest))
+    return images
+
+async def capture_template(registry, paths=None):
+    # reads the configuration of the registry's node and returns it as template
+    layout = registry.layout
+    lcc = registry.lcc
+    node_id = lcc.alias_to_node_id.get(registry.node_alias)
+    fields = list(template_fields(layout, paths))
+    images = await read_images(lcc, registry.node_alias, space_spans(fields))
+    values = {}
+    for field in fields:
+        lowest, image = images[field.space]
+        for indices in field.replication_indices():
+            offset = field.get_address(indices) - lowest
+            data = image[offset:offset + field.size]
+            if len(data) != field.size: continue
+            value = decode_value(field, data)
+            if field.type == "eventid" and node_id and value.startswith(node_id + "."):
+                value = "{node_id}" + value[len(node_id):]
+            elif isinstance(value, str):
+                value = value.replace("{", "{{").replace("}", "}}")
+            values[field.key(indices)] = value
+    return CdiTemplate(layout.digest, values)
+
+async def get_node_layout(lcc, node_id, node_alias):
+    # compiled CDI of a node, downloaded if it isn't in the inventory yet
+    layout = inventory.get_cdi_layout((inventory.get(node_id) or {}).get("cdi_digest"))
+    if layout: return layout
+    cdi = await lcc.read_cdi(node_alias)
+    if not cdi: raise RuntimeError("Couldn't read CDI")
+    layout = compile_cdi(cdi)
+    inventory.set_cdi_layout(node_id, layout)
+    return layout
+
+async def apply_template(lcc, template, node_ids, parameters=None, concurrency=4, verify=True, progress_callback=None):
+    # writes the template to many nodes at the same time
+    # fields are coalesced per space and only bytes that differ from the node's memory are written
+    # returns a report {node_id: {"seconds", "bytes", "ranges", "verified", "skipped", "error"}}, see layout_backup.format_report
+
+    async def apply_node(node_id):
+        alias = lcc.node_id_to_alias.get(node_id)
+        if alias is None: raise RuntimeError("Node isn't on the bus")
+        if progress_callback: progress_callback(node_id, "checking CDI")
+        layout = await get_node_layout(lcc, node_id, alias)
+        if layout.digest != template.cdi_digest:
+            raise RuntimeError("Node has a different CDI than the template")
+        patches = template.render(layout, node_id, (parameters or {}).get(node_id))
+
+        written = 0
+        range_count = 0
+        mismatches = []
+        skipped = []
+        for space, space_patches in patches.items():
+            # read the memory around the fields once, patch it and write the differences
+            lowest = min(space_patches)
+            end = max(address + len(data) for address, data in space_patches.items())
+            if progress_callback: progress_callback(node_id, f"reading space 0x{space:02X}")
+            live = await lcc.read_memory_configuration(alias, space, lowest, end - lowest)
+            image = bytearray(live)
+            for address, data in space_patches.items():
+                if address - lowest + len(data) > len(live):
+                    # short read, the field is beyond the end of the space
+                    skipped.append(f"0x{space:02X}:0x{address:X}")
+                    continue
+                image[address - lowest:address - lowest + len(data)] = data
+            ranges = diff_ranges(live, image, merge_gap)
+            for offset, size in ranges:
+                if progress_callback: progress_callback(node_id, f"writing space 0x{space:02X} at 0x{lowest+offset:X}")
+                await lcc.write_memory_configuration(alias, space, lowest + offset, bytes(image[offset:offset+size]))
+                written += size
+            range_count += len(ranges)
+            if verify:
+                for offset, size in ranges:
+                    data = await lcc.read_memory_configuration(alias, space, lowest + offset, size)
+                    if data != image[offset:offset+size]:
+                        mismatches.append(f"0x{space:02X}:0x{lowest+offset:X}")
+        if progress_callback: progress_callback(node_id, "done")
+        result = {"bytes": written, "ranges": range_count}
+        if verify: result["verified"] = not mismatches
+        if mismatches: result["mismatches"] = mismatches
+        if skipped: result["skipped"] = skipped
+        return result
+
+    return await run_per_node(node_ids, apply_node, concurrency)
+
+def matching_nodes(lcc, template):
+    # all nodes on the bus with "match", "unknown" or "different" CDI, known matches first
+    # nodes whose CDI isn't downloaded yet are offered as well, apply_template checks the CDI of every node
+    known = inventory.load()
+    result = {}
+    for node_id in list(lcc.node_id_to_alias):
+        digest = known.get(node_id, {}).get("cdi_digest")
+        if digest is None: result[node_id] = "unknown"
+        else: result[node_id] = "match" if digest == template.cdi_digest else "different"
+    order = ["match", "unknown", "different"]
+    return dict(sorted(result.items(), key=lambda x: (order.index(x[1]), x[0])))
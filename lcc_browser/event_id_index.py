@@ -0,0 +1,128 @@
+""" Reverse index from event id to the configuration fields that hold it."""
+from bisect import bisect_left
+from threading import Lock
+from lcc_browser.node_inventory import inventory
+from lcc_browser.layout_backup import read_archive
+
+class EventSlots:
+    # addresses of all eventid fields of a layout, sorted per space for bisection
+    # shared by all nodes with the same CDI
+    def __init__(self, layout):
+        slots = {}
+        for field in layout.fields:
+            if field.type != "eventid": continue
+            for indices in field.replication_indices():
+                slots.setdefault(field.space, []).append((field.get_address(indices), field, indices))
+        self.addresses = {}
+        self.slots = {}
+        for space, entries in slots.items():
+            entries.sort(key=lambda x: x[0])
+            self.addresses[space] = [x[0] for x in entries]
+            self.slots[space] = entries
+
+    def overlapping(self, space, address, size):
+        # slots that overlap [address, address+size)
+        addresses = self.addresses.get(space)
+        if not addresses: return []
+        start = bisect_left(addresses, address - 7)
+        end = bisect_left(addresses, address + size)
+        return self.slots[space][start:end]
+
+class EventIdIndex:
+    # event id (int) -> {(node_id, space, address)}
+    # fed by memory that's read from or written to nodes, so it's always as fresh as the last access
+    def __init__(self):
+        self.lcc = None
+        self.lock = Lock()
+        self.layout_slots = {} # cdi digest -> EventSlots
+        self.node_slots = {} # node_id -> EventSlots, None if the CDI isn't known
+        self.values = {} # (node_id, space, address) -> event id
+        self.index = {} # event id -> {(node_id, space, address): (path, indices)}
+        self.live = set() # keys read from or written to a node in this session, archives don't replace them
+
+    def attach(self, lcc):
+        if self.lcc: self.lcc.remove_memory_listener(self.on_memory)
+        self.lcc = lcc
+        lcc.add_memory_listener(self.on_memory)
+
+    def get_slots(self, node_id):
+        # called from the connection thread and while an archive is loaded
+        with self.lock:
+            if node_id in self.node_slots: return self.node_slots[node_id]
+        layout = inventory.get_cdi_layout((inventory.get(node_id) or {}).get("cdi_digest"))
+        # nodes without CDI are looked up again later, their CDI may be downloaded
+        if not layout: return None
+        with self.lock:
+            slots = self.layout_slots.get(layout.digest)
+            if slots is None:
+                slots = self.layout_slots[layout.digest] = EventSlots(layout)
+            self.node_slots[node_id] = slots
+        return slots
+
+    def forget_layout(self, node_id):
+        # called when a node's CDI changed
+        with self.lock:
+            self.node_slots.pop(node_id, None)
+            for key in [x for x in self.values if x[0] == node_id]:
+                self.remove_value(key)
+            self.live = {x for x in self.live if x[0] != node_id}
+
+    def on_memory(self, dst_alias, space, address, data):
+        node_id = self.lcc.alias_to_node_id.get(dst_alias)
+        if node_id is not None:
+            self.update(node_id, space, address, data, live=True)
+
+    def update(self, node_id, space, address, data, live=False):
+        # archived data (live=False) doesn't replace values that were seen on the node
+        slots = self.get_slots(node_id)
+        if slots is None: return
+        end = address + len(data)
+        with self.lock:
+            for slot_address, field, indices in slots.overlapping(space, address, len(data)):
+                key = (node_id, space, slot_address)
+                if live: self.live.add(key)
+                elif key in self.live: continue
+                if slot_address >= address and slot_address + 8 <= end:
+                    value = data[slot_address - address:slot_address - address + 8]
+                else:
+                    # partial update of a slot, merged with the known value
+                    old = self.values.get(key)
+                    if old is None: continue
+                    value = bytearray(old.to_bytes(8, "big"))
+                    for i in range(max(address, slot_address), min(end, slot_address + 8)):
+                        value[i - slot_address] = data[i - address]
+                self.set_value(key, int.from_bytes(value, "big"), field, indices)
+
+    def set_value(self, key, event_id, field, indices):
+        old = self.values.get(key)
+        if old == event_id: return
+        if old is not None: self.remove_value(key)
+        self.values[key] = event_id
+        self.index.setdefault(event_id, {})[key] = (field.path, indices)
+
+    def remove_value(self, key):
+        old = self.values.pop(key)
+        entries = self.index.get(old)
+        if entries is None: return
+        entries.pop(key, None)
+        if not entries: del self.index[old]
+
+    def lookup(self, event_id):
+        # [(node_id, CDI path, replication indices)] of the fields that hold the event id
+        if not isinstance(event_id, int):
+            event_id = int(str(event_id).replace(".", ""), 16)
+        with self.lock:
+            entries = list(self.index.get(event_id, {}).items())
+        return sorted([(key[0], path, indices) for key, (path, indices) in entries])
+
+    def load_archive(self, filename):
+        # indexes the memory images of a backup archive
+        try:
+            manifest, images = read_archive(filename)
+            for (node_id, space), data in images.items():
+                address = manifest["nodes"][node_id]["spaces"][f"{space:02X}"]["address"]
+                self.update(node_id, space, address, data)
+        except Exception as e:
+            print(f"Couldn't index backup {filename}:", e)
+
+event_id_index = EventIdIndex()
@@ -1,23 +1,105 @@
 import wx
 import wx.html2
+import os
 import json
+import asyncio
+import threading
 from lcc_browser.lcc.lcc_protocol import LccProtocol
 from lcc_browser.templates.gui import *
 from lcc_browser.log_viewer import *
 from lcc_browser.lcc_nodes_viewer import *
+from lcc_browser.bus_statistics_viewer import BusStatisticsViewer
 from lcc_browser.connection_dialog import *
 from lcc_browser.settings_dialog import *
 from lcc_browser.settings import settings
+from lcc_browser.node_inventory import inventory
+from lcc_browser.event_id_index import event_id_index
+from lcc_browser.layout_backup import backup_layout, restore_layout, format_report
 from lcc_browser.wx_events import *
+from lcc_browser.ui_bridge import ui_bridge
+from lcc_browser.wx_asyncio import main_loop
+from lcc_browser.browser_bridge import BrowserBridge
+from lcc_browser.api_server import ApiServer
+
+single_threaded = False # event loop model, chosen once in start_gui, changing the setting needs a restart
 
 js_lcc_injection = """
 class LCCEventTarget extends EventTarget {
+  constructor() {
+    super();
+    this.filteredListeners = new Map(); // event id or prefix without dots -> [listener]
+    this.prefixLengths = new Set();
+    this.pendingEvents = [];
+    this.dispatchRequested = false;
+  }
+  addEventListener(type, listener, options) {
+    // raw-event listeners can be limited to one event id or an event id prefix, e.g.
+    // LCC.addEventListener("raw-event", listener, {prefix: "104265632192"})
+    const key = this.filterKey(type, options);
+    if (key === null) return super.addEventListener(type, listener, options);
+    if (!this.filteredListeners.has(key)) this.filteredListeners.set(key, []);
+    this.filteredListeners.get(key).push(listener);
+    this.prefixLengths.add(key.length);
+    // producers on the bus only send events that somebody consumes
+    if (key.length === 16) this.registerConsumer(key);
+    else window.LCC.postMessage({type: "register-consumer-range", prefix: key});
+  }
+  removeEventListener(type, listener, options) {
+    const key = this.filterKey(type, options);
+    if (key === null) return super.removeEventListener(type, listener, options);
+    const listeners = (this.filteredListeners.get(key) || []).filter(x => x !== listener);
+    if (listeners.length) this.filteredListeners.set(key, listeners);
+    else this.filteredListeners.delete(key);
+    this.prefixLengths = new Set([...this.filteredListeners.keys()].map(x => x.length));
+  }
+  filterKey(type, options) {
+    const key = type === "raw-event" && options && (options.eventId || options.prefix);
+    return key ? key.replaceAll(".", "").toUpperCase() : null;
+  }
+  receiveEvents(ids) {
+    // called by the application with the events received since the last call
+    this.pendingEvents.push(...ids);
+    if (this.dispatchRequested) return;
+    this.dispatchRequested = true;
+    if (document.visibilityState === "visible") requestAnimationFrame(() => this.dispatchPending());
+    else setTimeout(() => this.dispatchPending(), 0);
+  }
+  dispatchPending() {
+    this.dispatchRequested = false;
+    const ids = this.pendingEvents;
+    this.pendingEvents = [];
+    for (const id of ids) {
+      const event = new CustomEvent("raw-event", {detail: id});
+      this.dispatchEvent(event);
+      if (!this.filteredListeners.size) continue;
+      const key = id.replace(".", "");
+      for (const length of this.prefixLengths) {
+        const listeners = this.filteredListeners.get(length === key.length ? key : key.slice(0, length));
+        if (!listeners) continue;
+        for (const listener of listeners) {
+          try {
+            if (typeof listener === "function") listener.call(this, event);
+            else listener.handleEvent(event);
+          } catch (e) {
+            console.error(e);
+          }
+        }
+      }
+    }
+  }
   sendEvent(node_name, event_data) {
     window.LCC.postMessage({type: "event", node_name, ...event_data});
   }
   sendRawEvent(id) {
     window.LCC.postMessage({type: "raw-event", id});
   }
+  registerConsumer(id) {
+    // the node identifies itself as consumer of this event
+    window.LCC.postMessage({type: "register-consumer", id});
+  }
+  registerProducer(id) {
+    window.LCC.postMessage({type: "register-producer", id});
+  }
 }
 const LCC = new LCCEventTarget();
 """
@@ -27,11 +109,11 @@ class GuiFrame(OpenLcbGui):
     def __init__(self):
         super().__init__(None, title="OpenLcb Interface")
         self.connection = None
-        self.Bind(EVT_CAN_FRAME_IN, self.on_can_frame_in)
-        self.Bind(EVT_LCC, self.on_lcc)
+        self.api_server = None
         self.Bind(wx.EVT_CLOSE, self.on_close)
         self.Bind(wx.EVT_SIZE, self.on_resize)
         self.lcc = LccProtocol()
+        event_id_index.attach(self.lcc)
 
         self.can_viewer = LogViewer(self, "CAN Traffic")
         self.can_viewer.Bind(wx.EVT_CLOSE, self.on_can_viewer_close)
@@ -45,6 +127,10 @@ class GuiFrame(OpenLcbGui):
         self.lcc_nodes.Bind(wx.EVT_CLOSE, self.on_lcc_nodes_close)
         self.lcc_nodes.Hide()
 
+        self.bus_statistics = BusStatisticsViewer(self, self.lcc)
+        self.bus_statistics.Bind(wx.EVT_CLOSE, self.on_bus_statistics_close)
+        self.bus_statistics.Hide()
+
         self.browser = wx.html2.WebView.New(self.panel)
         self.sizer.Add(self.browser, 1, wx.EXPAND)
         result = self.browser.AddUserScript(js_lcc_injection, wx.html2.WEBVIEW_INJECT_AT_DOCUMENT_START)
@@ -53,14 +139,28 @@ class GuiFrame(OpenLcbGui):
         self.browser.AddScriptMessageHandler('LCC')
         self.browser.Bind(wx.html2.EVT_WEBVIEW_SCRIPT_MESSAGE_RECEIVED, self.on_browser_event)
         self.browser.Bind(wx.html2.EVT_WEBVIEW_ERROR, self.on_browser_error)
+        self.browser_bridge = BrowserBridge(self.browser)
 
-        self.statusbar = self.CreateStatusBar(1, wx.STB_DEFAULT_STYLE)
+        self.statusbar = self.CreateStatusBar(2, wx.STB_DEFAULT_STYLE)
+        self.statusbar.SetStatusWidths([-1, 250])
         self.statusbar.SetStatusText("Not connected")
 
+        # frames are handed to the GUI in batches
+        ui_bridge.add_channel("can", self.on_can_frames)
+        ui_bridge.add_channel("lcc", self.on_lcc_frames)
+        ui_bridge.stats_callback = self.on_ui_bridge_stats
+        self.ui_bridge_losses = (0, 0)
+
     def on_browser_event(self, evt):
         evt = json.loads(evt.GetString())
         if evt.get("type") == "raw-event":
             self.lcc.emit_event(evt["id"])
+        elif evt.get("type") == "register-consumer":
+            self.lcc.register_consumer(evt["id"])
+        elif evt.get("type") == "register-consumer-range":
+            self.lcc.register_consumer_range(evt["prefix"])
+        elif evt.get("type") == "register-producer":
+            self.lcc.register_producer(evt["id"])
         elif evt.get("type") == "event":
             # todo, generate event id from higher-level representation
             pass
@@ -69,6 +169,9 @@ class GuiFrame(OpenLcbGui):
         print("Browser error", evt.GetString())
 
     def reload_browser(self, evt):
+        # the page registers its events again
+        self.lcc.local_events.clear()
+        self.browser_bridge.clear()
         if self.browser.GetCurrentURL() != settings["html_path"]:
             self.browser.LoadURL(settings["html_path"])
         else:
@@ -84,6 +187,7 @@ class GuiFrame(OpenLcbGui):
     def connect(self, connection, parameters):
         self.disconnect()
         self.connection = connection
+        self.connection.threaded = not single_threaded
         try:
             self.connection.connect(parameters)
         except Exception as e:
@@ -91,46 +195,107 @@ class GuiFrame(OpenLcbGui):
             dlg.ShowModal()
             return
 
-        self.lcc.set_frame_callback(lambda frame, sent_by_us: wx.PostEvent(self, LccEvent(frame=frame, sent_by_us=sent_by_us)))
-        self.connection.set_frame_callback(lambda frame, sent_by_us: wx.PostEvent(self, CanFrameInEvent(frame=frame, sent_by_us=sent_by_us)))
+        self.lcc.set_frame_callback(lambda frame, sent_by_us: ui_bridge.put("lcc", (frame, sent_by_us)))
+        self.connection.set_frame_callback(lambda frame, sent_by_us: ui_bridge.put("can", (frame, sent_by_us)))
+        self.lcc.set_connection(self.connection)
         self.connection.start()
-        self.lcc.connection = self.connection
         self.lcc.reserve_node_alias()
+        self.start_api_server()
         self.statusbar.SetStatusText("Connected")
         settings['can_driver'] = self.connection.name
         settings['can_driver_params'] = parameters
 
+    def start_api_server(self):
+        # dashboards on localhost receive events and node state, disabled without a port
+        port = settings.get("api_port")
+        if not port: return
+        self.api_server = ApiServer(self.lcc, port=port, token=settings.get("api_token"))
+        future, cancel = self.lcc.run_future(self.api_server.start())
+        def done(future):
+            try:
+                future.result()
+            except Exception as e:
+                print("Couldn't start API server:", e)
+        future.add_done_callback(done)
+
     def on_close(self, evt):
         settings.save()
         self.disconnect()
+        inventory.close()
         evt.Skip()
 
     def disconnect(self, evt=None):
+        if self.api_server:
+            self.api_server.stop()
+            self.api_server = None
         self.lcc.join()
         if self.connection:
             self.connection.join()
             self.connection.disconnect()
         self.statusbar.SetStatusText("Not connected")
 
-    def on_can_frame_in(self, evt):
-        log_entry = str(evt.frame)
-        if evt.sent_by_us:
-            log_entry += " (this node)"
-        wx.PostEvent(self.can_viewer, LogEntryEvent(get_log_entry=lambda x=log_entry: x))
-
-    def on_lcc(self, evt):
-        lcc_frame = evt.frame
-        if lcc_frame and hasattr(lcc_frame, 'type'):
-            def get_log_entry(x=lcc_frame, sent_by_us=evt.sent_by_us):
-                res = self.lcc.frame_to_human_readable(x)
-                if sent_by_us: res += " (this node)"
-                return res
-            wx.PostEvent(self.lcc_viewer, LogEntryEvent(get_log_entry=get_log_entry))
-            if not evt.sent_by_us:
-                wx.PostEvent(self.lcc_nodes, evt)
-                if lcc_frame.type == "ProducerConsumerReport":
-                    js = f"LCC.dispatchEvent(new CustomEvent('raw-event', {{detail: '{lcc_frame.inner.inner.inner.event_id}'}}));"
-                    self.browser.RunScriptAsync(js);
+    def on_can_frames(self, frames):
+        def get_log_entry(frame, sent_by_us):
+            res = str(frame)
+            if sent_by_us: res += " (this node)"
+            return res
+        self.can_viewer.add_log_entries([lambda x=x: get_log_entry(*x) for x in frames])
+
+    def on_lcc_frames(self, frames):
+        def get_log_entry(frame, sent_by_us):
+            res = self.lcc.frame_to_human_readable(frame)
+            if sent_by_us: res += " (this node)"
+            return res
+        frames = [x for x in frames if x[0] and hasattr(x[0], 'type')]
+        self.lcc_viewer.add_log_entries([lambda x=x: get_log_entry(*x) for x in frames])
+        for lcc_frame, sent_by_us in frames:
+            if not sent_by_us and lcc_frame.type == "ProducerConsumerReport":
+                self.browser_bridge.post(lcc_frame.inner.inner.inner.event_id)
+
+    def on_ui_bridge_stats(self, stats):
+        losses = (stats["coalesced"], stats["dropped"])
+        if losses == self.ui_bridge_losses: return
+        self.ui_bridge_losses = losses
+        self.statusbar.SetStatusText(f"UI updates coalesced: {losses[0]}, dropped: {losses[1]}", 1)
+
+    def backup_configuration(self, evt):
+        dialog = wx.FileDialog(self, "Backup configuration of all nodes", wildcard="Backup files (*.zip)|*.zip",
+            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        if dialog.ShowModal() == wx.ID_CANCEL: return
+        filename = dialog.GetPath()
+        self.run_layout_task("Backup", backup_layout(self.lcc, filename, progress_callback=self.on_layout_task_progress), filename)
+
+    def restore_configuration(self, evt):
+        dialog = wx.FileDialog(self, "Restore configuration of all nodes", wildcard="Backup files (*.zip)|*.zip",
+            style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
+        if dialog.ShowModal() == wx.ID_CANCEL: return
+        filename = dialog.GetPath()
+        self.run_layout_task("Restore", restore_layout(self.lcc, filename, progress_callback=self.on_layout_task_progress), filename)
+
+    def on_layout_task_progress(self, node_id, status):
+        wx.CallAfter(self.statusbar.SetStatusText, f"{node_id} {status}")
+
+    def run_layout_task(self, name, coroutine, filename):
+        # runs a backup or restore in the connection thread and shows the per-node report
+        # the archive is remembered, it seeds the event id index on the next start
+        try:
+            future, cancel = self.lcc.run_future(coroutine)
+        except RuntimeError as e:
+            coroutine.close()
+            wx.MessageDialog(self, str(e), "Error", wx.OK|wx.ICON_ERROR).ShowModal()
+            return
+        def done(future):
+            try:
+                text = format_report(future.result()) or "No nodes found"
+            except Exception as e:
+                text = f"{type(e).__name__}: {e}"
+            def show():
+                if not future.cancelled() and future.exception() is None:
+                    settings["last_backup"] = filename
+                self.statusbar.SetStatusText(f"{name} finished")
+                wx.MessageDialog(self, text, f"{name} report", wx.OK).ShowModal()
+            wx.CallAfter(show)
+        future.add_done_callback(done)
 
     def view_can_traffic(self, evt):
         self.can_viewer.Show(evt.IsChecked())
@@ -146,6 +311,13 @@ class GuiFrame(OpenLcbGui):
         self.menu.view_lcc_traffic.Check(False)
         self.lcc_viewer.Hide()
 
+    def view_bus_statistics(self, evt):
+        self.bus_statistics.Show(evt.IsChecked())
+
+    def on_bus_statistics_close(self, evt):
+        self.menu.view_bus_statistics.Check(False)
+        self.bus_statistics.Hide()
+
     def on_lcc_nodes_close(self, evt):
         self.menu.view_lcc_nodes.Check(False)
         self.lcc_nodes.Hide()
@@ -163,14 +335,13 @@ class GuiFrame(OpenLcbGui):
 
     def on_init(self):
         global settings
-        settings.load()
-
         if "width" in settings:
             self.SetSize((settings['width'], settings['height']))
 
         self.browser.LoadURL(settings["html_path"])
 
         self.lcc.update_node_id(settings["node_id"])
+        self.index_last_backup()
 
         if settings.get("auto_connect"):
             can_driver_name = settings.get("can_driver")
@@ -184,6 +355,12 @@ class GuiFrame(OpenLcbGui):
                     connection = CanDriver(self.lcc)
                     self.connect(connection, can_driver_params)
 
+    def index_last_backup(self):
+        # event ids are found before the nodes were read in this session, live reads replace the archived values
+        filename = settings.get("last_backup")
+        if not filename or not os.path.exists(filename): return
+        threading.Thread(target=event_id_index.load_archive, args=(filename,), daemon=True).start()
+
     def on_resize(self, evt):
         global settings
         size = evt.GetSize()
@@ -200,8 +377,19 @@ class LccBrowserApp(wx.App):
         return True
 
 def start_gui():
-    app = LccBrowserApp()
-    app.MainLoop()
+    global single_threaded
+    settings.load()
+    single_threaded = bool(settings.get("single_threaded"))
+    if single_threaded:
+        # the CAN connection runs in the GUI thread
+        async def run():
+            app = LccBrowserApp()
+            await main_loop()
+            app.OnExit() # as app.MainLoop() does when it returns
+        asyncio.run(run())
+    else:
+        app = LccBrowserApp()
+        app.MainLoop()
 
 if __name__ == "__main__":
     start_gui()
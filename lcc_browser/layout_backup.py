@@ -0,0 +1,180 @@
+""" Backup and restore of the configuration memory of all nodes on the bus."""
+import json
+import time
+import asyncio
+import zipfile
+from lcc_browser.node_inventory import inventory
+
+# spaces that don't hold configuration: CDI, all memory, firmware
+excluded_spaces = {0xff, 0xfe, 0xef}
+max_space_size = 0x10000 # upper limit for spaces that aren't described by a CDI
+merge_gap = 8 # differing byte ranges closer than this are written in one transaction
+manifest_name = "manifest.json"
+archive_format = 1
+
+def space_filename(node_id, space):
+    return f"nodes/{node_id}/space_{space:02X}.bin"
+
+def configurable_ranges(node_id, node_memory):
+    # space -> (address, size) of the memory that is backed up
+    layout = inventory.get_cdi_layout((inventory.get(node_id) or {}).get("cdi_digest"))
+    extents = layout.space_extents() if layout else {}
+    result = {}
+    for space, info in node_memory.spaces.items():
+        if space in excluded_spaces or info.read_only: continue
+        address, size = info.lowest_address, info.size
+        if space in extents:
+            # only the memory that's described by the CDI
+            lowest, end = extents[space]
+            address = max(address, lowest)
+            size = min(info.highest_address + 1, end) - address
+        size = min(size, max_space_size)
+        if size > 0: result[space] = (address, size)
+    return result
+
+def diff_ranges(old, new, gap=merge_gap):
+    # (offset, size) of the byte ranges where new differs from old
+    ranges = []
+    start = None
+    last = None
+    for i in range(len(new)):
+        if i < len(old) and old[i] == new[i]: continue
+        if start is not None and i - last <= gap:
+            last = i
+            continue
+        if start is not None: ranges.append((start, last + 1 - start))
+        start = last = i
+    if start is not None: ranges.append((start, last + 1 - start))
+    return ranges
+
+async def run_per_node(node_ids, func, concurrency):
+    # runs func(node_id) for all nodes, at most concurrency nodes at the same time
+    semaphore = asyncio.Semaphore(concurrency)
+    async def run(node_id):
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                result = await func(node_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+            result["seconds"] = round(time.monotonic() - start, 3)
+            return node_id, result
+    return dict(await asyncio.gather(*[run(node_id) for node_id in node_ids]))
+
+async def backup_layout(lcc, filename, node_ids=None, concurrency=4, progress_callback=None):
+    # reads every configurable address space of every node into a zip archive
+    # returns a report {node_id: {"seconds", "bytes", "error"}}
+    if node_ids is None:
+        node_ids = list(lcc.node_id_to_alias.keys())
+    images = {}
+
+    async def backup_node(node_id):
+        alias = lcc.node_id_to_alias.get(node_id)
+        if alias is None: raise RuntimeError("Node isn't on the bus")
+        node_memory = await lcc.read_node_memory(alias)
+        spaces = {}
+        for space, (address, size) in configurable_ranges(node_id, node_memory).items():
+            if progress_callback: progress_callback(node_id, f"reading space 0x{space:02X}")
+            data = await lcc.read_memory_configuration(alias, space, address, size)
+            images[(node_id, space)] = data
+            spaces[f"{space:02X}"] = {"address": address, "size": len(data), "file": space_filename(node_id, space)}
+        if progress_callback: progress_callback(node_id, "done")
+        return {"spaces": spaces, "bytes": sum(x["size"] for x in spaces.values())}
+
+    report = await run_per_node(node_ids, backup_node, concurrency)
+
+    manifest = {
+        "format": archive_format,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "nodes": {},
+    }
+    for node_id, result in report.items():
+        if "error" in result: continue
+        info = inventory.get(node_id) or {}
+        manifest["nodes"][node_id] = {
+            "name": " ".join([info.get(x) or "" for x in ["manufacturer_name", "model_name", "node_name"]]).strip(),
+            "software_version": info.get("software_version"),
+            "cdi_digest": info.get("cdi_digest"),
+            "spaces": result["spaces"],
+        }
+
+    def write_archive():
+        with zipfile.ZipFile(filename, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr(manifest_name, json.dumps(manifest, indent=2))
+            for (node_id, space), data in images.items():
+                if node_id in manifest["nodes"]:
+                    archive.writestr(space_filename(node_id, space), bytes(data))
+    await asyncio.get_running_loop().run_in_executor(None, write_archive)
+    return report
+
+def read_archive(filename):
+    # returns the manifest and {(node_id, space): data}
+    with zipfile.ZipFile(filename, "r") as archive:
+        manifest = json.loads(archive.read(manifest_name))
+        if manifest.get("format") != archive_format:
+            raise ValueError(f"Unsupported backup format {manifest.get('format')}")
+        images = {}
+        for node_id, node in manifest["nodes"].items():
+            for space, entry in node["spaces"].items():
+                images[(node_id, int(space, 16))] = archive.read(entry["file"])
+    return manifest, images
+
+async def restore_layout(lcc, filename, node_ids=None, concurrency=4, verify=True, progress_callback=None):
+    # writes the byte ranges that differ between the archive and the nodes, then reads them back
+    # returns a report {node_id: {"seconds", "bytes", "ranges", "verified", "error"}}
+    manifest, images = await asyncio.get_running_loop().run_in_executor(None, read_archive, filename)
+    if node_ids is None:
+        node_ids = list(manifest["nodes"].keys())
+
+    async def restore_node(node_id):
+        alias = lcc.node_id_to_alias.get(node_id)
+        if alias is None: raise RuntimeError("Node isn't on the bus")
+        node = manifest["nodes"].get(node_id)
+        if node is None: raise RuntimeError("Node isn't in the backup")
+        written = 0
+        range_count = 0
+        mismatches = []
+        for space, entry in node["spaces"].items():
+            space = int(space, 16)
+            address = entry["address"]
+            image = images[(node_id, space)]
+            if progress_callback: progress_callback(node_id, f"comparing space 0x{space:02X}")
+            live = await lcc.read_memory_configuration(alias, space, address, len(image))
+            ranges = diff_ranges(live, image)
+            for offset, size in ranges:
+                if progress_callback: progress_callback(node_id, f"writing space 0x{space:02X} at 0x{address+offset:X}")
+                await lcc.write_memory_configuration(alias, space, address + offset, image[offset:offset+size])
+                written += size
+            range_count += len(ranges)
+            if verify:
+                for offset, size in ranges:
+                    data = await lcc.read_memory_configuration(alias, space, address + offset, size)
+                    if data != image[offset:offset+size]:
+                        mismatches.append(f"0x{space:02X}:0x{address+offset:X}")
+        if progress_callback: progress_callback(node_id, "done")
+        result = {"bytes": written, "ranges": range_count}
+        if verify: result["verified"] = not mismatches
+        if mismatches: result["mismatches"] = mismatches
+        return result
+
+    return await run_per_node(node_ids, restore_node, concurrency)
+
+def format_report(report):
+    lines = []
+    for node_id, result in report.items():
+        line = f"{node_id}: {result.get('seconds', 0):.1f} s"
+        if "error" in result:
+            line += f", {result['error']}"
+        else:
+            line += f", {result.get('bytes', 0)} bytes"
+            if "ranges" in result: line += f" in {result['ranges']} ranges"
+            if result.get("verified") is False:
+                line += ", verification failed at " + ", ".join(result["mismatches"])
+            elif result.get("verified"):
+                line += ", verified"
+            if result.get("skipped"):
+                line += ", fields beyond the end of memory skipped at " + ", ".join(result["skipped"])
+        lines.append(line)
+    return "\n".join(lines)
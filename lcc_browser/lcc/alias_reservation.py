@@ -0,0 +1,135 @@
+""" CAN alias reservation of local nodes, see 6.2 of the OpenLCB CAN frame transfer standard."""
+
+reservation_delay = .2 # seconds between the CID frames and the RID frame
+retry_delay = .5 # after a frame couldn't be sent
+collision_backoff = 1 # seconds before a reservation restarts after repeated collisions
+max_fast_restarts = 4 # collisions in a row that restart right away
+
+class AliasGenerator:
+    # the pseudo random alias sequence suggested by the standard, seeded with the node id
+    # a node id always yields the same aliases, so collisions resolve the same way on every run
+    def __init__(self, node_id):
+        seed = int.from_bytes(node_id, "big")
+        self.lfsr1 = seed >> 24
+        self.lfsr2 = seed & 0xffffff
+
+    def step(self):
+        temp1 = ((self.lfsr1 << 9) | ((self.lfsr2 >> 15) & 0x1ff)) & 0xffffff
+        temp2 = (self.lfsr2 << 9) & 0xffffff
+        self.lfsr2 += temp2 + 0x7a4ba9
+        self.lfsr1 += temp1 + 0x1b0ca3
+        self.lfsr1 = (self.lfsr1 & 0xffffff) + ((self.lfsr2 & 0xff000000) >> 24)
+        self.lfsr2 &= 0xffffff
+
+    def next_alias(self, is_used=lambda alias: False):
+        # the next alias of the sequence that isn't zero and not known to be in use
+        for i in range(0x1000):
+            alias = (self.lfsr1 ^ self.lfsr2 ^ (self.lfsr1 >> 12) ^ (self.lfsr2 >> 12)) & 0xfff
+            self.step()
+            if alias and not is_used(alias): return alias
+        return alias or 1 # all aliases are taken, the reservation sorts it out
+
+class AliasReservation:
+    # reserves and defends the alias of one local node id
+    # states: inhibited, reserving, permitted, collision (duplicate node id)
+    # all methods run in the connection loop, waits are scheduled with loop.call_later
+    def __init__(self, protocol, node_id, state_callback=None):
+        self.protocol = protocol
+        self.node_id = node_id
+        self.generator = AliasGenerator(node_id)
+        self.alias = None
+        self.state = "inhibited"
+        self.timer = None
+        self.state_callback = state_callback # func(reservation), called on every state change
+        self.collisions = 0 # in total
+        self.collisions_in_row = 0 # reset when the alias is permitted
+
+    def set_state(self, state):
+        self.state = state
+        if self.state_callback: self.state_callback(self)
+
+    def schedule(self, delay, func, *args):
+        self.cancel()
+        self.timer = self.protocol.connection.loop.call_later(delay, func, *args)
+
+    def cancel(self):
+        if self.timer: self.timer.cancel()
+        self.timer = None
+
+    def set_alias(self, alias):
+        owners = self.protocol.alias_owners
+        if owners.get(self.alias) is self: del owners[self.alias]
+        self.alias = alias
+        if alias is not None: owners[alias] = self
+
+    def start(self):
+        # 6.2.1, four CID frames carry the node id, the alias is ours if nobody objects in time
+        self.cancel()
+        self.set_alias(self.generator.next_alias(self.protocol.is_alias_used))
+        self.set_state("reserving")
+        node_id = self.node_id
+        parts = [(node_id[0] << 4) | (node_id[1] >> 4), ((node_id[1] & 0xf) << 8) | node_id[2],
+            (node_id[3] << 4) | (node_id[4] >> 4), ((node_id[4] & 0xf) << 8) | node_id[5]]
+        try:
+            for sequence_number, part in zip([7, 6, 5, 4], parts):
+                self.protocol.send_cc_cid_frame(sequence_number, part, source_alias=self.alias)
+        except Exception as e:
+            print("Couldn't send CID frames:", e)
+            # backoff and repeat
+            self.schedule(2, self.start)
+            return
+        self.schedule(reservation_delay, self.reserve, self.alias)
+
+    def reserve(self, alias):
+        # check if this reservation was restarted or canceled
+        if self.state != "reserving" or self.alias != alias: return
+        self.timer = None
+        if self.protocol.send_cc_frame("ReserveIDFrame", source_alias=alias):
+            # backoff and repeat
+            self.schedule(retry_delay, self.start)
+            return
+        self.protocol.send_cc_frame("AliasMapDefinitionFrame", self.node_id, source_alias=alias)
+        self.collisions_in_row = 0
+        self.set_state("permitted")
+
+    def handle_collision(self, frame):
+        # a received frame carries our alias, see 6.2.5 Node ID Alias Collision Handling
+        if self.state == "reserving":
+            # restart with the next alias of the sequence
+            print(f"Node alias collision detected while reserving {self.alias:03X}")
+            self.restart()
+        elif self.state == "permitted":
+            if frame.type == "CanControlCheckIDFrame":
+                # another node checks our alias, defend it
+                self.protocol.send_cc_frame("ReserveIDFrame", source_alias=self.alias)
+            else:
+                print(f"Node alias collision {self.alias:03X}")
+                self.protocol.send_cc_frame("AliasMapResetFrame", self.node_id, source_alias=self.alias)
+                self.set_state("inhibited")
+                self.restart()
+
+    def restart(self):
+        # a node that keeps colliding, e.g. with a bus that echoes our frames, backs off
+        self.collisions += 1
+        self.collisions_in_row += 1
+        if self.collisions_in_row <= max_fast_restarts:
+            self.start()
+        else:
+            self.cancel()
+            self.set_alias(None)
+            self.set_state("inhibited")
+            self.schedule(collision_backoff, self.start)
+
+    def release(self):
+        # gives up the alias, e.g. when the node id changes
+        self.cancel()
+        if self.state == "permitted":
+            self.protocol.send_cc_frame("AliasMapResetFrame", self.node_id, source_alias=self.alias)
+        self.set_alias(None)
+        self.set_state("inhibited")
+
+    def stop(self):
+        # the connection closes, the alias is reserved again on the next connection
+        self.cancel()
+        self.set_alias(None)
+        self.state = "inhibited"
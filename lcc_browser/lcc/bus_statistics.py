@@ -0,0 +1,154 @@
+import time
+from bisect import bisect_left
+from lcc_browser.lcc.message_format import type_to_mti_map, type_to_cc_map
+
+mti_names = {value: name for name, value in type_to_mti_map.items()}
+cc_names = {value: name for name, value in type_to_cc_map.items()}
+datagram_reply_mtis = {type_to_mti_map["DatagramReceivedOk"], type_to_mti_map["DatagramRejected"]}
+error_mtis = {type_to_mti_map[x] for x in ["DatagramRejected", "OptionalInteractionRejected", "TerminateDueToError"]}
+latency_bounds = [.001, .002, .005, .01, .02, .05, .1, .2, .5, 1, 2, 5] # upper bounds of the latency buckets in seconds
+frame_overhead_bits = 67 # extended CAN frame without data and bit stuffing
+
+class RollingCounter:
+    # sums per interval of the last size intervals
+    # adding is O(1), a slot is reset when it's reused for a newer interval
+    def __init__(self, size=60, interval=1):
+        self.size = size
+        self.interval = interval
+        self.values = [0] * size
+        self.slots = [-1] * size
+
+    def add(self, now, value=1):
+        slot = int(now / self.interval)
+        i = slot % self.size
+        if self.slots[i] != slot:
+            self.slots[i] = slot
+            self.values[i] = 0
+        self.values[i] += value
+
+    def total(self, now, window=None):
+        # sum of the last window seconds, the current interval is included
+        slot = int(now / self.interval)
+        count = self.size if window is None else min(self.size, int(window / self.interval))
+        return sum([value for s, value in zip(self.slots, self.values) if slot - count < s <= slot])
+
+    def series(self, now):
+        # values of the intervals, oldest first
+        slot = int(now / self.interval)
+        result = []
+        for s in range(slot - self.size + 1, slot + 1):
+            i = s % self.size
+            result.append(self.values[i] if self.slots[i] == s else 0)
+        return result
+
+def frame_label(can_id):
+    # human-readable frame type from the CAN header, without parsing the frame
+    if can_id >> 27 & 1:
+        frame_type = can_id >> 24 & 7
+        if frame_type == 1:
+            mti = can_id >> 12 & 0xfff
+            return mti_names.get(mti) or f"MTI 0x{mti:03X}"
+        if 2 <= frame_type <= 5: return "Datagram"
+        if frame_type == 7: return "Stream"
+        return f"Frame type {frame_type}"
+    if can_id >> 24 & 7 >= 4: return "CheckIDFrame"
+    variable_field = can_id >> 12 & 0xfff
+    return cc_names.get(variable_field) or f"Control frame 0x{variable_field:03X}"
+
+class BusStatistics:
+    # traffic statistics in rolling windows, updating them costs O(1) per frame
+    # frames are counted in the thread that sends or receives them, snapshots can be taken from any thread
+    def __init__(self, window=60, bitrate=125000):
+        self.window = window
+        self.bitrate = bitrate # used to estimate the bus load
+        self.reset()
+
+    def reset(self):
+        counter = lambda: RollingCounter(self.window)
+        self.frames = {False: counter(), True: counter()} # sent_by_us -> frames
+        self.bytes = {False: counter(), True: counter()}
+        self.bits = counter()
+        self.types = {} # frame type -> RollingCounter
+        self.sources = {} # source alias -> RollingCounter
+        self.errors = {} # kind -> RollingCounter
+        self.latency = [counter() for i in range(len(latency_bounds) + 1)]
+        self.latency_sum = counter()
+        self.pending_datagrams = {} # destination alias -> (source alias, send time)
+        self.started = time.monotonic()
+
+    def get_counter(self, table, key):
+        counter = table.get(key)
+        if counter is None:
+            counter = table[key] = RollingCounter(self.window)
+        return counter
+
+    def count_frame(self, frame, sent_by_us=False, now=None):
+        if now is None: now = time.monotonic()
+        size = len(frame.data) if frame.data else 0
+        sent_by_us = bool(sent_by_us)
+        self.frames[sent_by_us].add(now)
+        self.bytes[sent_by_us].add(now, size)
+        self.bits.add(now, frame_overhead_bits + 8 * size)
+        can_id = frame.id
+        self.get_counter(self.types, frame_label(can_id)).add(now)
+        source_alias = can_id & 0xfff
+        self.get_counter(self.sources, source_alias).add(now)
+        if not can_id >> 27 & 1: return
+
+        frame_type = can_id >> 24 & 7
+        if frame_type in (2, 5):
+            # only or last frame of a datagram, the reply is timed
+            if sent_by_us:
+                self.pending_datagrams[can_id >> 12 & 0xfff] = (source_alias, now)
+        elif frame_type == 1:
+            mti = can_id >> 12 & 0xfff
+            if not sent_by_us and mti in error_mtis:
+                self.count_error(mti_names[mti], now)
+            if not sent_by_us and mti in datagram_reply_mtis and size >= 2:
+                pending = self.pending_datagrams.get(source_alias)
+                destination_alias = int.from_bytes(frame.data[:2], "big") & 0xfff
+                if pending and pending[0] == destination_alias:
+                    del self.pending_datagrams[source_alias]
+                    self.count_latency(now - pending[1], now)
+
+    def count_latency(self, seconds, now=None):
+        if now is None: now = time.monotonic()
+        self.latency[bisect_left(latency_bounds, seconds)].add(now)
+        self.latency_sum.add(now, seconds)
+
+    def count_error(self, kind, now=None):
+        if now is None: now = time.monotonic()
+        self.get_counter(self.errors, kind).add(now)
+
+    def snapshot(self, window=10, now=None):
+        # rates over the last window seconds, counts over the whole rolling window
+        if now is None: now = time.monotonic()
+        window = max(1, min(window, self.window, now - self.started))
+        rate = lambda counter: counter.total(now, window) / window
+        latency_counts = [x.total(now) for x in self.latency]
+        latency_count = sum(latency_counts)
+        return {
+            "window": self.window,
+            "rate_window": window,
+            "frames_rx": rate(self.frames[False]),
+            "frames_tx": rate(self.frames[True]),
+            "bytes_rx": rate(self.bytes[False]),
+            "bytes_tx": rate(self.bytes[True]),
+            "bus_load": rate(self.bits) / self.bitrate,
+            "frames_series": [a + b for a, b in zip(self.frames[False].series(now), self.frames[True].series(now))],
+            "types": sorted([(key, rate(x)) for key, x in dict(self.types).items()], key=lambda x: -x[1]),
+            "sources": sorted([(key, rate(x)) for key, x in dict(self.sources).items()], key=lambda x: -x[1]),
+            "errors": sorted([(key, x.total(now)) for key, x in dict(self.errors).items()], key=lambda x: -x[1]),
+            "latency": list(zip(latency_bounds + [None], latency_counts)),
+            "latency_mean": self.latency_sum.total(now) / latency_count if latency_count else None,
+            "latency_p95": self.latency_percentile(latency_counts, .95),
+        }
+
+    def latency_percentile(self, counts, fraction):
+        # upper bound of the bucket that contains the percentile, None if it's above the largest bound
+        total = sum(counts)
+        if not total: return None
+        seen = 0
+        for bound, count in zip(latency_bounds + [None], counts):
+            seen += count
+            if seen >= fraction * total: return bound
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from collections import defaultdict
+from threading import Lock
+from lcc_browser.lcc.message_format import EventRange
+
+def event_id_to_int(event_id):
+    # accepts "010102030405.0001", "01.01.02.03.04.05.00.01", bytes or int
+    if isinstance(event_id, int): return event_id
+    if isinstance(event_id, (bytes, bytearray)): return int.from_bytes(event_id, "big")
+    return int(event_id.replace(".", ""), 16)
+
+def prefix_to_range(prefix):
+    # "0501010118" -> EventRange of all event ids that start with these hex digits
+    prefix = prefix.replace(".", "")
+    if not 0 < len(prefix) <= 16: raise ValueError(f"Invalid event id prefix {prefix}")
+    mask_bits = 64 - 4 * len(prefix)
+    return EventRange(int(prefix, 16) << mask_bits, mask_bits)
+
+def int_to_event_id(value):
+    res = f"{value:016X}"
+    return res[:12] + "." + res[12:]
+
+class EventIndex:
+    # event id -> nodes that produce or consume it
+    # single events are a dict lookup, ranges are bucketed by their mask size
+    # so a query costs one lookup per distinct mask size (at most 64)
+    # filled in the connection thread, queried from the GUI thread
+
+    def __init__(self):
+        self.lock = Lock()
+        self.events = {} # event id (int) -> {node_id: status}
+        self.ranges = {} # mask bits -> {range base: {node_id: status}}
+        self.node_entries = defaultdict(set) # node_id -> {(event id, None) or (base, mask bits)}
+
+    def add_event(self, node_id, event_id, status="valid"):
+        with self.lock:
+            self.events.setdefault(event_id, {})[node_id] = status
+            self.node_entries[node_id].add((event_id, None))
+
+    def add_range(self, node_id, event_range):
+        with self.lock:
+            bucket = self.ranges.setdefault(event_range.mask_bits, {})
+            bucket.setdefault(event_range.base, {})[node_id] = "range"
+            self.node_entries[node_id].add((event_range.base, event_range.mask_bits))
+
+    def remove_node(self, node_id):
+        with self.lock:
+            for key, mask_bits in self.node_entries.pop(node_id, ()):
+                if mask_bits is None:
+                    table = self.events
+                else:
+                    table = self.ranges.get(mask_bits, {})
+                nodes = table.get(key)
+                if nodes is None: continue
+                nodes.pop(node_id, None)
+                if not nodes: del table[key]
+                if mask_bits is not None and not table: del self.ranges[mask_bits]
+
+    def lookup(self, event_id):
+        # {node_id: status} of all nodes that identified event_id or a range containing it
+        with self.lock:
+            result = dict(self.events.get(event_id, {}))
+            for mask_bits, bucket in self.ranges.items():
+                nodes = bucket.get(event_id >> mask_bits << mask_bits)
+                if nodes:
+                    for node_id, status in nodes.items():
+                        result.setdefault(node_id, status)
+        return result
+
+    def node_events(self, node_id):
+        # event ids and EventRanges identified by a node
+        with self.lock:
+            entries = list(self.node_entries.get(node_id, ()))
+        return [key if mask_bits is None else EventRange(key, mask_bits) for key, mask_bits in entries]
+
+class EventMap:
+    # layout-wide map of producers and consumers
+    # the map is built by sending addressed IdentifyEvents to one node at a time
+    # and kept up to date from identify messages on the bus
+
+    def __init__(self, lcc, update_callback=None, node_interval=.1, settle_time=.25, max_reply_time=3):
+        self.lcc = lcc
+        self.update_callback = update_callback # called with the node id whose events changed, connection thread
+        self.node_interval = node_interval # minimum pause between two nodes, limits the bus load
+        self.settle_time = settle_time # a node is done when it didn't identify anything for this long
+        self.max_reply_time = max_reply_time
+        self.producers = EventIndex()
+        self.consumers = EventIndex()
+        self.crawled = {} # node_id -> time of the last completed crawl
+        self.last_reply = {} # alias -> time of the last identify message
+        self.is_running = False
+
+    def start(self):
+        if self.is_running: return
+        self.is_running = True
+        for frame_type, func in self.get_listeners():
+            self.lcc.add_listener(frame_type, func)
+
+    def stop(self):
+        if not self.is_running: return
+        self.is_running = False
+        for frame_type, func in self.get_listeners():
+            self.lcc.remove_listener(frame_type, func)
+
+    def get_listeners(self):
+        return [
+            ("ProducerIdentified", self.on_producer_identified),
+            ("ProducerRangeIdentified", self.on_producer_range_identified),
+            ("ConsumerIdentified", self.on_consumer_identified),
+            ("ConsumerRangeIdentified", self.on_consumer_range_identified),
+            ("InitializationComplete", self.on_node_initialized),
+            ("InitializationCompleteSimple", self.on_node_initialized),
+        ]
+
+    def get_node_id(self, frame):
+        self.last_reply[frame.source_alias] = time.monotonic()
+        return self.lcc.alias_to_node_id.get(frame.source_alias)
+
+    def on_producer_identified(self, frame):
+        node_id = self.get_node_id(frame)
+        if node_id is None: return
+        inner = frame.inner.inner.inner
+        self.producers.add_event(node_id, event_id_to_int(inner.event_id), str(inner.status))
+        self.notify(node_id)
+
+    def on_consumer_identified(self, frame):
+        node_id = self.get_node_id(frame)
+        if node_id is None: return
+        inner = frame.inner.inner.inner
+        self.consumers.add_event(node_id, event_id_to_int(inner.event_id), str(inner.status))
+        self.notify(node_id)
+
+    def on_producer_range_identified(self, frame):
+        node_id = self.get_node_id(frame)
+        if node_id is None: return
+        self.producers.add_range(node_id, frame.inner.inner.inner.event_id_range)
+        self.notify(node_id)
+
+    def on_consumer_range_identified(self, frame):
+        node_id = self.get_node_id(frame)
+        if node_id is None: return
+        self.consumers.add_range(node_id, frame.inner.inner.inner.event_id_range)
+        self.notify(node_id)
+
+    def on_node_initialized(self, frame):
+        # a restarted node may have a new configuration, it's crawled again
+        node_id = frame.inner.inner.inner.node_id
+        self.forget(node_id)
+
+    def notify(self, node_id):
+        if self.update_callback: self.update_callback(node_id)
+
+    def forget(self, node_id):
+        self.producers.remove_node(node_id)
+        self.consumers.remove_node(node_id)
+        self.crawled.pop(node_id, None)
+
+    async def crawl_node(self, node_id):
+        # asks a single node for all of its events and waits until it's done answering
+        alias = self.lcc.node_id_to_alias.get(node_id)
+        if alias is None: return False
+        self.forget(node_id)
+        start = time.monotonic()
+        self.last_reply[alias] = start
+        async with self.lcc.node_locks[alias]:
+            self.lcc.send_mti_frame("IdentifyEvents", dst_alias=alias)
+            while True:
+                await asyncio.sleep(self.settle_time / 2)
+                now = time.monotonic()
+                if now - self.last_reply[alias] > self.settle_time: break
+                if now - start > self.max_reply_time: break
+        self.crawled[node_id] = time.monotonic()
+        return True
+
+    async def crawl(self, node_ids=None, progress_callback=None):
+        # crawls nodes one after the other, by default all nodes with a known alias
+        # nodes are identified sequentially so the replies of one node don't collide with another's
+        if node_ids is None:
+            node_ids = list(self.lcc.node_id_to_alias.keys())
+        for i, node_id in enumerate(node_ids):
+            if progress_callback: progress_callback(i, len(node_ids), node_id)
+            await self.crawl_node(node_id)
+            await asyncio.sleep(self.node_interval)
+
+    def who_produces(self, event_id):
+        return self.producers.lookup(event_id_to_int(event_id))
+
+    def who_consumes(self, event_id):
+        return self.consumers.lookup(event_id_to_int(event_id))
@@ -1,8 +1,15 @@
-import random
 from lcc_browser.can.connection import CanFrame
-from lcc_browser.lcc.message_format import LccFrame, DatagramProtocol, type_to_mti_map, type_to_cc_map, type_to_memory_config_map, response_filter, datagram_response_filter
-from threading import Timer, Lock
+from lcc_browser.lcc.message_format import LccFrame, DatagramProtocol, type_to_mti_map, type_to_cc_map, type_to_memory_config_map, response_filter, datagram_response_filter, rejection_filter, datagram_mti
+from lcc_browser.lcc.memory_space import AddressSpace, NodeMemory
+from lcc_browser.lcc.event_map import EventMap, event_id_to_int, prefix_to_range
+from lcc_browser.lcc.local_events import LocalEvents
+from lcc_browser.lcc.bus_statistics import BusStatistics
+from lcc_browser.lcc.tracing import tracer
+from lcc_browser.lcc.alias_reservation import AliasReservation
+from lcc_browser.lcc.message_format import EventRange
+from threading import Lock
 import traceback
+from contextlib import nullcontext
 import math
 from collections import defaultdict
 import asyncio
@@ -22,6 +29,22 @@ class ProtocolError(Exception):
     pass
 class CanError(Exception):
     pass
+class RequestRejected(ProtocolError):
+    # the node rejected a request, temporary rejections may succeed when the request is repeated
+    def __init__(self, frame_type, error_code=None, temporary=False):
+        self.frame_type = frame_type
+        self.error_code = error_code
+        self.temporary = temporary
+        code = f" (error code 0x{error_code:04X})" if error_code is not None else ""
+        super().__init__(f"Error: Node sent {frame_type}{code}")
+
+def check_rejection(frame):
+    # raises RequestRejected for frames that reject a request
+    if frame.type in ["DatagramRejected", "OptionalInteractionRejected", "TerminateDueToError"]:
+        error = getattr(frame.inner.inner.inner, "inner", None)
+        if error is None: raise RequestRejected(frame.type)
+        raise RequestRejected(frame.type, error.error_code, error.temporary)
+    return frame
 
 class LccProtocol:
     def __init__(self):
@@ -32,73 +55,80 @@ class LccProtocol:
         self.alias_to_node_id = {}
         self.node_id_to_alias = {}
         self.node_locks = defaultdict(asyncio.Lock) # locks that provide exclusive access to a node (node_alias -> lock)
+        self.node_memory = {} # memory options and address spaces (node_id -> NodeMemory)
+        self.alias_memory = {} # same for nodes whose node id isn't known (node_alias -> NodeMemory)
         self.handlers = {
             "AliasMapDefinitionFrame": self.handle_cc_alias_map_definition,
             "AliasMappingEnquiryFrame": self.handle_cc_alias_map_enquiry,
             "AliasMapResetFrame": self.handle_cc_alias_map_reset,
             "VerifiedNodeId": self.handle_mti_verified_node_id,
+            "InitializationComplete": self.handle_mti_initialization_complete,
+            "InitializationCompleteSimple": self.handle_mti_initialization_complete,
+            "IdentifyConsumer": self.handle_mti_identify_consumer,
+            "IdentifyProducer": self.handle_mti_identify_producer,
+            "IdentifyEvents": self.handle_mti_identify_events,
         }
         self.dynamic_handlers = defaultdict(dict) # one-time handlers waiting for replies, filter -> func
+        self.listeners = defaultdict(list) # permanent observers of received frames, frame type (None for all) -> [func]
+        self.memory_listeners = [] # observers of memory contents, func(dst_alias, space, address, data)
         self.dynamic_handler_lock = Lock()
         self.lcc_control_state = "inhibited"
         self.lcc_message_state = "ready" # we're always ready to accept events
-        self.timer = None
+        self.reservations = {} # aliases of local node ids, node id -> AliasReservation
+        self.alias_owners = {} # alias -> AliasReservation that reserves or holds it
         self.connection = None
         self.frame_callback = None
+        self.local_events = LocalEvents() # events produced and consumed by this node
+        self.advertisement = None # cancels a running event advertisement
+        self.event_map = EventMap(self) # producers and consumers of the layout, updated from identify messages
+        self.event_map.start()
+        self.statistics = BusStatistics() # bus load and traffic, counted for every sent and received frame
 
     def set_connection(self, connection):
         self.connection = connection
+        # without a connection thread all handlers run in the caller's thread and don't need a lock
+        self.dynamic_handler_lock = Lock() if connection.threaded else nullcontext()
+
+    def call_soon(self, func, *args):
+        # schedules func in the connection loop
+        if self.connection.threaded:
+            self.connection.loop.call_soon_threadsafe(func, *args)
+        else:
+            self.connection.loop.call_soon(func, *args)
 
     def set_frame_callback(self, func):
         self.frame_callback = func
 
     def join(self):
-        if self.timer: self.timer.cancel()
+        if self.connection and self.connection.loop and self.connection.loop.is_running():
+            self.call_soon(self.stop_reservations)
+        else:
+            self.stop_reservations()
         self.lcc_control_state = "inhibited"
         self.lcc_message_state = "ready"
 
-    def handle_cc_frame(self, frame):
-        if frame.source_alias == self.node_alias:
-            if self.lcc_control_state == "reserving":
-                # third bullet point, or 6.2.1
-                # The node shall restart the (reservation) process at the beginning if, before completion of the process, a frame is
-                # received that carries a source Node ID alias value that is identical to the alias value being tested by this
-                # procedure.
-                print("Node alias collision detected while reserving")
-                self.timer.cancel()
-                self.timer = Timer(1, self.reserve_node_alias)
-                self.timer.start()
-            else:
-                # see 6.2.5 Node ID Alias Collision Handling
-                if frame.type == "CanControlCheckIDFrame":
-                    # first bullet point
-                    # CID frame
-                    # reserve id alias
-                    self.send_cc_frame("ReserveIDFrame")
-                else:
-                    if self.lcc_control_state == "permitted":
-                        # second bullet point
-                        # non CID frame
-                        self.lcc_control_set_state("inhibited")
-                        # send Alias Map Reset frame
-                        self.send_cc_frame("AliasMapResetFrame", self.node_id)
-                        # try to get a new alias reserved
-                        print("Node alias collision")
-                        self.timer.cancel()
-                        self.timer = Timer(1, self.reserve_node_alias)
-                        self.timer.start()
+    def stop_reservations(self):
+        for reservation in self.reservations.values():
+            reservation.stop()
+
+    def handle_alias_collision(self, frame):
+        # any received frame that carries the alias of a local node
+        reservation = self.alias_owners.get(frame.source_alias)
+        if reservation: reservation.handle_collision(frame)
 
     def handle_cc_alias_map_definition(self, frame):
         # Alias Map Definition (AMD) frame
         # see 6.2.6 optional Duplicate Node ID Handling
         node_id = frame.inner.inner.node_id
-        if self.lcc_control_state == "permitted" and node_id == self.node_id:
+        reservation = self.reservations.get(bytes(id_to_bytes(node_id)))
+        if reservation and reservation.state == "permitted":
             # send Producer-Consumer Event Report
             # Duplicate Node ID Detected
             duplicate_node_id_evt = bytearray.fromhex("0101000000000201")
-            can_frame = CanFrame(0x195b4000 | (self.node_alias & 0xfff), duplicate_node_id_evt, True, False)
+            can_frame = CanFrame(0x195b4000 | (reservation.alias & 0xfff), duplicate_node_id_evt, True, False)
             self.can_tx(can_frame)
-            self.lcc_control_set_state("collision")
+            reservation.cancel()
+            reservation.set_state("collision")
         self.add_alias(node_id, frame.source_alias)
 
     def handle_cc_alias_map_reset(self, frame):
@@ -107,44 +137,98 @@ class LccProtocol:
     def handle_mti_verified_node_id(self, frame):
         self.add_alias(frame.inner.inner.inner.node_id, frame.source_alias)
 
+    def handle_mti_initialization_complete(self, frame):
+        # the node (re)started, its memory layout may have changed
+        node_id = frame.inner.inner.inner.node_id
+        self.node_memory.pop(node_id, None)
+        self.alias_memory.pop(frame.source_alias, None)
+        self.add_alias(node_id, frame.source_alias)
+
+    def handle_mti_identify_consumer(self, frame):
+        event_id = frame.inner.inner.inner.event_id
+        if self.local_events.is_consumer(event_id):
+            self.send_mti_frame("ConsumerIdentified", id_to_bytes(event_id))
+
+    def handle_mti_identify_producer(self, frame):
+        event_id = frame.inner.inner.inner.event_id
+        if self.local_events.is_producer(event_id):
+            self.send_mti_frame("ProducerIdentified", id_to_bytes(event_id))
+
+    def handle_mti_identify_events(self, frame):
+        # global, or addressed to this node
+        destination_alias = getattr(frame, "destination_alias", None)
+        if destination_alias is not None and destination_alias != self.node_alias: return
+        self.advertise_events()
+
+    def register_producer(self, event_id):
+        # new events are identified right away, all events are advertised after initialization
+        event_id = event_id_to_int(event_id)
+        if self.local_events.add("producer", event_id) and self.lcc_message_state == "initialized":
+            self.send_mti_frame("ProducerIdentified", event_id.to_bytes(8, "big"))
+
+    def register_consumer(self, event_id):
+        event_id = event_id_to_int(event_id)
+        if self.local_events.add("consumer", event_id) and self.lcc_message_state == "initialized":
+            self.send_mti_frame("ConsumerIdentified", event_id.to_bytes(8, "big"))
+
+    def register_consumer_range(self, prefix):
+        # consumes all events that start with a hex prefix, identified with one range message
+        event_range = prefix_to_range(prefix)
+        if event_range.mask_bits == 0: return self.register_consumer(event_range.base)
+        if self.local_events.add_range("consumer", event_range) and self.lcc_message_state == "initialized":
+            self.send_mti_frame("ConsumerRangeIdentified", event_range.to_bytes())
+
     def add_alias(self, node_id, alias):
+        if self.alias_to_node_id.get(alias, node_id) != node_id:
+            # the alias belongs to another node now
+            self.alias_memory.pop(alias, None)
         self.node_id_to_alias[node_id] = alias
         self.alias_to_node_id[alias] = node_id
 
     def remove_alias(self, node_id, alias):
         self.node_id_to_alias.pop(node_id, None)
         self.alias_to_node_id.pop(alias, None)
+        self.alias_memory.pop(alias, None)
 
     def handle_cc_alias_map_enquiry(self, frame):
         # Alias Mapping Enquiry (AME) frame
-        if self.lcc_control_state == "permitted" and \
-            (frame.inner.inner.node_id is None or frame.inner.inner.node_id == self.node_id):
-            # see 6.2.3
-            # send alias map definition
-            self.send_cc_frame("AliasMapDefinitionFrame", self.node_id);
+        # see 6.2.3, all local nodes answer an enquiry without node id
+        node_id = frame.inner.inner.node_id
+        if node_id is None:
+            reservations = list(self.reservations.values())
+        else:
+            reservations = [self.reservations.get(bytes(id_to_bytes(node_id)))]
+        for reservation in reservations:
+            if reservation and reservation.state == "permitted":
+                # send alias map definition
+                self.send_cc_frame("AliasMapDefinitionFrame", reservation.node_id, source_alias=reservation.alias)
 
     def update_node_id(self, node_id):
-        node_id = id_to_bytes(node_id)
-        random.seed(node_id)
+        node_id = bytes(id_to_bytes(node_id))
         if node_id == self.node_id: return
-
-        if self.lcc_control_state == "permitted":
-            # release currently used alias
-            self.send_cc_frame("AliasMapResetFrame", self.node_id)
+        old_node_id = self.node_id
         self.node_id = node_id
-        if self.connection:
-            self.reserve_node_alias()
+        if self.has_loop():
+            self.call_soon(self.replace_reservation, old_node_id, node_id)
 
-    def send_cc_cid_frame(self, sequence_number, data, payload=None):
+    def replace_reservation(self, old_node_id, node_id):
+        # releases the alias of the old node id
+        reservation = self.reservations.pop(old_node_id, None)
+        if reservation: reservation.release()
+        self.start_reservations([node_id])
+
+    def send_cc_cid_frame(self, sequence_number, data, payload=None, source_alias=None):
         if not self.connection: return 1
-        can_frame = CanFrame((1 << 28) | (sequence_number << 24) | (data << 12) | self.node_alias, payload, True, False)
+        if source_alias is None: source_alias = self.node_alias
+        can_frame = CanFrame((1 << 28) | (sequence_number << 24) | (data << 12) | source_alias, payload, True, False)
         self.can_tx(can_frame)
 
-    def send_cc_frame(self, type, payload=None):
+    def send_cc_frame(self, type, payload=None, source_alias=None):
         if not self.connection: return 1
+        if source_alias is None: source_alias = self.node_alias
         sequence_number = 0
         data = type_to_cc_map.get(type)
-        can_frame = CanFrame((1 << 28) | (sequence_number << 24) | (data << 12) | self.node_alias, payload, True, False)
+        can_frame = CanFrame((1 << 28) | (sequence_number << 24) | (data << 12) | source_alias, payload, True, False)
         self.can_tx(can_frame)
 
     def send_lcc_frame(self, frame_type, data, payload=None):
@@ -176,76 +260,105 @@ class LccProtocol:
         self.can_tx(can_frame)
 
     async def protocol_support_inquiry(self, dst_alias):
-        async with self.node_locks[dst_alias]:
-            try:
-                response_filter = lambda frame: frame.source_alias == dst_alias and frame.type == "ProtocolSupportReply"
-                response_future = self.add_handler(response_filter)
-                response_handler = datagram_response_filter(self.node_alias, dst_alias)
-                self.send_mti_frame("ProtocolSupportInquiry", dst_alias=dst_alias)
-                result = await asyncio.wait_for(response_future, timeout=2)
-                return result.inner.inner.inner.inner
-            finally:
-                self.remove_handler(response_filter)
+        with tracer.span("protocol_support_inquiry", dst_alias=dst_alias) as span:
+            span.phase("lock wait")
+            async with self.node_locks[dst_alias]:
+                try:
+                    rejected = rejection_filter(self.node_alias, dst_alias, type_to_mti_map["ProtocolSupportInquiry"])
+                    response_filter = lambda frame: (frame.source_alias == dst_alias and frame.type == "ProtocolSupportReply") or rejected(frame)
+                    response_future = self.add_handler(response_filter)
+                    self.send_mti_frame("ProtocolSupportInquiry", dst_alias=dst_alias)
+                    span.phase("wait reply")
+                    result = check_rejection(await asyncio.wait_for(response_future, timeout=2))
+                    return result.inner.inner.inner.inner
+                finally:
+                    self.remove_handler(response_filter)
 
     async def simple_node_information(self, dst_alias):
-        async with self.node_locks[dst_alias]:
-            try:
-                response_filter = lambda frame: frame.source_alias == dst_alias and frame.type == "SimpleNodeIdentInfoReply" and hasattr(frame, "multipart_data")
-                response_future = self.add_handler(response_filter)
-                response_handler = datagram_response_filter(self.node_alias, dst_alias)
-                self.send_mti_frame("SimpleNodeIdentInfoRequest", dst_alias=dst_alias)
-                result = await asyncio.wait_for(response_future, timeout=2)
-                return result.inner.inner.inner.inner
-            finally:
-                self.remove_handler(response_filter)
+        with tracer.span("simple_node_information", dst_alias=dst_alias) as span:
+            span.phase("lock wait")
+            async with self.node_locks[dst_alias]:
+                try:
+                    rejected = rejection_filter(self.node_alias, dst_alias, type_to_mti_map["SimpleNodeIdentInfoRequest"])
+                    response_filter = lambda frame: (frame.source_alias == dst_alias and frame.type == "SimpleNodeIdentInfoReply" and hasattr(frame, "multipart_data")) or rejected(frame)
+                    response_future = self.add_handler(response_filter)
+                    self.send_mti_frame("SimpleNodeIdentInfoRequest", dst_alias=dst_alias)
+                    span.phase("wait reply")
+                    result = check_rejection(await asyncio.wait_for(response_future, timeout=2))
+                    return result.inner.inner.inner.inner
+                finally:
+                    self.remove_handler(response_filter)
 
     @requires_initialization
-    async def send_datagram(self, payload, dst_alias, expected_response=None):
+    async def send_datagram(self, payload, dst_alias, expected_response=None, retries=3, locked=False):
         """Sends a datagram and awaits its response."""
-        async with self.node_locks[dst_alias]:
-            # install handlers before sending datagram to avoid timing issues
-            dg_filter = datagram_response_filter(self.node_alias, dst_alias)
-            dg_future = self.add_handler(dg_filter)
-            if expected_response:
-                proto_future = self.add_handler(expected_response)
-
-            try:
-                num_frames = math.ceil(len(payload) / 8)
-                for i in range(num_frames):
-                    if num_frames <= 1:
-                        frame_type = 2
-                    elif i == 0:
-                        frame_type = 3
-                    elif i+1 < num_frames:
-                        frame_type = 4
-                    else:
-                        frame_type = 5
-
-                    data = payload[i*8:(i+1)*8]
-                    can_frame = CanFrame((0b11 << 27) | (frame_type << 24) | (dst_alias << 12) | self.node_alias, data, True, False)
-                    self.can_tx(can_frame)
-                    # some delay helps avoid dropped frames by slow nodes (or drivers?)
-                    await asyncio.sleep(0.001)
-
-                dg_result = await asyncio.wait_for(dg_future, timeout=5)
-                if dg_result.type == "DatagramRejected":
-                    raise ProtocolError("Error: Datagram was rejected")
+        # the reply deadline comes from the node's DatagramReceivedOk, rejections end the request at once
+        # temporary rejections are retried with exponential backoff
+        # locked: the caller already holds the node lock, e.g. during read-modify-write
+        with tracer.span("send_datagram", dst_alias=dst_alias, size=len(payload)) as span:
+            span.phase("lock wait")
+            async with nullcontext() if locked else self.node_locks[dst_alias]:
+                rejected = rejection_filter(self.node_alias, dst_alias, datagram_mti)
+                acknowledged = datagram_response_filter(self.node_alias, dst_alias)
+                dg_filter = lambda frame: acknowledged(frame) or rejected(frame)
                 if expected_response:
-                    res = await asyncio.wait_for(proto_future, timeout=5)
-                    return res
-                else:
-                    return True
-
-            except asyncio.TimeoutError:
-                print("Timeout while waiting for LCC response")
-                raise MissingResponse()
-
-            finally:
-                self.remove_handler(dg_filter)
-                if expected_response:
-                    self.remove_handler(expected_response)
+                    proto_filter = lambda frame: expected_response(frame) or rejected(frame)
+
+                try:
+                    for attempt in range(retries + 1):
+                        # install handlers before sending datagram to avoid timing issues
+                        dg_future = self.add_handler(dg_filter)
+                        if expected_response:
+                            proto_future = self.add_handler(proto_filter)
+                        try:
+                            return await self.send_datagram_frames(payload, dst_alias, dg_future,
+                                proto_future if expected_response else None, span)
+                        except RequestRejected as e:
+                            if not e.temporary or attempt == retries: raise
+                            span.set(retries=attempt + 1)
+                            span.phase("backoff")
+                            await asyncio.sleep(.1 * 2 ** attempt)
+
+                except asyncio.TimeoutError:
+                    print("Timeout while waiting for LCC response")
+                    raise MissingResponse()
+
+                finally:
+                    self.remove_handler(dg_filter)
+                    if expected_response:
+                        self.remove_handler(proto_filter)
+
+    async def send_datagram_frames(self, payload, dst_alias, dg_future, proto_future, span, ack_timeout=5, reply_timeout=5):
+        span.phase("send frames")
+        num_frames = math.ceil(len(payload) / 8)
+        for i in range(num_frames):
+            if num_frames <= 1:
+                frame_type = 2
+            elif i == 0:
+                frame_type = 3
+            elif i+1 < num_frames:
+                frame_type = 4
+            else:
+                frame_type = 5
 
-    async def read_memory_configuration_block(self, dst_alias, address_space, starting_address, size):
+            data = payload[i*8:(i+1)*8]
+            can_frame = CanFrame((0b11 << 27) | (frame_type << 24) | (dst_alias << 12) | self.node_alias, data, True, False)
+            self.can_tx(can_frame)
+            # some delay helps avoid dropped frames by slow nodes (or drivers?)
+            await asyncio.sleep(0.001)
+
+        span.phase("wait DatagramReceivedOk")
+        dg_result = check_rejection(await asyncio.wait_for(dg_future, timeout=ack_timeout))
+        if not proto_future: return True
+        flags = dg_result.inner.inner.inner.inner
+        if flags and flags.reply_pending and flags.timeout:
+            # the node announced how long it needs for the reply
+            reply_timeout = flags.timeout
+            span.set(reply_timeout=reply_timeout)
+        span.phase("wait reply")
+        return check_rejection(await asyncio.wait_for(proto_future, timeout=reply_timeout))
+
+    async def read_memory_configuration_block(self, dst_alias, address_space, starting_address, size, locked=False):
         assert size >= 1 and size <= 64, f"Invalid size {size}"
         assert address_space is not None, "Address space is None"
         command = type_to_memory_config_map.get("ReadMemoryConfiguration") & 0b11111100
@@ -255,24 +368,33 @@ class LccProtocol:
         if address_space < 0xfd:
             data.append(address_space)
         data += size.to_bytes(1, byteorder='big')
-        response = await self.send_datagram(data, dst_alias, response_filter(data, self.node_alias, dst_alias))
+        with tracer.span("read_memory_configuration_block", dst_alias=dst_alias, address_space=address_space, address=starting_address, size=size):
+            response = await self.send_datagram(data, dst_alias, response_filter(data, self.node_alias, dst_alias), locked=locked)
 
         if response and response.type == "ReadMemoryConfigurationReplyFailure":
                 raise ProtocolError("Error: Memory read failed")
         return response.inner.inner.inner.inner.inner.data
 
-    async def write_memory_configuration_block(self, dst_alias, address_space, starting_address, payload):
+    async def write_memory_configuration_block(self, dst_alias, address_space, starting_address, payload, mask=None, locked=False):
+        # with a mask, only bits that are set in the mask are written (write under mask)
         size = len(payload)
         assert size >= 1 and size <= 64, f"Invalid size {size}"
         assert address_space is not None, "Address space is None"
-        command = type_to_memory_config_map.get("WriteMemoryConfiguration") & 0b11111100
+        if mask is None:
+            command = type_to_memory_config_map.get("WriteMemoryConfiguration") & 0b11111100
+        else:
+            assert len(mask) == size and size <= 32, f"Invalid mask size {len(mask)}"
+            command = type_to_memory_config_map.get("WriteUnderMask") & 0b11111100
         if address_space >= 0xfd:
             command += address_space - 0xfc
         data = bytearray([0x20, command, *starting_address.to_bytes(4, byteorder='big')])
         if address_space < 0xfd:
             data.append(address_space)
         data += payload
-        response = await self.send_datagram(data, dst_alias, response_filter(data, self.node_alias, dst_alias))
+        if mask is not None:
+            data += mask # mask bytes follow the data bytes
+        with tracer.span("write_memory_configuration_block", dst_alias=dst_alias, address_space=address_space, address=starting_address, size=size):
+            response = await self.send_datagram(data, dst_alias, response_filter(data, self.node_alias, dst_alias), locked=locked)
         
         if response and response.type == "WriteMemoryConfigurationReplyFailure":
                 raise ProtocolError("Error: Memory write failed")
@@ -284,7 +406,7 @@ class LccProtocol:
         with self.dynamic_handler_lock:
             def func(frame):
                 if loop.is_running() and not future.done():
-                    loop.call_soon_threadsafe(future.set_result, frame)
+                    self.call_soon(future.set_result, frame)
             self.dynamic_handlers[filter] = func
         return future
 
@@ -292,6 +414,33 @@ class LccProtocol:
         with self.dynamic_handler_lock:
             del self.dynamic_handlers[filter]
 
+    def add_listener(self, frame_type, func):
+        # func is called in the connection thread for every received frame of this type
+        # frame_type None listens to all frames
+        with self.dynamic_handler_lock:
+            self.listeners[frame_type] = self.listeners[frame_type] + [func]
+
+    def remove_listener(self, frame_type, func):
+        with self.dynamic_handler_lock:
+            self.listeners[frame_type] = [x for x in self.listeners[frame_type] if x != func]
+
+    def add_memory_listener(self, func):
+        # func is called in the connection thread with memory that was read from or written to a node
+        with self.dynamic_handler_lock:
+            self.memory_listeners = self.memory_listeners + [func]
+
+    def remove_memory_listener(self, func):
+        with self.dynamic_handler_lock:
+            self.memory_listeners = [x for x in self.memory_listeners if x != func]
+
+    def notify_memory(self, dst_alias, address_space, address, data):
+        for listener in self.memory_listeners:
+            try:
+                listener(dst_alias, address_space, address, data)
+            except Exception as e:
+                print("Memory listener failed:", type(e), e)
+                print(traceback.format_exc())
+
     async def wait_for_response(self, filter):
         # waits for an incoming message that matches the filter predicate function
         future = self.add_handler(filter)
@@ -312,62 +461,130 @@ class LccProtocol:
         response = await self.send_datagram(data, dst_alias, response_filter(data, self.node_alias, dst_alias))
         return response.inner.inner.inner.inner.inner
         
-    async def read_memory_configuration(self, dst_alias, address_space, address, size, progress_callback=None):
-        # read memory configuration data in blocks of 64 bytes
+    async def read_address_space_info(self, dst_alias, address_space):
+        command = type_to_memory_config_map.get("GetMemoryConfigurationAddressSpaceInfo")
+        data = bytearray([0x20, command, address_space])
+        try:
+            response = await self.send_datagram(data, dst_alias, response_filter(data, self.node_alias, dst_alias))
+        except MissingResponse:
+            raise MissingResponse("Node didn't answer request for memory address space information")
+        return response.inner.inner.inner.inner.inner
+
+    async def read_node_memory(self, dst_alias):
+        # queries memory options and all address spaces between highest and lowest once per node
+        node_memory = self.get_node_memory(dst_alias)
+        if node_memory: return node_memory
+
+        options = await self.read_memory_options(dst_alias)
+        lowest = options.lowest_address_space
+        if lowest is None: lowest = 0xfd # default according to the memory configuration standard
+        spaces = {}
+        for address_space in range(options.highest_address_space, lowest-1, -1):
+            try:
+                info = await self.read_address_space_info(dst_alias, address_space)
+            except (ProtocolError, MissingResponse) as e:
+                # some nodes reject or ignore requests for spaces they don't implement, keep the other spaces
+                print(f"Skipping address space 0x{address_space:02X}:", e)
+                continue
+            if not info.present or not info.inner: continue
+            spaces[address_space] = AddressSpace(address_space, info.inner.lowest_address,
+                info.inner.highest_address, bool(info.inner.read_only), info.inner.description)
+        node_memory = NodeMemory(options, spaces)
+        node_id = self.alias_to_node_id.get(dst_alias)
+        if node_id is not None:
+            self.node_memory[node_id] = node_memory
+        else:
+            self.alias_memory[dst_alias] = node_memory
+        return node_memory
+
+    def get_node_memory(self, dst_alias):
+        # cached memory layout of a node, or None
+        node_id = self.alias_to_node_id.get(dst_alias)
+        if node_id is None: return self.alias_memory.get(dst_alias)
+        return self.node_memory.get(node_id) or self.alias_memory.get(dst_alias)
+
+    async def read_memory_configuration(self, dst_alias, address_space, address, size, progress_callback=None, data_callback=None):
+        # reads in the largest blocks the node accepts, see MemoryPlanner
+        # data_callback receives each block as soon as it arrives
+        node_memory = await self.read_node_memory(dst_alias)
+        # don't read past the end of a known address space
+        size = node_memory.clamp(address_space, address, size)
+        end = address + size
         buffer = b""
-        while 1:
-            block_size = min(size, 64)
+        for block_address, block_size in node_memory.planner.plan_read(address, size, node_memory.space_end(address_space)):
             try:
-                data = await self.read_memory_configuration_block(dst_alias, address_space, address+len(buffer), block_size)
+                data = await self.read_memory_configuration_block(dst_alias, address_space, block_address, block_size)
             except MissingResponse:
                 raise MissingResponse("Node didn't answer request for memory config read")
+            # aligned blocks may extend beyond the requested range
+            data = data[max(0, address - block_address):max(0, end - block_address)]
+            if data: self.notify_memory(dst_alias, address_space, address + len(buffer), data)
             buffer += data
-            size -= len(data)
+            if data_callback: data_callback(data)
             if progress_callback: progress_callback(len(buffer))
-            if len(data) != 64 or size == 0: break
+            if len(buffer) < min(end, block_address + block_size) - address: break # short read, end of space
         return buffer
 
     async def write_memory_configuration(self, dst_alias, address_space, address, payload, progress_callback=None):
-        # read memory configuration data in blocks of 64 bytes
-        offset = 0
-        while 1:
-            block_size = min(len(payload), 64)
-            block = payload[:block_size]
+        # writes in the largest transactions the node accepts, see MemoryPlanner
+        node_memory = await self.read_node_memory(dst_alias)
+        written = 0
+        for transaction in node_memory.planner.plan_write(address, payload):
+            kind, block_address = transaction[:2]
             try:
-                data = await self.write_memory_configuration_block(dst_alias, address_space, address+offset, block)
+                if kind == "write":
+                    data = transaction[2]
+                    await self.write_memory_configuration_block(dst_alias, address_space, block_address, data)
+                    self.notify_memory(dst_alias, address_space, block_address, data)
+                elif kind == "write_under_mask":
+                    data, mask = transaction[2:]
+                    await self.write_memory_configuration_block(dst_alias, address_space, block_address, data, mask)
+                    offset = mask.index(0xff)
+                    data = data[offset:offset+mask.count(0xff)] # only count the bytes that were changed
+                    self.notify_memory(dst_alias, address_space, block_address + offset, data)
+                elif kind == "read_modify_write":
+                    block_size, offset, data = transaction[2:]
+                    # nobody else may write the block between reading and writing it
+                    async with self.node_locks[dst_alias]:
+                        block = bytearray(await self.read_memory_configuration_block(dst_alias, address_space, block_address, block_size, locked=True))
+                        if len(block) != block_size:
+                            raise ProtocolError("Error: Node returned a short block for read-modify-write")
+                        block[offset:offset+len(data)] = data
+                        await self.write_memory_configuration_block(dst_alias, address_space, block_address, block, locked=True)
+                    self.notify_memory(dst_alias, address_space, block_address, bytes(block))
             except MissingResponse:
                 raise MissingResponse("Node didn't answer request for memory config write")
-            offset += block_size
-            payload = payload[block_size:]
-            if progress_callback: progress_callback(offset)
-            if len(payload) == 0: break
-
-    async def read_cdi(self, dst_alias, progress_callback=None):
-        await asyncio.sleep(.05) # allow some time for previous datagrams to settle, compensates bugs in some TCS nodes
-        try:
-            # check if CDI is present
-            data = bytearray([0x20])
-            command = type_to_memory_config_map.get("GetMemoryConfigurationAddressSpaceInfo")
-            data.append(command)
-            address_space = 0xff
-            data.append(address_space)
+            written += len(data)
+            if progress_callback: progress_callback(min(written, len(payload)))
 
+    async def read_cdi(self, dst_alias, progress_callback=None, data_callback=None):
+        with tracer.span("read_cdi", dst_alias=dst_alias) as span:
+            span.phase("settle")
+            await asyncio.sleep(.05) # allow some time for previous datagrams to settle, compensates bugs in some TCS nodes
             try:
-                response = await self.send_datagram(data, dst_alias, response_filter(data, self.node_alias, dst_alias))
-            except MissingResponse:
-                raise MissingResponse("Node didn't answer request for memory address space information")
-            if response.type == "DatagramRejected":
-                raise ProtocolError("Datagram was rejected")
-            assert response.inner.inner.inner.inner.inner.present
-            return await self.read_memory_configuration(dst_alias, address_space, 0, 0xffffffff, progress_callback)
-        except asyncio.CancelledError as e:
-            return None
+                # check if CDI is present, and how large it is
+                address_space = 0xff
+                span.phase("read memory options")
+                node_memory = await self.read_node_memory(dst_alias)
+                cdi_space = node_memory.get_space(address_space)
+                if cdi_space is None:
+                    raise ProtocolError("Node doesn't have a CDI address space")
+                span.phase("read CDI")
+                span.set(size=cdi_space.size)
+                return await self.read_memory_configuration(dst_alias, address_space, cdi_space.lowest_address, cdi_space.size, progress_callback, data_callback)
+            except asyncio.CancelledError as e:
+                span.set(canceled=True)
+                return None
 
     def run_future(self, future):
         # runs an async function as future in the connection executor thread
         # may be canceled by calling the returned function
         if not self.connection or not self.connection.loop or not self.connection.loop.is_running():
             raise RuntimeError("No connection")
+        if not self.connection.threaded:
+            # the caller runs in the connection loop
+            task = self.connection.create_task(future)
+            return task, task.cancel
         future = asyncio.run_coroutine_threadsafe(future, self.connection.loop)
         def cancel_future(future=future):
             if not self.connection or not self.connection.loop or not self.connection.loop.is_running():
@@ -375,45 +592,50 @@ class LccProtocol:
             self.connection.loop.call_soon_threadsafe(future.cancel)
         return future, cancel_future
         
-    def generate_node_alias(self):
-        self.node_alias = random.randint(0, 0xfff)
+    def has_loop(self):
+        # whether calls can be scheduled in the connection loop, it may not run yet
+        return bool(self.connection and self.connection.loop and not self.connection.loop.is_closed())
 
     def reserve_node_alias(self):
-        if self.timer: self.timer.cancel()
-        # according to 6.2.1
-        self.generate_node_alias()
-        print(f"Reserving node alias {self.node_alias:X}")
-        # send CID frames
-        self.lcc_control_set_state("reserving")
-        try:
-            self.send_cc_cid_frame(7, (self.node_id[0]<<4) | ((self.node_id[1] & 0xf0) >> 4))
-            self.send_cc_cid_frame(6, ((self.node_id[1] & 0xf)<<8) | self.node_id[2])
-            self.send_cc_cid_frame(5, (self.node_id[3]<<4) | ((self.node_id[4] & 0xf0) >> 4))
-            self.send_cc_cid_frame(4, ((self.node_id[4] & 0xf)<<8) | self.node_id[5])
-        except:
-            # backoff and repeat
-            self.timer = Timer(2, self.reserve_node_alias)
-            self.timer.start()
-            return
-
-        self.timer = Timer(0.2, self.reserve_node_alias_2, (self.node_alias,))
-        self.timer.start()
-
-    def reserve_node_alias_2(self, res_node_alias):
-        # check if we still want to reserve
-        if self.lcc_control_state != "reserving": return
-        # check if this reservation was canceled
-        if self.node_alias != res_node_alias: return
-
-        # reserve id
-        if self.send_cc_frame("ReserveIDFrame"):
-            # backoff and repeat
-            self.timer = Timer(0.5, self.reserve_node_alias, self.node_alias)
-            self.timer.start()
-        else:
-            # send Alias Map Definition
-            self.send_cc_frame("AliasMapDefinitionFrame", self.node_id);
-            self.lcc_control_set_state("permitted")
+        # (re)starts the reservation of this node's alias, may be called from any thread
+        self.reserve_aliases([self.node_id])
+
+    def reserve_aliases(self, node_ids):
+        # reserves aliases for many local node ids at once, may be called from any thread
+        # the reservations share one waiting period, see alias_reservation
+        if not self.has_loop(): return
+        self.call_soon(self.start_reservations, [bytes(id_to_bytes(x)) for x in node_ids])
+
+    def release_aliases(self, node_ids):
+        # may be called from any thread
+        if not self.has_loop(): return
+        self.call_soon(self.stop_local_nodes, [bytes(id_to_bytes(x)) for x in node_ids])
+
+    def start_reservations(self, node_ids):
+        for node_id in node_ids:
+            reservation = self.reservations.get(node_id)
+            if reservation is None:
+                reservation = self.reservations[node_id] = AliasReservation(self, node_id, self.on_reservation_state)
+            reservation.start()
+
+    def stop_local_nodes(self, node_ids):
+        for node_id in node_ids:
+            reservation = self.reservations.pop(node_id, None)
+            if reservation: reservation.release()
+
+    def is_alias_used(self, alias):
+        return alias in self.alias_owners or alias in self.alias_to_node_id
+
+    def get_alias(self, node_id):
+        # alias of a local node id, None until it's permitted
+        reservation = self.reservations.get(bytes(id_to_bytes(node_id)))
+        if reservation and reservation.state == "permitted": return reservation.alias
+
+    def on_reservation_state(self, reservation):
+        # the reservation of this node's id drives the message layer
+        if reservation.node_id != self.node_id: return
+        if reservation.alias is not None: self.node_alias = reservation.alias
+        self.lcc_control_set_state(reservation.state)
 
     def lcc_control_set_state(self, state):
         print("CAN control status", state)
@@ -430,7 +652,31 @@ class LccProtocol:
             self.lcc_message_state = "ready"
 
     def advertise_events(self):
-        pass
+        # identifies all local events, ranges are used where they save frames
+        messages = []
+        for role, single_type, range_type in [
+                ("producer", "ProducerIdentified", "ProducerRangeIdentified"),
+                ("consumer", "ConsumerIdentified", "ConsumerRangeIdentified")]:
+            for x in self.local_events.identification(role):
+                if isinstance(x, EventRange):
+                    messages.append((range_type, x.to_bytes()))
+                else:
+                    messages.append((single_type, x.to_bytes(8, "big")))
+        if not messages: return
+        if self.connection and self.connection.loop and self.connection.loop.is_running():
+            # a new request restarts the advertisement
+            if self.advertisement: self.advertisement()
+            future, self.advertisement = self.run_future(self.send_mti_frames(messages))
+        else:
+            for type, payload in messages:
+                self.send_mti_frame(type, payload)
+
+    async def send_mti_frames(self, messages, batch_size=16, batch_interval=.01):
+        # sends (type, payload) messages in batches so other traffic isn't blocked
+        for i in range(0, len(messages), batch_size):
+            for type, payload in messages[i:i+batch_size]:
+                self.send_mti_frame(type, payload)
+            await asyncio.sleep(batch_interval)
 
     def frame_to_human_readable(self, lcc_frame):
         # format construct parser output into human-readable columns
@@ -463,6 +709,7 @@ class LccProtocol:
         try:
             lcc_frame = LccFrame.parse(parsing_input)
         except Exception as e:
+            self.statistics.count_error("Parse error")
             print('LCC construct parsing failed:', e)
             print(traceback.format_exc())
             print(frame)
@@ -516,12 +763,17 @@ class LccProtocol:
         if sent_by_us: return lcc_frame
 
         # call frame handlers if this is a received frame
-        if not lcc_frame.is_openlcb_message:
-            self.handle_cc_frame(lcc_frame)
-        handler = self.handlers.get(getattr(lcc_frame, "type", None))
-        if handler:
-            if self.connection and self.connection.loop and self.connection.loop.is_running():
-                self.connection.loop.call_soon_threadsafe(handler, lcc_frame)
+        self.handle_alias_collision(lcc_frame)
+        frame_type = getattr(lcc_frame, "type", None)
+        handler = self.handlers.get(frame_type)
+        if self.connection and self.connection.loop and self.connection.loop.is_running():
+            if handler:
+                self.call_soon(handler, lcc_frame)
+            with self.dynamic_handler_lock:
+                listeners = self.listeners.get(None, [])
+                if frame_type: listeners = self.listeners.get(frame_type, []) + listeners
+            for listener in listeners:
+                self.call_soon(listener, lcc_frame)
 
         # dynamic handlers
         with self.dynamic_handler_lock:
@@ -536,6 +788,7 @@ class LccProtocol:
         if not self.connection:
             print("Can't send CAN frame because no transmitter was provided")
             return
+        self.register_producer(event_id)
         can_frame = CanFrame((0b11<<27) |(1<<24) | (0x5B4 << 12) | self.node_alias, id_to_bytes(event_id), True, False)
         self.can_tx(can_frame)
 
@@ -543,5 +796,6 @@ class LccProtocol:
         if self.connection is None:
             print("Error: Cannot send LCC frame without CAN connection")
             return
+        self.statistics.count_frame(can_frame, True)
         self.parse_frame(can_frame, sent_by_us=True)
         self.connection.send(can_frame)
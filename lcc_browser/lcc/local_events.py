@@ -0,0 +1,84 @@
+from threading import Lock
+from lcc_browser.lcc.message_format import EventRange
+from lcc_browser.lcc.event_map import event_id_to_int
+
+def compress_events(event_ids):
+    # covers a set of event ids with the fewest identification messages
+    # aligned blocks of 2^k events that are all present become one range, see event transport standard
+    # returns a list of event ids (int) and EventRanges
+    result = []
+    blocks = set(event_ids)
+    for mask_bits in range(64):
+        merged = set()
+        bit = 1 << mask_bits
+        for base in blocks:
+            if base ^ bit in blocks:
+                merged.add(base & ~bit)
+            else:
+                result.append(base if mask_bits == 0 else EventRange(base, mask_bits))
+        blocks = merged
+        if not blocks: break
+    for base in blocks:
+        result.append(EventRange(base, 64))
+    return result
+
+class LocalEvents:
+    # events this node produces and consumes, e.g. on behalf of the browser page
+    # membership tests are a set lookup plus one lookup per distinct range mask size
+
+    def __init__(self):
+        self.lock = Lock()
+        self.events = {"producer": set(), "consumer": set()} # role -> event ids (int)
+        self.ranges = {"producer": {}, "consumer": {}} # role -> {mask bits: {range base}}
+
+    def add(self, role, event_id):
+        # returns True if the event wasn't registered before
+        event_id = event_id_to_int(event_id)
+        with self.lock:
+            if self.covers(role, event_id): return False
+            self.events[role].add(event_id)
+            return True
+
+    def add_range(self, role, event_range):
+        with self.lock:
+            bases = self.ranges[role].setdefault(event_range.mask_bits, set())
+            if event_range.base in bases: return False
+            bases.add(event_range.base)
+            return True
+
+    def remove(self, role, event_id):
+        with self.lock:
+            self.events[role].discard(event_id_to_int(event_id))
+
+    def clear(self):
+        with self.lock:
+            for role in self.events:
+                self.events[role] = set()
+                self.ranges[role] = {}
+
+    def contains(self, role, event_id):
+        # ranges may be added from the GUI thread while the connection thread answers identify messages
+        with self.lock:
+            return self.covers(role, event_id)
+
+    def covers(self, role, event_id):
+        # the caller holds the lock
+        if event_id in self.events[role]: return True
+        for mask_bits, bases in self.ranges[role].items():
+            if event_id >> mask_bits << mask_bits in bases: return True
+        return False
+
+    def is_producer(self, event_id):
+        return self.contains("producer", event_id_to_int(event_id))
+
+    def is_consumer(self, event_id):
+        return self.contains("consumer", event_id_to_int(event_id))
+
+    def identification(self, role):
+        # event ids and ranges to advertise for a role, ranges where they save frames
+        with self.lock:
+            events = set(self.events[role])
+            ranges = [EventRange(base, mask_bits) for mask_bits, bases in self.ranges[role].items() for base in bases]
+        # events covered by a registered range don't need to be identified again
+        events = {x for x in events if not any(x in r for r in ranges)}
+        return ranges + compress_events(events)
@@ -0,0 +1,90 @@
+""" Splits memory configuration reads and writes into transactions that a node accepts."""
+
+max_block_size = 64 # maximum payload of a read or write datagram
+max_masked_block_size = 32 # write under mask carries data and mask bytes
+
+class MemoryPlanner:
+    def __init__(self, options):
+        # options is a GetMemoryConfigurationOptionsReply
+        commands = options.available_commands
+        write_lengths = options.write_lengths
+        self.unaligned_read = bool(commands.unaligned_read)
+        self.unaligned_write = bool(commands.unaligned_write)
+        self.write_under_mask = bool(commands.write_under_mask)
+        lengths = [n for n, flag in [
+            (64, write_lengths["64_byte"]),
+            (4, write_lengths["4_byte"]),
+            (2, write_lengths["2_byte"]),
+            (1, write_lengths["1_byte"]),
+        ] if flag]
+        # nodes that don't announce any write length are treated like arbitrary ones
+        self.arbitrary_writes = bool(write_lengths.arbitrary) or not lengths
+        self.write_lengths = lengths # largest first
+
+    def plan_read(self, address, size, space_end=None):
+        # returns (address, size) of read transactions that cover the requested range
+        # aligned reads may start before or end after the range, the caller trims the data
+        # space_end is the address after the last byte of the space, aligned reads don't go beyond it
+        end = address + size
+        if self.unaligned_read:
+            return [(x, min(max_block_size, end - x)) for x in range(address, end, max_block_size)]
+        start = address - address % max_block_size
+        if space_end is None:
+            return [(x, max_block_size) for x in range(start, end, max_block_size)]
+        return [(x, min(max_block_size, space_end - x)) for x in range(start, end, max_block_size)]
+
+    def plan_write(self, address, data):
+        # returns write transactions, largest legal ones first
+        #   ("write", address, data)
+        #   ("write_under_mask", address, data, mask)
+        #   ("read_modify_write", address, size, offset, data): data is patched into the block at offset
+        transactions = []
+        pos = address
+        end = address + len(data)
+        while pos < end:
+            length = self.direct_write_length(pos, end - pos)
+            if length:
+                transactions.append(("write", pos, bytes(data[pos-address:pos-address+length])))
+                pos += length
+                continue
+
+            # the remaining bytes don't fit a legal transaction, write a larger block
+            # and preserve the bytes around them
+            block_address, block_size = self.masked_write_block(pos, end)
+            block_end = min(end, block_address + block_size)
+            offset = pos - block_address
+            patch = bytes(data[pos-address:block_end-address])
+            if self.write_under_mask and block_size <= max_masked_block_size:
+                block = bytearray(block_size)
+                mask = bytearray(block_size)
+                block[offset:offset+len(patch)] = patch
+                mask[offset:offset+len(patch)] = b"\xff" * len(patch)
+                transactions.append(("write_under_mask", block_address, bytes(block), bytes(mask)))
+            else:
+                transactions.append(("read_modify_write", block_address, block_size, offset, patch))
+            pos = block_end
+        return transactions
+
+    def direct_write_length(self, address, size):
+        # largest number of bytes that can be written at address without touching other bytes
+        if self.arbitrary_writes:
+            length = min(size, max_block_size)
+            if not self.unaligned_write:
+                # don't cross a block boundary
+                length = min(length, max_block_size - address % max_block_size)
+            return length
+        for length in self.write_lengths:
+            if length <= size and (self.unaligned_write or address % length == 0):
+                return length
+        return 0
+
+    def masked_write_block(self, address, end):
+        # legal block that starts at or before address and covers most of the range
+        # the smallest such block is preferred, it needs the fewest preserved bytes
+        best = None
+        for length in reversed(self.write_lengths):
+            start = address if self.unaligned_write else address - address % length
+            covered = min(end, start + length)
+            if best is None or covered > best[0]:
+                best = (covered, start, length)
+        return best[1:]
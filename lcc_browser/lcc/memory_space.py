@@ -0,0 +1,68 @@
+from construct import Container
+from lcc_browser.lcc.memory_planner import MemoryPlanner
+
+def container_to_dict(container):
+    # plain, serialisable copy of a parsed construct container
+    result = {}
+    for key, value in container.items():
+        if key.startswith("_"): continue
+        if isinstance(value, dict):
+            value = container_to_dict(value)
+        result[key] = value
+    return result
+
+def dict_to_container(d):
+    return Container({key: dict_to_container(value) if isinstance(value, dict) else value for key, value in d.items()})
+
+class AddressSpace:
+    # an address space as reported by GetMemoryConfigurationAddressSpaceInfo
+    def __init__(self, space, lowest_address, highest_address, read_only, description=None):
+        self.space = space
+        self.lowest_address = lowest_address
+        self.highest_address = highest_address
+        self.read_only = read_only
+        self.description = description
+
+    @property
+    def size(self):
+        return self.highest_address + 1 - self.lowest_address
+
+    def clamp(self, address, size):
+        # number of bytes that can be read from address without running past the end of the space
+        return max(0, min(size, self.highest_address + 1 - address))
+
+    def __repr__(self):
+        read_only = ", read only" if self.read_only else ""
+        return f"AddressSpace(0x{self.space:X}, 0x{self.lowest_address:X}-0x{self.highest_address:X}{read_only})"
+
+class NodeMemory:
+    # memory configuration options and address space map of a node
+    def __init__(self, options, spaces):
+        self.options = options # GetMemoryConfigurationOptionsReply
+        self.spaces = spaces # space number -> AddressSpace, only spaces that are present
+        self.planner = MemoryPlanner(options)
+
+    def get_space(self, space):
+        return self.spaces.get(space)
+
+    def clamp(self, space, address, size):
+        info = self.spaces.get(space)
+        if info is None: return size
+        return info.clamp(address, size)
+
+    def space_end(self, space):
+        # address after the last byte of a known space, or None
+        info = self.spaces.get(space)
+        if info is None: return None
+        return info.highest_address + 1
+
+    def to_dict(self):
+        return {
+            "options": container_to_dict(self.options),
+            "spaces": [[x.space, x.lowest_address, x.highest_address, x.read_only, x.description] for x in self.spaces.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        spaces = {x[0]: AddressSpace(*x) for x in d["spaces"]}
+        return cls(dict_to_container(d["options"]), spaces)
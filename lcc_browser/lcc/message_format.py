@@ -124,14 +124,20 @@ VerifiedNodeId = Struct(
     "node_id" / NodeId
 )
 
-OptionalInteractionRejected = Struct(
-    Type("OptionalInteractionRejected"),
-    "error_code" / BitsInteger(16)
+# error codes of rejections, see the message network standard
+# temporary errors may succeed when the request is repeated
+ErrorCode = Struct(
+    "error_code" / Optional(Hex(Int16ub)),
+    "mti" / Optional(Hex(Int16ub)), # MTI of the rejected message, if the node sends it
+    "permanent" / Computed(lambda this: this.error_code is not None and bool(this.error_code & 0x1000)),
+    "temporary" / Computed(lambda this: this.error_code is not None and bool(this.error_code & 0x2000)),
 )
 
-TerminateDueToError = Struct(
-    Type("TerminateDueToError"),
-    "error_code" / BitsInteger(16)
+DatagramReceivedOkFlags = Struct(
+    "flags" / Optional(Int8ub),
+    "reply_pending" / Computed(lambda this: this.flags is not None and bool(this.flags & 0x80)),
+    # the node replies within 2^N seconds, None if it didn't tell
+    "timeout" / Computed(lambda this: 2 ** (this.flags & 0x0f) if this.flags and this.flags & 0x0f else None),
 )
 
 ProtocolSupport = BitStruct(
@@ -175,19 +181,58 @@ ConsumerIdentified = Struct(
     "event_id" / EventId,
 )
 
+class EventRange:
+    # a block of event ids identified by a range message
+    # the lowest mask_bits bits of the base are don't-care bits
+    __slots__ = ("base", "mask_bits")
+
+    def __init__(self, base, mask_bits):
+        self.base = base & ~((1 << mask_bits) - 1)
+        self.mask_bits = mask_bits
+
+    @property
+    def lower(self):
+        return self.base
+
+    @property
+    def upper(self):
+        return self.base | ((1 << self.mask_bits) - 1)
+
+    def encode(self):
+        # the don't-care bits are filled with the complement of the first significant bit
+        if self.mask_bits >= 64: return 0
+        if (self.base >> self.mask_bits) & 1:
+            return self.base
+        return self.base | ((1 << self.mask_bits) - 1)
+
+    def to_bytes(self):
+        return self.encode().to_bytes(8, "big")
+
+    def __contains__(self, event_id):
+        return event_id >> self.mask_bits == self.base >> self.mask_bits
+
+    def __eq__(self, other):
+        return isinstance(other, EventRange) and (self.base, self.mask_bits) == (other.base, other.mask_bits)
+
+    def __hash__(self):
+        return hash((self.base, self.mask_bits))
+
+    def __str__(self):
+        return f"{hex(self.lower)} - {hex(self.upper)}"
+
+    def __repr__(self):
+        return f"EventRange({hex(self.lower)} - {hex(self.upper)})"
+
 class EventIdRangeAdapter(Adapter):
     def _decode(self, obj, context, path):
+        # the mask is given by the run of identical low bits, see event transport standard
         mask_count = 1
-        while (obj >> mask_count) & 1 == obj & 1:
+        while mask_count < 64 and (obj >> mask_count) & 1 == obj & 1:
             mask_count += 1
-        mask = (1 << mask_count) - 1
-        lower_range = obj & (~mask)
-        upper_range = obj | mask
-        return f"{hex(lower_range)} - {hex(upper_range)}"
+        return EventRange(obj, mask_count)
 
     def _encode(self, obj, context, path):
-        # TODO
-        return None
+        return obj.encode()
 
 EventIdRange = EventIdRangeAdapter(BitsInteger(64))
 
@@ -198,7 +243,7 @@ ConsumerRangeIdentified = Struct(
 
 IdentifyProducer = Struct(
     Type("IdentifyProducer"),
-    "event_id_range" / EventIdRange,
+    "event_id" / EventId,
 )
 
 ProducerIdentified = Struct(
@@ -263,8 +308,8 @@ MtiMessage = Struct(
         0x490: VerifyNodeIdGlobal,
         0x170: VerifiedNodeId,
         0x171: VerifiedNodeId,
-         0x68: OptionalInteractionRejected,
-         0xA8: TerminateDueToError,
+         0x68: MtiMultipartType("OptionalInteractionRejected", ErrorCode),
+         0xA8: MtiMultipartType("TerminateDueToError", ErrorCode),
         0x828: Type("ProtocolSupportInquiry"),
         0x668: MtiMultipartType("ProtocolSupportReply", ProtocolSupport),
 
@@ -306,8 +351,8 @@ MtiMessage = Struct(
         0xA08: MtiMultipartType("SimpleNodeIdentInfoReply", SimpleNodeInformation),
 
         # Datagram
-        0xA28: Type("DatagramReceivedOk"),
-        0xA48: Type("DatagramRejected"),
+        0xA28: MtiMultipartType("DatagramReceivedOk", DatagramReceivedOkFlags),
+        0xA48: MtiMultipartType("DatagramRejected", ErrorCode),
 
         # Stream
         0xcc8: Type("MTI_STREAM_INITIATE_REQUEST"),
@@ -411,6 +456,17 @@ WriteMemoryConfiguration = Struct(
     "data" / GreedyBytes
 )
 
+WriteUnderMask = Struct(
+    Type("WriteUnderMask"),
+    "starting_address" / Int32ub,
+    "address_space" / IfThenElse(
+        this._.command & 0b11 == 0, 
+        Byte,
+        Computed(0xFC + (this._.command & 0b11))
+    ),
+    "data" / GreedyBytes # data bytes followed by the same number of mask bytes
+)
+
 WriteMemoryConfigurationReply = Struct(
     Type("WriteMemoryConfigurationReply"),
     "starting_address" / Int32ub,
@@ -473,7 +529,7 @@ GetMemoryConfigurationAddressSpaceInfoReply = Struct(
         "flags" / Byte,
         "read_only" / Computed(this.flags & 1),
         "lowest_address" / IfThenElse(this.flags & 0b10, Int32ub, Computed(0)),
-        "description" / CString("utf8"),
+        "description" / Optional(CString("utf8")),
     )),
 )
 
@@ -497,6 +553,10 @@ MemoryConfiguration = Struct(
         0x01: WriteMemoryConfiguration,
         0x02: WriteMemoryConfiguration,
         0x03: WriteMemoryConfiguration,
+        0x08: WriteUnderMask,
+        0x09: WriteUnderMask,
+        0x0A: WriteUnderMask,
+        0x0B: WriteUnderMask,
         0x10: WriteMemoryConfigurationReply,
         0x11: WriteMemoryConfigurationReply,
         0x12: WriteMemoryConfigurationReply,
@@ -546,6 +606,7 @@ def traverse_subcons(sc, keyfunc, number, save_types=None):
 type_to_mti_map = traverse_subcons(LccFrame.subcon, "mti", None)
 type_to_cc_map = traverse_subcons(LccFrame.subcon, "cc_variable_field", None)
 type_to_memory_config_map = traverse_subcons(DatagramProtocol, "command", None)
+datagram_mti = 0x1C48 # full MTI of datagrams, they are sent as CAN frame types instead
 
 
 ### utilities for waiting on expected responses
@@ -566,6 +627,16 @@ def datagram_response_filter(requestor_alias, responder_alias):
             and frame.type in ["DatagramReceivedOk", "DatagramRejected"]
     return response_filter
 
+def rejection_filter(requestor_alias, responder_alias, request_mti):
+    # matches OptionalInteractionRejected and TerminateDueToError frames that refer to a request
+    # nodes may leave out the rejected MTI, then any request to the node matches
+    def response_filter(frame):
+        if frame.destination_alias != requestor_alias or frame.source_alias != responder_alias: return False
+        if frame.type not in ["OptionalInteractionRejected", "TerminateDueToError"]: return False
+        error = getattr(frame.inner.inner.inner, "inner", None)
+        return error is None or error.mti is None or error.mti == request_mti
+    return response_filter
+
 def response_filter(request_datagram, requestor_alias, responder_alias):
     # returns a filter function that matches valid response frames for a given request
     if request_datagram[0] != 0x20:
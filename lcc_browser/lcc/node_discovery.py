@@ -0,0 +1,133 @@
+import asyncio
+import traceback
+
+class NodeDiscovery:
+    # collects protocol support and simple node information of every node that announces itself
+    # queries run in the connection thread with bounded concurrency, results are published in batches
+
+    def __init__(self, lcc, publish_callback, concurrency=8, batch_interval=.25):
+        self.lcc = lcc
+        self.publish_callback = publish_callback # called with {node_id: info} in the connection thread
+        self.concurrency = concurrency
+        self.batch_interval = batch_interval
+        self.semaphore = None
+        self.nodes = {} # node_id -> info dict
+        self.in_flight = {} # node_id -> task, at most one query per node
+        self.pending = set() # node ids that changed since the last batch was published
+        self.flush_handle = None
+        self.is_running = False
+
+    def start(self):
+        if self.is_running: return
+        self.is_running = True
+        self.lcc.add_listener("VerifiedNodeId", self.on_node_seen)
+        self.lcc.add_listener("InitializationComplete", self.on_node_initialized)
+        self.lcc.add_listener("InitializationCompleteSimple", self.on_node_initialized)
+
+    def stop(self):
+        if not self.is_running: return
+        self.is_running = False
+        self.lcc.remove_listener("VerifiedNodeId", self.on_node_seen)
+        self.lcc.remove_listener("InitializationComplete", self.on_node_initialized)
+        self.lcc.remove_listener("InitializationCompleteSimple", self.on_node_initialized)
+        loop = self.lcc.connection.loop if self.lcc.connection else None
+        if loop and loop.is_running():
+            loop.call_soon_threadsafe(self.cancel)
+        else:
+            self.cancel()
+
+    def cancel(self):
+        for task in self.in_flight.values():
+            task.cancel()
+        self.in_flight = {}
+        if self.flush_handle:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.nodes = {}
+        self.pending = set()
+
+    def forget(self, node_ids):
+        # nodes that left the bus are published again when they return
+        loop = self.lcc.connection.loop if self.lcc.connection else None
+        if loop and loop.is_running():
+            loop.call_soon_threadsafe(self.remove_nodes, node_ids)
+
+    def restore(self, aliases):
+        # nodes that came back after they were forgotten, {node_id: alias}
+        loop = self.lcc.connection.loop if self.lcc.connection else None
+        if loop and loop.is_running():
+            loop.call_soon_threadsafe(self.add_nodes, aliases)
+
+    def add_nodes(self, aliases):
+        for node_id, alias in aliases.items():
+            if alias is not None: self.add_node(node_id, alias)
+
+    def remove_nodes(self, node_ids):
+        for node_id in node_ids:
+            self.nodes.pop(node_id, None)
+            self.pending.discard(node_id)
+
+    def on_node_seen(self, frame):
+        self.add_node(frame.inner.inner.inner.node_id, frame.source_alias)
+
+    def on_node_initialized(self, frame):
+        # a node that (re)started may have new firmware or settings
+        self.add_node(frame.inner.inner.inner.node_id, frame.source_alias, refresh=True)
+
+    def add_node(self, node_id, alias, refresh=False):
+        if not self.is_running: return
+        info = self.nodes.get(node_id)
+        if info is None:
+            info = self.nodes[node_id] = {"node_id": node_id}
+            self.mark_updated(node_id)
+        if info.get("alias") != alias:
+            info["alias"] = alias
+            self.mark_updated(node_id)
+        if refresh:
+            info.pop("protocols", None)
+        self.query(node_id)
+
+    def query(self, node_id):
+        # deduplicates queries, nodes answer VerifyNodeIdGlobal more than once
+        if node_id in self.in_flight: return
+        if "protocols" in self.nodes[node_id]: return
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        task = asyncio.get_running_loop().create_task(self.download_node_details(node_id))
+        self.in_flight[node_id] = task
+        task.add_done_callback(lambda task, node_id=node_id: self.in_flight.pop(node_id, None))
+
+    async def download_node_details(self, node_id):
+        async with self.semaphore:
+            info = self.nodes[node_id]
+            alias = info["alias"]
+            try:
+                protocols = await self.lcc.protocol_support_inquiry(alias)
+                info["protocols"] = [name for name, value in protocols.items() if name != "_io" and value]
+                self.mark_updated(node_id)
+                if "SimpleNodeInformationProtocol" not in info["protocols"]: return
+
+                node_information = await self.lcc.simple_node_information(alias)
+                info |= dict(node_information.fixed_fields)
+                info |= dict(node_information.user_fields)
+                info.pop("_io", None)
+                self.mark_updated(node_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Couldn't download details of node {node_id}:", type(e), e)
+                print(traceback.format_exc())
+
+    def mark_updated(self, node_id):
+        self.pending.add(node_id)
+        if self.flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self.flush_handle = loop.call_later(self.batch_interval, self.flush)
+
+    def flush(self):
+        # publishes one consolidated update of all nodes that changed
+        self.flush_handle = None
+        batch = {node_id: dict(self.nodes[node_id]) for node_id in self.pending if node_id in self.nodes}
+        self.pending = set()
+        if batch and self.publish_callback:
+            self.publish_callback(batch)
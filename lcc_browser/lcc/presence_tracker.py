@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+class PresenceTracker:
+    # tracks which nodes are on the bus without periodic global verification
+    # any frame a node sends marks it alive, nodes that have been quiet for a while
+    # are probed with addressed VerifyNodeId messages, limited by a bus overhead budget
+
+    def __init__(self, lcc, publish_callback, quiet_interval=10, reply_timeout=2, probe_rate=5, tick_interval=.5,
+            seen_callback=None, seen_interval=60):
+        self.lcc = lcc
+        self.publish_callback = publish_callback # called with {node_id: is_present} in the connection thread
+        self.seen_callback = seen_callback # called with {node_id: (alias, time.time() of the last frame)}
+        self.seen_interval = seen_interval # seconds between calls of seen_callback
+        self.seen_published = time.monotonic()
+        self.quiet_interval = quiet_interval # seconds without frames before a node is probed
+        self.reply_timeout = reply_timeout # seconds a probed node has to answer
+        self.probe_rate = probe_rate # maximum number of probe frames per second
+        self.tick_interval = tick_interval
+        self.last_seen = {} # alias -> time of the last received frame
+        self.probes = {} # alias -> time the outstanding probe was sent
+        self.identify_probes = {} # alias -> time an alias of unknown node id was last probed
+        self.present = {} # node_id -> alias of nodes considered present
+        self.changes = {}
+        self.tick_handle = None
+        self.is_running = False
+
+    def start(self):
+        if self.is_running: return
+        self.is_running = True
+        self.lcc.add_listener(None, self.on_frame)
+        self.lcc.add_listener("VerifiedNodeId", self.on_node_id)
+        self.lcc.add_listener("InitializationComplete", self.on_node_id)
+        self.lcc.add_listener("InitializationCompleteSimple", self.on_node_id)
+        self.lcc.add_listener("AliasMapDefinitionFrame", self.on_alias_map_definition)
+        self.lcc.add_listener("AliasMapResetFrame", self.on_alias_map_reset)
+        try:
+            self.lcc.run_future(self.begin())
+        except RuntimeError as e:
+            print("Can't track node presence:", e)
+
+    def stop(self):
+        if not self.is_running: return
+        self.is_running = False
+        self.lcc.remove_listener(None, self.on_frame)
+        self.lcc.remove_listener("VerifiedNodeId", self.on_node_id)
+        self.lcc.remove_listener("InitializationComplete", self.on_node_id)
+        self.lcc.remove_listener("InitializationCompleteSimple", self.on_node_id)
+        self.lcc.remove_listener("AliasMapDefinitionFrame", self.on_alias_map_definition)
+        self.lcc.remove_listener("AliasMapResetFrame", self.on_alias_map_reset)
+        loop = self.lcc.connection.loop if self.lcc.connection else None
+        if loop and loop.is_running():
+            loop.call_soon_threadsafe(self.reset)
+        else:
+            self.reset()
+
+    def reset(self):
+        if self.tick_handle:
+            self.tick_handle.cancel()
+            self.tick_handle = None
+        self.last_seen = {}
+        self.probes = {}
+        self.identify_probes = {}
+        self.present = {}
+        self.changes = {}
+
+    async def begin(self):
+        # one global verification finds the nodes that are already on the bus
+        # everything after that is learned from the bus traffic
+        self.lcc.send_mti_frame("VerifyNodeIdGlobal")
+        self.schedule_tick()
+
+    def schedule_tick(self):
+        if not self.is_running: return
+        loop = asyncio.get_running_loop()
+        self.tick_handle = loop.call_later(self.tick_interval, self.tick)
+
+    def on_frame(self, frame):
+        if not self.is_running: return
+        alias = frame.source_alias
+        if alias == self.lcc.node_alias: return
+        self.last_seen[alias] = time.monotonic()
+        self.probes.pop(alias, None)
+        node_id = self.lcc.alias_to_node_id.get(alias)
+        if node_id is not None:
+            self.set_present(node_id, alias)
+
+    def on_node_id(self, frame):
+        if not self.is_running: return
+        self.set_present(frame.inner.inner.inner.node_id, frame.source_alias)
+
+    def on_alias_map_definition(self, frame):
+        if not self.is_running: return
+        self.set_present(frame.inner.inner.node_id, frame.source_alias)
+
+    def on_alias_map_reset(self, frame):
+        # the node released its alias, it's offline until it announces itself again
+        if not self.is_running: return
+        self.last_seen.pop(frame.source_alias, None)
+        self.probes.pop(frame.source_alias, None)
+        self.set_absent(frame.inner.inner.node_id)
+
+    def set_present(self, node_id, alias):
+        previous_alias = self.present.get(node_id)
+        if previous_alias == alias: return
+        if previous_alias is not None:
+            # the node got a new alias, forget the old one
+            self.last_seen.pop(previous_alias, None)
+            self.probes.pop(previous_alias, None)
+        self.present[node_id] = alias
+        self.changes[node_id] = True
+
+    def set_absent(self, node_id):
+        if self.present.pop(node_id, None) is None: return
+        self.changes[node_id] = False
+
+    def tick(self):
+        self.tick_handle = None
+        now = time.monotonic()
+
+        # nodes that didn't answer their probe have left the bus
+        for alias, sent in list(self.probes.items()):
+            if now - sent > self.reply_timeout:
+                del self.probes[alias]
+                self.last_seen.pop(alias, None)
+                node_id = self.lcc.alias_to_node_id.get(alias)
+                if node_id is not None and self.present.get(node_id) == alias:
+                    self.set_absent(node_id)
+
+        # aliases of unknown nodes are probed first to learn their node id,
+        # then the nodes that have been quiet for the longest time
+        budget = max(1, int(self.probe_rate * self.tick_interval))
+        candidates = []
+        for alias, seen in self.last_seen.items():
+            if alias in self.probes: continue
+            if alias not in self.lcc.alias_to_node_id:
+                last_probe = self.identify_probes.get(alias)
+                if last_probe is None or now - last_probe > self.quiet_interval:
+                    candidates.append((0, alias))
+            elif now - seen > self.quiet_interval:
+                candidates.append((seen, alias))
+        candidates.sort()
+        for seen, alias in candidates[:budget]:
+            if seen == 0: self.identify_probes[alias] = now
+            self.probes[alias] = now
+            self.lcc.send_mti_frame("VerifyNodeIdAddressed", dst_alias=alias)
+
+        if self.changes:
+            changes = self.changes
+            self.changes = {}
+            if self.publish_callback: self.publish_callback(changes)
+
+        if self.seen_callback and now - self.seen_published >= self.seen_interval:
+            # last seen times of the present nodes that sent frames since the last call
+            wall_time = time.time()
+            seen = {}
+            for node_id, alias in self.present.items():
+                last = self.last_seen.get(alias)
+                if last is not None and last > self.seen_published:
+                    seen[node_id] = (alias, wall_time - (now - last))
+            self.seen_published = now
+            if seen: self.seen_callback(seen)
+        self.schedule_tick()
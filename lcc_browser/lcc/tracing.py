@@ -0,0 +1,119 @@
+""" Records timed spans of protocol operations and exports them as Chrome trace."""
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+
+class NullSpan:
+    # stands in for a span while tracing is disabled, so traced code doesn't need checks
+    def phase(self, name):
+        pass
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+null_span = NullSpan()
+
+class Span:
+    # a traced operation, divided into named phases that last until the next phase or the end
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.track = tracer.current_track()
+        self.start = time.perf_counter()
+        self.phases = [] # (name, start time)
+        self.end = None
+
+    def phase(self, name):
+        self.phases.append((name, time.perf_counter()))
+
+    def set(self, **args):
+        self.args |= args
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.finish(self)
+        return False
+
+class Tracer:
+    # records spans of protocol operations as Chrome trace events, see chrome://tracing or ui.perfetto.dev
+    # each asyncio task gets its own track, operations of a task nest properly
+    def __init__(self, max_events=200000):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.events = deque(maxlen=max_events) # the oldest events are dropped
+        self.tracks = {} # (task or thread id, name) -> (track id, name)
+        self.origin = time.perf_counter()
+
+    def span(self, name, **args):
+        if not self.enabled: return null_span
+        return Span(self, name, args)
+
+    def start(self):
+        self.clear()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+            self.tracks = {}
+        self.origin = time.perf_counter()
+
+    def current_track(self):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        # keyed by id and name, so finished tasks aren't kept alive and reused ids get a new track
+        if task is not None:
+            key = (id(task), task.get_name())
+        else:
+            key = (threading.get_ident(), threading.current_thread().name)
+        with self.lock:
+            track = self.tracks.get(key)
+            if track is None:
+                track = self.tracks[key] = (len(self.tracks) + 1, key[1])
+        return track[0]
+
+    def to_us(self, t):
+        return round((t - self.origin) * 1e6, 1)
+
+    def finish(self, span):
+        # the span becomes a complete event, its phases nested events inside it
+        events = [{"name": span.name, "cat": "lcc", "ph": "X", "pid": 1, "tid": span.track,
+            "ts": self.to_us(span.start), "dur": round((span.end - span.start) * 1e6, 1), "args": span.args}]
+        ends = [t for name, t in span.phases[1:]] + [span.end]
+        for (name, start), end in zip(span.phases, ends):
+            events.append({"name": name, "cat": "phase", "ph": "X", "pid": 1, "tid": span.track,
+                "ts": self.to_us(start), "dur": round((end - start) * 1e6, 1)})
+        with self.lock:
+            self.events.extend(events)
+
+    def export(self, filename):
+        # writes the recorded events as Chrome trace JSON
+        with self.lock:
+            events = list(self.events)
+            tracks = list(self.tracks.values())
+        metadata = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": track_id, "args": {"name": name}}
+            for track_id, name in tracks]
+        with open(filename, "w") as stream:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, stream)
+        return len(events)
+
+tracer = Tracer()
@@ -1,31 +1,41 @@
 import wx
 import asyncio
-import traceback
+import time
 from lcc_browser.templates.lcc_nodes_viewer import *
-from threading import Thread, Timer
+from threading import Thread
 from collections import defaultdict
 from lxml import etree
-from lcc_browser.xml_to_dict import etree_to_dict
-from lcc_browser.wx_controls.lcc_cdi_generator import SegmentGenerator, generate_acdi_panel
+from lcc_browser.cdi_layout import CdiStreamCompiler
+from lcc_browser.wx_controls.lcc_cdi_generator import SegmentGenerator, AcdiGenerator
 from lcc_browser.cdi_registry import CdiRegistry
 from lcc_browser.wx_events import *
+from lcc_browser.lcc.node_discovery import NodeDiscovery
+from lcc_browser.lcc.presence_tracker import PresenceTracker
+from lcc_browser.settings import settings
+from lcc_browser.node_inventory import inventory
+from lcc_browser.lcc.memory_space import NodeMemory
+from lcc_browser.cdi_template import CdiTemplate, capture_template, apply_template, matching_nodes
+from lcc_browser.layout_backup import format_report
+from lcc_browser.event_id_index import event_id_index
 
 
 class LccNodesViewer(LccNodesViewerTemplate):
-    query_interval = 5
-
     def __init__(self, parent):
         super().__init__(parent)
         self.lcc = parent.lcc
         self.Bind(wx.EVT_SHOW, self.on_show)
         self.Bind(wx.EVT_WINDOW_DESTROY, self.on_destroy)
-        self.Bind(EVT_LCC, self.on_lcc)
         self.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_node_selected)
+        self.notebook.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.on_page_changed)
         self.button_refresh.Bind(wx.EVT_BUTTON, self.on_refresh)
-        self.refresh_timer = Timer(0, lambda: None)
-        self.node_id_list = set()
-        self.node_id_reported = set()
+        self.button_map_events.Bind(wx.EVT_BUTTON, self.on_map_events)
+        self.button_find_event.Bind(wx.EVT_BUTTON, self.on_find_event)
+        self.button_save_template.Bind(wx.EVT_BUTTON, self.on_save_template)
+        self.button_apply_template.Bind(wx.EVT_BUTTON, self.on_apply_template)
+        self.node_filter.Bind(wx.EVT_TEXT, self.on_filter)
+        self.node_filter.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN, self.on_filter_cancel)
         self.node_info = defaultdict(dict) # node id to info
+        self.discovered_versions = {} # node id -> software version reported in this session, node_info also holds stored ones
         self.node_alias = None # selected node alias
 
         # this window only lets one async future run at the same time
@@ -35,152 +45,224 @@ class LccNodesViewer(LccNodesViewerTemplate):
         self.statusbar = self.CreateStatusBar(1, wx.STB_DEFAULT_STYLE)
         self.selected_node_id = None
         self.cdi_registry = None
+        self.page_generators = [] # generators of CDI notebook pages, built when first shown
+        self.discovery = NodeDiscovery(self.lcc, self.publish_discovery)
+        # quiet nodes are probed individually, the probe rate limits the bus overhead in frames per second
+        self.presence = PresenceTracker(self.lcc, self.publish_presence,
+            quiet_interval=settings.get("presence_quiet_interval", 10),
+            probe_rate=settings.get("presence_probe_rate", 5),
+            seen_callback=self.publish_seen)
+        # nodes that left the bus are removed from the list after node_expiry seconds, 0 keeps them
+        self.node_expiry = settings.get("node_expiry", 600)
+        self.gone_since = {} # node_id -> time.monotonic() when the node left
+        self.expiry_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_expiry_timer, self.expiry_timer)
 
     def on_show(self, evt):
         if evt.IsShown():
-            self.query_nodes()
+            self.load_inventory()
+            self.discovery.start()
+            self.presence.start()
             self.node_alias = 0x581
+            if self.node_expiry: self.expiry_timer.Start(10000)
         else:
-            self.refresh_timer.cancel()
+            self.expiry_timer.Stop()
+            self.gone_since = {}
+            self.presence.stop()
+            self.discovery.stop()
             self.cancel_future()
             # reset forms
             self.node_info = defaultdict(dict)
-            self.node_id_list = set()
-            self.node_id_reported = set()
-            self.node_list.DeleteAllItems()
+            self.discovered_versions = {}
+            self.node_list.clear()
             self.node_info_text.SetValue("")
-            for i in range(1, self.notebook.GetPageCount()):
-                self.notebook.DeletePage(1)
+            self.clear_cdi_pages()
 
     def on_destroy(self, evt):
+        self.expiry_timer.Stop()
+        self.presence.stop()
+        self.discovery.stop()
         self.cancel_future()
-        self.refresh_timer.cancel()
 
 
-    def query_nodes(self):
-        self.refresh_timer.cancel()
-        self.refresh_timer = Timer(self.query_interval, self.query_nodes)
-        self.refresh_timer.start()
-        if self.future and not self.future.done():
-            # don't confuse nodes by sending messages from multiple threads
+    def load_inventory(self):
+        # known nodes are shown right away and refreshed when they're seen on the bus
+        try:
+            known = inventory.load()
+        except Exception as e:
+            print("Couldn't load node inventory:", type(e), e)
             return
+        for node_id, info in known.items():
+            self.node_info[node_id] |= info
+        self.node_list.update_nodes(known, False)
 
-        # remove nodes that have timed out from list view
-        i = 0
-        while i < self.node_list.GetItemCount():
-            node_id = self.node_list.GetItem(i, 1).GetText()
-            if node_id not in self.node_id_reported:
-                self.node_list.DeleteItem(i)
-                self.node_id_list.remove(node_id)
-            else:
-                i += 1
+    def on_filter(self, evt):
+        # matches manufacturer, model, name and node id
+        self.node_list.set_filter(self.node_filter.GetValue())
 
-        self.node_id_reported = set()
-        self.lcc.send_mti_frame("VerifyNodeIdGlobal")
+    def on_filter_cancel(self, evt):
+        self.node_filter.SetValue("")
 
-    async def download_node_details(self, node_id, node_alias):
-        selected_node_alias = self.lcc.node_id_to_alias.get(self.selected_node_id)
-        is_selected = node_alias == selected_node_alias
+    def publish_discovery(self, batch):
+        # runs in the connection thread, the inventory is updated incrementally
+        for node_id, info in batch.items():
+            if info.get("software_version") is not None: self.discovered_versions[node_id] = info["software_version"]
         try:
-            protocols = await self.lcc.protocol_support_inquiry(node_alias)
-
-            wx.CallAfter(self.refresh_node_list)
-            if is_selected:
-                wx.CallAfter(self.refresh_node_info_text)
-
-            has_sni = False
-            self.node_info[node_id]["protocols"] = ""
-            for name, value in protocols.items():
-                if name == "_io": continue
-                if value:
-                    self.node_info[node_id]["protocols"] += f"  {name}\n"
-                    if name == "SimpleNodeInformationProtocol":
-                        has_sni = True
-            if not has_sni: return
+            inventory.update_many(batch)
+        except Exception as e:
+            print("Couldn't update node inventory:", type(e), e)
+        wx.CallAfter(self.on_nodes_discovered, batch)
 
-            node_information = await self.lcc.simple_node_information(node_alias)
-            self.node_info[node_id] |= dict(node_information.fixed_fields)
-            self.node_info[node_id] |= dict(node_information.user_fields)
-            wx.CallAfter(self.refresh_node_list)
-            if is_selected:
-                wx.CallAfter(self.refresh_node_info_text)
+    def publish_presence(self, changes):
+        try:
+            for node_id, is_present in changes.items():
+                if is_present: inventory.mark_seen(node_id, self.lcc.node_id_to_alias.get(node_id))
         except Exception as e:
-            print(e)
-            print(traceback.format_exc())
+            print("Couldn't update node inventory:", type(e), e)
+        wx.CallAfter(self.on_presence_changed, changes)
+
+    def publish_seen(self, seen):
+        # runs in the connection thread with the last seen times of present nodes, see PresenceTracker.seen_interval
+        try:
+            inventory.mark_seen_many(seen)
+        except Exception as e:
+            print("Couldn't update node inventory:", type(e), e)
+
+    def on_presence_changed(self, changes):
+        # nodes that left the bus are greyed out, nodes that return are queried again
+        # new nodes are added by the discovery engine
+        if not self.IsShown(): return
+        gone = {node_id for node_id, is_present in changes.items() if not is_present}
+        back = {node_id for node_id, is_present in changes.items() if is_present}
+        now = time.monotonic()
+        for node_id in gone: self.gone_since[node_id] = now
+        for node_id in back: self.gone_since.pop(node_id, None)
+        if gone:
+            self.discovery.forget(gone)
+            self.node_list.set_present(gone, False)
+        if back:
+            self.node_list.set_present(back, True)
+            self.discovery.restore({node_id: self.lcc.node_id_to_alias.get(node_id) for node_id in back})
 
+    def on_expiry_timer(self, evt):
+        # only the rows of the expired nodes and the rows below them are repainted
+        now = time.monotonic()
+        expired = [node_id for node_id, since in self.gone_since.items() if now - since >= self.node_expiry]
+        if not expired: return
+        for node_id in expired:
+            del self.gone_since[node_id]
+            self.node_info.pop(node_id, None)
+        self.node_list.expire(expired)
 
-    def on_lcc(self, evt):
+    def on_nodes_discovered(self, batch):
+        # consolidated update from the discovery engine
         if not self.IsShown(): return
-        if evt.frame.type == "VerifiedNodeId":
-            node_id = evt.frame.inner.inner.inner.node_id
-            self.node_id_reported.add(node_id)
-            if node_id not in self.node_id_list:
-                self.node_list.Append(("Node", node_id))
-                self.node_id_list.add(node_id)
-            if "protocols" not in self.node_info[node_id]:
-                self.lcc.run_future(self.download_node_details(node_id, evt.frame.source_alias))
+        for node_id, info in batch.items():
+            self.node_info[node_id] |= info
+            self.gone_since.pop(node_id, None)
+        self.node_list.update_nodes(batch, True)
+        if self.selected_node_id in batch:
+            self.refresh_node_info_text()
 
     async def read_cdi(self, node_alias):
         wx.CallAfter(self.statusbar.SetStatusText, "Reading node config")
         def progress_callback(n):
             wx.CallAfter(self.statusbar.SetStatusText, f"Reading node config {n}")
         try:
-            options = await self.lcc.read_memory_options(node_alias)
-            # TODO: support more restrictive node read/write alignment
-            # not sure if there are LCC devices out there that need aligned io
-            is_node_supported = options.write_lengths.arbitrary and \
-                options.available_commands.unaligned_write and \
-                options.available_commands.unaligned_read
-            if not is_node_supported:
-                wx.CallAfter(self.statusbar.SetStatusText, "Error: Unsupported node configuration")
-                return
-            cdi = await self.lcc.read_cdi(node_alias, progress_callback)
+            # memory options and address spaces are cached per node and kept in the inventory
+            # reads and writes are planned to match the node's alignment and write lengths
+            # the stored layout is only used while the node runs the firmware it was read from
+            node_id = self.lcc.alias_to_node_id.get(node_alias)
+            if node_id is not None and node_id not in self.lcc.node_memory:
+                # discovery usually knows the version already, SNIP is only asked when it doesn't
+                software_version = self.discovered_versions.get(node_id)
+                if software_version is None: software_version = await self.read_software_version(node_alias)
+                memory = inventory.get_memory(node_id, software_version) if software_version is not None else None
+                if memory: self.lcc.node_memory[node_id] = NodeMemory.from_dict(memory)
+                node_memory = await self.lcc.read_node_memory(node_alias)
+                if not memory: inventory.set_memory(node_id, node_memory, software_version)
+            else:
+                node_memory = await self.lcc.read_node_memory(node_alias)
+            # segments are compiled while the CDI is downloaded and shown as soon as they're complete
+            compiler = CdiStreamCompiler()
+            wx.CallAfter(self.begin_cdi, compiler.layout)
+            def data_callback(data):
+                segments = compiler.feed(data)
+                if segments:
+                    layout = compiler.layout
+                    wx.CallAfter(self.add_cdi_segments, len(layout.groups), len(layout.fields), segments)
+            cdi = await self.lcc.read_cdi(node_alias, progress_callback, data_callback)
+            if not cdi: return
+            layout = compiler.close()
+            if node_id is not None:
+                if (inventory.get(node_id) or {}).get("cdi_digest") != layout.digest:
+                    event_id_index.forget_layout(node_id)
+                inventory.set_cdi_layout(node_id, layout)
+        except etree.XMLSyntaxError as e:
+            print("Error while parsing CDI", type(e), e)
+            wx.CallAfter(self.statusbar.SetStatusText, "Error while parsing CDI XML data. Try again")
+            return
         except Exception as e:
             print("Error while reading CDI", type(e), e)
             wx.CallAfter(self.statusbar.SetStatusText, str(e))
             return
-        if cdi:
-            wx.CallAfter(self.show_cdi, cdi)
+        wx.CallAfter(self.end_cdi, len(layout.groups), len(layout.fields))
+
+    async def read_software_version(self, node_alias):
+        # None if the node doesn't tell
+        try:
+            node_information = await self.lcc.simple_node_information(node_alias)
+            return getattr(node_information.fixed_fields, "software_version", None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("Couldn't read software version:", type(e), e)
+            return None
 
-    def show_cdi(self, cdi):
+    def clear_cdi_pages(self):
+        self.page_generators = []
         for i in range(1, self.notebook.GetPageCount()):
             self.notebook.DeletePage(1)
 
-        try:
-            cdi = etree.fromstring(cdi)
-        except Exception as e:
-            self.statusbar.SetStatusText("Error while parsing CDI XML data. Try again")
-            return
+    def begin_cdi(self, layout):
+        self.clear_cdi_pages()
 
-        # load CDI
+        # bind widgets to the compiled CDI, which is still empty at this point
         update_status = lambda status: wx.CallAfter(self.statusbar.SetStatusText, status)
-        self.cdi_registry = CdiRegistry(self.lcc, self.node_alias, update_status)
-
-        acdi = None
-        for element in list(cdi):
-            if element.tag == "identification":
-                identification = etree_to_dict(element).get("identification")
-                for tag, element in identification.items():
-                    print(tag, element)
-            elif element.tag == "acdi":
-                acdi = element
-            elif element.tag == "segment":
-                sg = SegmentGenerator(element, self.notebook, self.cdi_registry)
-                panel = sg.get_panel()
-                if panel:
-                    self.notebook.AddPage(panel, sg.get_name())
-        if not acdi is None:
-            panel = generate_acdi_panel(element, self.notebook, self.cdi_registry)
-            self.notebook.AddPage(panel, "ID")
+        self.cdi_registry = CdiRegistry(self.lcc, self.node_alias, layout, update_status)
+
+    def add_cdi_segments(self, group_count, field_count, segments):
+        # pages start out empty, controls are generated when a page is first selected
+        self.cdi_registry.update_entries(group_count, field_count)
+        for group_index in segments:
+            generator = SegmentGenerator(group_index, self.notebook, self.cdi_registry)
+            self.notebook.AddPage(generator.get_panel(), generator.get_name())
+            self.page_generators.append(generator)
+
+    def end_cdi(self, group_count, field_count):
+        self.cdi_registry.update_entries(group_count, field_count)
+        layout = self.cdi_registry.layout
+        for tag, element in layout.identification.items():
+            print(tag, element)
+        if layout.acdi:
+            generator = AcdiGenerator(self.notebook, self.cdi_registry)
+            self.notebook.AddPage(generator.get_panel(), generator.get_name())
+            self.page_generators.append(generator)
+
+    def on_page_changed(self, evt):
+        i = evt.GetSelection()
+        if i >= 1 and i-1 < len(self.page_generators):
+            self.page_generators[i-1].build()
+        evt.Skip()
 
-        self.future, self.cancel_future = self.lcc.run_future(self.refresh_memory())
-            
     # load memory values from node
     async def refresh_memory(self):
         if self.cdi_registry is None: return
         try:
-            for i, entry in enumerate(self.cdi_registry.entries):
-                progress = f"({i}/{len(self.cdi_registry.entries)})"
+            # only controls that have been generated are refreshed
+            entries = self.cdi_registry.visible_entries()
+            for i, entry in enumerate(entries):
+                progress = f"({i}/{len(entries)})"
                 wx.CallAfter(self.statusbar.SetStatusText, f"Reading value {entry.name} {progress}")
                 await self.cdi_registry.read_memory_async(entry)
                 await asyncio.sleep(.001) # some delay makes some slow nodes behave less buggy
@@ -191,13 +273,106 @@ class LccNodesViewer(LccNodesViewerTemplate):
     def on_refresh(self, evt):
         self.future, self.cancel_future = self.lcc.run_future(self.refresh_memory())
 
+    async def map_events(self):
+        # identifies the events of all nodes, one node at a time
+        def progress_callback(i, count, node_id):
+            wx.CallAfter(self.statusbar.SetStatusText, f"Identifying events of node {node_id} ({i}/{count})")
+        try:
+            await self.lcc.event_map.crawl(progress_callback=progress_callback)
+            wx.CallAfter(self.statusbar.SetStatusText, "Done")
+            wx.CallAfter(self.refresh_node_info_text)
+        except Exception as e:
+            print("Error while mapping events", type(e), e)
+            wx.CallAfter(self.statusbar.SetStatusText, str(e))
+
+    def on_map_events(self, evt):
+        self.cancel_future()
+        self.future, self.cancel_future = self.lcc.run_future(self.map_events())
+
+    def on_find_event(self, evt):
+        # shows the fields that hold an event id, and its producers and consumers
+        dialog = wx.TextEntryDialog(self, "Event ID", "Find event")
+        if dialog.ShowModal() != wx.ID_OK: return
+        try:
+            event_id = int(dialog.GetValue().strip().replace(".", ""), 16)
+        except ValueError:
+            self.statusbar.SetStatusText("Invalid event ID")
+            return
+        lines = ["Configured in (nodes whose memory has been read or backed up):"]
+        lines += [f"  {node_id} {path}" + (f" #{','.join([str(i+1) for i in indices])}" if indices else "")
+            for node_id, path, indices in event_id_index.lookup(event_id)] or ["  -"]
+        event_map = self.lcc.event_map
+        lines.append("Producers:")
+        lines += [f"  {node_id} ({status})" for node_id, status in event_map.who_produces(event_id).items()] or ["  -"]
+        lines.append("Consumers:")
+        lines += [f"  {node_id} ({status})" for node_id, status in event_map.who_consumes(event_id).items()] or ["  -"]
+        wx.MessageDialog(self, "\n".join(lines), "Find event", wx.OK).ShowModal()
+
+    def on_save_template(self, evt):
+        # captures the configuration of the selected node
+        if self.cdi_registry is None or not self.cdi_registry.layout.digest:
+            self.statusbar.SetStatusText("Select a node and wait until its CDI is loaded")
+            return
+        dialog = wx.FileDialog(self, "Save configuration template", wildcard="Templates (*.json)|*.json",
+            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        if dialog.ShowModal() == wx.ID_CANCEL: return
+        filename = dialog.GetPath()
+        async def save():
+            try:
+                wx.CallAfter(self.statusbar.SetStatusText, "Capturing template")
+                template = await capture_template(self.cdi_registry)
+                template.save(filename)
+                wx.CallAfter(self.statusbar.SetStatusText, f"Saved {len(template.values)} values")
+            except Exception as e:
+                print("Error while capturing template", type(e), e)
+                wx.CallAfter(self.statusbar.SetStatusText, str(e))
+        self.cancel_future()
+        self.future, self.cancel_future = self.lcc.run_future(save())
+
+    def on_apply_template(self, evt):
+        # writes a template to all nodes on the bus with the same CDI
+        dialog = wx.FileDialog(self, "Apply configuration template", wildcard="Templates (*.json)|*.json",
+            style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
+        if dialog.ShowModal() == wx.ID_CANCEL: return
+        try:
+            template = CdiTemplate.load(dialog.GetPath())
+        except Exception as e:
+            wx.MessageDialog(self, f"Couldn't load template: {e}", "Error", wx.OK|wx.ICON_ERROR).ShowModal()
+            return
+        nodes = matching_nodes(self.lcc, template)
+        if not nodes:
+            self.statusbar.SetStatusText("No nodes on the bus")
+            return
+        node_ids = list(nodes)
+        notes = {"match": "", "unknown": " (CDI is checked first)", "different": " (different CDI, will be skipped)"}
+        message = f"Write the template to {len(node_ids)} nodes?\n" + "\n".join([node_id + notes[status] for node_id, status in nodes.items()])
+        if wx.MessageDialog(self, message, "Apply template", wx.OK|wx.CANCEL).ShowModal() != wx.ID_OK: return
+
+        def progress_callback(node_id, status):
+            wx.CallAfter(self.statusbar.SetStatusText, f"{node_id} {status}")
+        async def apply():
+            try:
+                report = await apply_template(self.lcc, template, node_ids, progress_callback=progress_callback)
+                text = format_report(report)
+            except Exception as e:
+                text = f"{type(e).__name__}: {e}"
+            def show():
+                self.statusbar.SetStatusText("Template applied")
+                wx.MessageDialog(self, text, "Template report", wx.OK).ShowModal()
+            wx.CallAfter(show)
+        self.cancel_future()
+        self.future, self.cancel_future = self.lcc.run_future(apply())
+
     def on_node_selected(self, evt):
-        i = self.node_list.GetNextSelected(-1)
-        if i == -1: return
-        node_id = self.node_list.GetItem(i, 1).GetText()
+        node_id = self.node_list.selected_node_id()
+        if node_id is None: return
         self.selected_node_id = node_id
 
         self.node_alias = self.lcc.node_id_to_alias.get(node_id)
+        self.refresh_node_info_text()
+        if self.node_alias is None:
+            self.statusbar.SetStatusText("Node hasn't been seen on the bus")
+            return
         protocols = self.node_info[node_id].get("protocols")
         if protocols is None:
             print("Error: Node didn't send protocol support yet.")
@@ -206,32 +381,27 @@ class LccNodesViewer(LccNodesViewerTemplate):
             self.cancel_future()
             async_func = self.read_cdi(self.node_alias)
             self.future, self.cancel_future = self.lcc.run_future(async_func)
-        self.refresh_node_info_text()
-
-    def refresh_node_list(self):
-        for i in range(self.node_list.GetItemCount()):
-            node_id = self.node_list.GetItem(i, 1).GetText()
-            info = self.node_info[node_id]
-            if info.get("manufacturer_name"):
-                # display a human-friendly node name
-                manufacturer_name = info['manufacturer_name']
-                model_name = info['model_name']
-                node_name = info['node_name']
-                node_name = f"{manufacturer_name} {model_name} {node_name}"
-                self.node_list.SetItemText(i, node_name)
 
     def refresh_node_info_text(self):
         node_id = self.selected_node_id
         info = self.node_info.get(node_id)
+        if info is None: return
+        protocols = "".join([f"  {name}\n" for name in info.get("protocols", [])])
+        event_map = self.lcc.event_map
+        produced = len(event_map.producers.node_events(node_id))
+        consumed = len(event_map.consumers.node_events(node_id))
+        last_seen = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(info["last_seen"])) if info.get("last_seen") else "never"
         text = \
 f"""Node ID {node_id}
 Node Alias {self.node_alias}
+Last seen {last_seen}
 {info.get("manufacturer_name")} {info.get("model_name")}
 Hardware version {info.get("hardware_version")}
 Software version {info.get("software_version")}
 Node name {info.get("node_name")}
 Node description {info.get("node_description")}
+Produces {produced} events or ranges, consumes {consumed}
 Supported Protocols:
-{info.get("protocols")}
+{protocols}
 """
         self.node_info_text.SetValue(text)
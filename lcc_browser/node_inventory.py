@@ -0,0 +1,166 @@
+""" Persistent inventory of the nodes that have been seen on the bus."""
+import os
+import json
+import time
+import sqlite3
+from threading import Lock
+from lcc_browser.settings import data_directory
+from lcc_browser.cdi_layout import CdiLayout, layout_cache
+
+inventory_filename = os.path.join(data_directory, "inventory.sqlite")
+
+schema = """
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id TEXT PRIMARY KEY,
+    alias INTEGER,
+    last_seen REAL,
+    protocols TEXT, -- json list of protocol names
+    snip TEXT, -- json dict of simple node information fields
+    memory TEXT, -- json NodeMemory, memory options and address spaces
+    cdi_digest TEXT REFERENCES cdi_layouts(digest)
+);
+CREATE INDEX IF NOT EXISTS nodes_last_seen ON nodes(last_seen);
+CREATE INDEX IF NOT EXISTS nodes_cdi_digest ON nodes(cdi_digest);
+CREATE TABLE IF NOT EXISTS cdi_layouts (
+    digest TEXT PRIMARY KEY,
+    layout TEXT -- json CdiLayout
+);
+"""
+
+snip_fields = ["manufacturer_name", "model_name", "hardware_version", "software_version", "node_name", "node_description"]
+
+class NodeInventory:
+    # node info dicts use the keys of the nodes viewer:
+    # node_id, alias, last_seen, protocols, cdi_digest and the SNIP fields
+    # the database may be used from the GUI and the connection thread
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.db = None
+        self.lock = Lock()
+
+    def open(self):
+        if self.db: return self.db
+        filename = self.filename or inventory_filename
+        if filename != ":memory:":
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.executescript(schema)
+        return self.db
+
+    def close(self):
+        with self.lock:
+            if self.db:
+                self.db.close()
+                self.db = None
+
+    def row_to_info(self, row):
+        node_id, alias, last_seen, protocols, snip, memory, cdi_digest = row
+        info = {"node_id": node_id, "alias": alias, "last_seen": last_seen, "cdi_digest": cdi_digest}
+        if protocols is not None: info["protocols"] = json.loads(protocols)
+        if snip is not None: info |= json.loads(snip)
+        return info
+
+    def load(self):
+        # all known nodes, most recently seen first
+        with self.lock:
+            rows = self.open().execute("SELECT * FROM nodes ORDER BY last_seen DESC").fetchall()
+        return {row[0]: self.row_to_info(row) for row in rows}
+
+    def get(self, node_id):
+        with self.lock:
+            row = self.open().execute("SELECT * FROM nodes WHERE node_id = ?", (node_id,)).fetchone()
+        return self.row_to_info(row) if row else None
+
+    def update(self, node_id, info):
+        # stores the keys of info that belong to the inventory, other columns are left alone
+        self.update_columns(node_id, self.info_to_columns(info))
+
+    def info_to_columns(self, info):
+        columns = {}
+        if "alias" in info: columns["alias"] = info["alias"]
+        if "last_seen" in info: columns["last_seen"] = info["last_seen"]
+        if "protocols" in info: columns["protocols"] = json.dumps(info["protocols"])
+        if "cdi_digest" in info: columns["cdi_digest"] = info["cdi_digest"]
+        snip = {key: info[key] for key in snip_fields if key in info}
+        if snip: columns["snip"] = json.dumps(snip)
+        return columns
+
+    def update_columns(self, node_id, columns):
+        self.update_rows({node_id: columns})
+
+    def update_rows(self, rows):
+        # {node_id: columns} in one transaction
+        with self.lock:
+            db = self.open()
+            with db:
+                for node_id, columns in rows.items():
+                    if not columns: continue
+                    names = ", ".join(columns)
+                    placeholders = ", ".join(["?"] * len(columns))
+                    assignments = ", ".join([f"{name} = excluded.{name}" for name in columns])
+                    db.execute(f"INSERT INTO nodes (node_id, {names}) VALUES (?, {placeholders}) "
+                        f"ON CONFLICT(node_id) DO UPDATE SET {assignments}",
+                        (node_id, *columns.values()))
+
+    def update_many(self, infos):
+        # batch of {node_id: info}, e.g. published by the discovery engine
+        self.update_rows({node_id: self.info_to_columns(info) for node_id, info in infos.items()})
+
+    def mark_seen(self, node_id, alias=None):
+        self.mark_seen_many({node_id: (alias, time.time())})
+
+    def mark_seen_many(self, seen):
+        # {node_id: (alias, time)}, a None alias is left alone
+        rows = {}
+        for node_id, (alias, timestamp) in seen.items():
+            rows[node_id] = {"last_seen": timestamp}
+            if alias is not None: rows[node_id]["alias"] = alias
+        self.update_rows(rows)
+
+    def set_memory(self, node_id, node_memory, software_version=None):
+        # the memory layout is only valid for the firmware it was read from
+        memory = node_memory.to_dict() | {"software_version": software_version}
+        self.update_columns(node_id, {"memory": json.dumps(memory)})
+
+    def get_memory(self, node_id, software_version=None):
+        # memory options and address spaces as dict, see NodeMemory.from_dict
+        # None if they were stored for a different software version
+        with self.lock:
+            row = self.open().execute("SELECT memory FROM nodes WHERE node_id = ?", (node_id,)).fetchone()
+        if not row or row[0] is None: return None
+        memory = json.loads(row[0])
+        if memory.get("software_version") != software_version: return None
+        return memory
+
+    def set_cdi_layout(self, node_id, layout):
+        # layouts are shared by all nodes with identical CDI
+        with self.lock:
+            db = self.open()
+            exists = db.execute("SELECT 1 FROM cdi_layouts WHERE digest = ?", (layout.digest,)).fetchone()
+            if not exists:
+                db.execute("INSERT INTO cdi_layouts (digest, layout) VALUES (?, ?)",
+                    (layout.digest, json.dumps(layout.to_dict())))
+            db.execute("INSERT INTO nodes (node_id, cdi_digest) VALUES (?, ?) "
+                "ON CONFLICT(node_id) DO UPDATE SET cdi_digest = excluded.cdi_digest",
+                (node_id, layout.digest))
+            db.commit()
+
+    def get_cdi_layout(self, digest):
+        if digest is None: return None
+        layout = layout_cache.get(digest)
+        if layout: return layout
+        with self.lock:
+            row = self.open().execute("SELECT layout FROM cdi_layouts WHERE digest = ?", (digest,)).fetchone()
+        if not row: return None
+        layout = CdiLayout.from_dict(json.loads(row[0]))
+        layout_cache[digest] = layout
+        return layout
+
+    def forget(self, node_id):
+        with self.lock:
+            db = self.open()
+            db.execute("DELETE FROM nodes WHERE node_id = ?", (node_id,))
+            db.commit()
+
+inventory = NodeInventory()
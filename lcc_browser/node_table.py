@@ -0,0 +1,124 @@
+""" Sorted and filtered table of nodes that backs the virtual node list."""
+from bisect import bisect_left
+
+class NodeTable:
+    # rows are kept sorted by (column value, node id), a node's row is found by a dict lookup
+    # updates move only the changed node and touch the rows between its old and new position
+    columns = ["manufacturer_name", "model_name", "node_name", "node_id"]
+
+    def __init__(self):
+        self.nodes = {} # node_id -> info
+        self.present = set() # node ids that have been seen in this session
+        self.sort_column = 0
+        self.ascending = True
+        self.filter_text = ""
+        self.keys = [] # ascending sort keys of the shown nodes
+        self.row_of = {} # node_id -> index into keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_text(self, info, column):
+        return str(info.get(self.columns[column]) or "")
+
+    def sort_key(self, node_id):
+        return (self.get_text(self.nodes[node_id], self.sort_column).lower(), node_id)
+
+    def matches(self, node_id):
+        if not self.filter_text: return True
+        info = self.nodes[node_id]
+        return any(self.filter_text in self.get_text(info, i).lower() for i in range(len(self.columns)))
+
+    def to_row(self, index):
+        # display row of a sorted index and vice versa
+        return index if self.ascending else len(self.keys) - 1 - index
+
+    def row(self, node_id):
+        index = self.row_of.get(node_id)
+        return None if index is None else self.to_row(index)
+
+    def node_id(self, row):
+        if not 0 <= row < len(self.keys): return None
+        return self.keys[self.to_row(row)][1]
+
+    def text(self, row, column):
+        node_id = self.node_id(row)
+        if node_id is None: return ""
+        return self.get_text(self.nodes[node_id], column)
+
+    def is_present(self, row):
+        return self.node_id(row) in self.present
+
+    def update(self, node_id, info, is_present=None):
+        # returns the (first, last) rows that changed, None if the node isn't shown
+        self.nodes[node_id] = self.nodes.get(node_id, {"node_id": node_id}) | info
+        if is_present: self.present.add(node_id)
+        elif is_present is False: self.present.discard(node_id)
+        old = self.row_of.get(node_id)
+        key = self.sort_key(node_id)
+        matches = self.matches(node_id)
+        if old is not None and matches and self.keys[old] == key:
+            row = self.to_row(old)
+            return row, row
+        count = len(self.keys)
+        if old is not None: self.remove_index(old)
+        new = None
+        if matches:
+            new = bisect_left(self.keys, key)
+            self.keys.insert(new, key)
+        if old is None and new is None: return None
+        if old is not None and new is not None:
+            # a move shifts the rows in between by one
+            first, last = min(old, new), max(old, new)
+        else:
+            # an insertion or removal shifts all following rows
+            first, last = old if new is None else new, len(self.keys) - 1
+        for i in range(first, last + 1):
+            self.row_of[self.keys[i][1]] = i
+        if count != len(self.keys) and not self.ascending:
+            # rows are counted from the end
+            return 0, len(self.keys) - 1
+        rows = self.to_row(first), self.to_row(last)
+        return min(rows), max(rows)
+
+    def remove_index(self, index):
+        node_id = self.keys.pop(index)[1]
+        del self.row_of[node_id]
+
+    def set_present(self, node_id, is_present):
+        if node_id not in self.nodes: return None
+        return self.update(node_id, {}, is_present)
+
+    def expire(self, node_id):
+        # removes a node from the table
+        # returns the (first, last) rows that changed, None if the node wasn't shown
+        self.present.discard(node_id)
+        if self.nodes.pop(node_id, None) is None: return None
+        index = self.row_of.get(node_id)
+        if index is None: return None
+        self.remove_index(index)
+        for i in range(index, len(self.keys)):
+            self.row_of[self.keys[i][1]] = i
+        if not self.ascending:
+            # rows are counted from the end
+            return 0, len(self.keys) - 1
+        return index, len(self.keys) - 1
+
+    def clear(self):
+        self.nodes = {}
+        self.present = set()
+        self.keys = []
+        self.row_of = {}
+
+    def set_sort(self, column, ascending=True):
+        self.sort_column = column
+        self.ascending = ascending
+        self.rebuild()
+
+    def set_filter(self, text):
+        self.filter_text = text.strip().lower()
+        self.rebuild()
+
+    def rebuild(self):
+        self.keys = sorted([self.sort_key(node_id) for node_id in self.nodes if self.matches(node_id)])
+        self.row_of = {key[1]: i for i, key in enumerate(self.keys)}
@@ -0,0 +1,34 @@
+class RingBuffer:
+    # fixed-capacity sequence, the oldest item is dropped when a new one doesn't fit
+    # index 0 is the oldest item
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = [None] * capacity
+        self.start = 0
+        self.count = 0
+        self.total = 0 # number of items ever appended, the sequence number of the next item
+
+    def append(self, item):
+        self.items[(self.start + self.count) % self.capacity] = item
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+        self.total += 1
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0: index += self.count
+        if not 0 <= index < self.count: raise IndexError("ring buffer index out of range")
+        return self.items[(self.start + index) % self.capacity]
+
+    def sequence_number(self, index):
+        # stable id of the item at index, it doesn't change when older items are dropped
+        return self.total - self.count + index
+
+    def clear(self):
+        self.items = [None] * self.capacity
+        self.start = 0
+        self.count = 0
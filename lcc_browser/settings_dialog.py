@@ -50,6 +50,7 @@ class SettingsDialog(SettingsDialogTemplate):
         print(html_path)
         self.html_path.SetValue(html_path)
         self.auto_connect.SetValue(settings.get("auto_connect", False))
+        self.single_threaded.SetValue(settings.get("single_threaded", False))
 
     def get_settings(self):
         html_path = self.html_path.GetValue()
@@ -60,6 +61,7 @@ class SettingsDialog(SettingsDialogTemplate):
             "node_id": self.node_id.GetValue(),
             "html_path": html_path,
             "auto_connect": self.auto_connect.IsChecked(),
+            "single_threaded": self.single_threaded.IsChecked(),
         }
         return settings
 
@@ -0,0 +1,82 @@
+# -*- coding: UTF-8 -*-
+#
+# generated by wxGlade 1.0.4 on Mon Oct 19 10:12:41 2026
+#
+
+import wx
+
+# begin wxGlade: dependencies
+# end wxGlade
+
+# begin wxGlade: extracode
+# end wxGlade
+
+
+class BusStatisticsTemplate(wx.Frame):
+    def __init__(self, *args, **kwds):
+        # begin wxGlade: BusStatisticsTemplate.__init__
+        kwds["style"] = kwds.get("style", 0) | wx.DEFAULT_FRAME_STYLE
+        wx.Frame.__init__(self, *args, **kwds)
+        self.SetSize((720, 520))
+        self.SetTitle("Bus Statistics")
+
+        self.panel_1 = wx.Panel(self, wx.ID_ANY)
+
+        sizer_1 = wx.BoxSizer(wx.VERTICAL)
+
+        self.summary_text = wx.StaticText(self.panel_1, wx.ID_ANY, "")
+        sizer_1.Add(self.summary_text, 0, wx.ALL | wx.EXPAND, 5)
+
+        grid_sizer_1 = wx.GridSizer(2, 2, 5, 5)
+        sizer_1.Add(grid_sizer_1, 1, wx.ALL | wx.EXPAND, 5)
+
+        self.type_list = wx.ListCtrl(self.panel_1, wx.ID_ANY, style=wx.LC_HRULES | wx.LC_REPORT | wx.LC_VRULES)
+        self.type_list.AppendColumn("Frame type", format=wx.LIST_FORMAT_LEFT, width=200)
+        self.type_list.AppendColumn("Frames/s", format=wx.LIST_FORMAT_RIGHT, width=100)
+        grid_sizer_1.Add(self.type_list, 1, wx.EXPAND, 0)
+
+        self.source_list = wx.ListCtrl(self.panel_1, wx.ID_ANY, style=wx.LC_HRULES | wx.LC_REPORT | wx.LC_VRULES)
+        self.source_list.AppendColumn("Source alias", format=wx.LIST_FORMAT_LEFT, width=90)
+        self.source_list.AppendColumn("Node ID", format=wx.LIST_FORMAT_LEFT, width=140)
+        self.source_list.AppendColumn("Frames/s", format=wx.LIST_FORMAT_RIGHT, width=80)
+        grid_sizer_1.Add(self.source_list, 1, wx.EXPAND, 0)
+
+        self.latency_list = wx.ListCtrl(self.panel_1, wx.ID_ANY, style=wx.LC_HRULES | wx.LC_REPORT | wx.LC_VRULES)
+        self.latency_list.AppendColumn("Datagram round trip", format=wx.LIST_FORMAT_LEFT, width=160)
+        self.latency_list.AppendColumn("Count", format=wx.LIST_FORMAT_RIGHT, width=80)
+        grid_sizer_1.Add(self.latency_list, 1, wx.EXPAND, 0)
+
+        self.error_list = wx.ListCtrl(self.panel_1, wx.ID_ANY, style=wx.LC_HRULES | wx.LC_REPORT | wx.LC_VRULES)
+        self.error_list.AppendColumn("Error", format=wx.LIST_FORMAT_LEFT, width=200)
+        self.error_list.AppendColumn("Count", format=wx.LIST_FORMAT_RIGHT, width=80)
+        grid_sizer_1.Add(self.error_list, 1, wx.EXPAND, 0)
+
+        sizer_2 = wx.BoxSizer(wx.HORIZONTAL)
+        sizer_1.Add(sizer_2, 0, wx.ALL | wx.EXPAND, 5)
+
+        self.record_trace = wx.CheckBox(self.panel_1, wx.ID_ANY, "Record trace")
+        sizer_2.Add(self.record_trace, 0, wx.ALIGN_CENTER_VERTICAL, 0)
+
+        self.save_trace = wx.Button(self.panel_1, wx.ID_ANY, "Save trace...")
+        sizer_2.Add(self.save_trace, 0, wx.LEFT, 10)
+
+        self.trace_text = wx.StaticText(self.panel_1, wx.ID_ANY, "")
+        sizer_2.Add(self.trace_text, 1, wx.ALIGN_CENTER_VERTICAL | wx.LEFT, 10)
+
+        self.panel_1.SetSizer(sizer_1)
+
+        self.Layout()
+
+        self.Bind(wx.EVT_CHECKBOX, self.on_record_trace, self.record_trace)
+        self.Bind(wx.EVT_BUTTON, self.on_save_trace, self.save_trace)
+        # end wxGlade
+
+    def on_record_trace(self, event):  # wxGlade: BusStatisticsTemplate.<event_handler>
+        print("Event handler 'on_record_trace' not implemented!")
+        event.Skip()
+
+    def on_save_trace(self, event):  # wxGlade: BusStatisticsTemplate.<event_handler>
+        print("Event handler 'on_save_trace' not implemented!")
+        event.Skip()
+
+# end of class BusStatisticsTemplate
@@ -34,6 +34,11 @@ class OpenLcbGui(wx.Frame):
         self.Bind(wx.EVT_MENU, self.reload_browser, item)
         item = wxglade_tmp_menu.Append(wx.ID_ANY, "Settings...", "")
         self.Bind(wx.EVT_MENU, self.show_settings_dialog, item)
+        wxglade_tmp_menu.AppendSeparator()
+        item = wxglade_tmp_menu.Append(wx.ID_ANY, "Backup configuration...", "")
+        self.Bind(wx.EVT_MENU, self.backup_configuration, item)
+        item = wxglade_tmp_menu.Append(wx.ID_ANY, "Restore configuration...", "")
+        self.Bind(wx.EVT_MENU, self.restore_configuration, item)
         self.menu.Append(wxglade_tmp_menu, "&Layout")
         wxglade_tmp_menu = wx.Menu()
         self.menu.view_lcc_nodes = wxglade_tmp_menu.Append(wx.ID_ANY, "LCC Nodes", "", wx.ITEM_CHECK)
@@ -43,6 +48,8 @@ class OpenLcbGui(wx.Frame):
         self.Bind(wx.EVT_MENU, self.view_can_traffic, self.menu.view_can_traffic)
         self.menu.view_lcc_traffic = wxglade_tmp_menu.Append(wx.ID_ANY, "LCC Traffic", "", wx.ITEM_CHECK)
         self.Bind(wx.EVT_MENU, self.view_lcc_traffic, self.menu.view_lcc_traffic)
+        self.menu.view_bus_statistics = wxglade_tmp_menu.Append(wx.ID_ANY, "Bus Statistics", "", wx.ITEM_CHECK)
+        self.Bind(wx.EVT_MENU, self.view_bus_statistics, self.menu.view_bus_statistics)
         self.menu.Append(wxglade_tmp_menu, "&View")
         self.SetMenuBar(self.menu)
         # Menu Bar end
@@ -75,6 +82,14 @@ class OpenLcbGui(wx.Frame):
         print("Event handler 'show_settings_dialog' not implemented!")
         event.Skip()
 
+    def backup_configuration(self, event):  # wxGlade: OpenLcbGui.<event_handler>
+        print("Event handler 'backup_configuration' not implemented!")
+        event.Skip()
+
+    def restore_configuration(self, event):  # wxGlade: OpenLcbGui.<event_handler>
+        print("Event handler 'restore_configuration' not implemented!")
+        event.Skip()
+
     def view_lcc_nodes(self, event):  # wxGlade: OpenLcbGui.<event_handler>
         print("Event handler 'view_lcc_nodes' not implemented!")
         event.Skip()
@@ -87,6 +102,10 @@ class OpenLcbGui(wx.Frame):
         print("Event handler 'view_lcc_traffic' not implemented!")
         event.Skip()
 
+    def view_bus_statistics(self, event):  # wxGlade: OpenLcbGui.<event_handler>
+        print("Event handler 'view_bus_statistics' not implemented!")
+        event.Skip()
+
 # end of class OpenLcbGui
 
 class MyApp(wx.App):
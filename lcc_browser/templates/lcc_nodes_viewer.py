@@ -9,6 +9,7 @@ import wx
 # end wxGlade
 
 # begin wxGlade: extracode
+from lcc_browser.wx_controls.node_list import NodeList
 # end wxGlade
 
 
@@ -30,8 +31,14 @@ class LccNodesViewerTemplate(wx.Frame):
         label_1 = wx.StaticText(self.node_select_panel, wx.ID_ANY, "Select a node")
         sizer_1.Add(label_1, 0, 0, 0)
 
-        self.node_list = wx.ListCtrl(self.node_select_panel, wx.ID_ANY, style=wx.LC_HRULES | wx.LC_REPORT | wx.LC_VRULES)
-        self.node_list.AppendColumn("Name", format=wx.LIST_FORMAT_LEFT, width=200)
+        self.node_filter = wx.SearchCtrl(self.node_select_panel, wx.ID_ANY, "")
+        self.node_filter.ShowCancelButton(True)
+        sizer_1.Add(self.node_filter, 0, wx.EXPAND | wx.TOP, 5)
+
+        self.node_list = NodeList(self.node_select_panel, wx.ID_ANY, style=wx.LC_HRULES | wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_VRULES)
+        self.node_list.AppendColumn("Manufacturer", format=wx.LIST_FORMAT_LEFT, width=120)
+        self.node_list.AppendColumn("Model", format=wx.LIST_FORMAT_LEFT, width=120)
+        self.node_list.AppendColumn("Name", format=wx.LIST_FORMAT_LEFT, width=120)
         self.node_list.AppendColumn("ID", format=wx.LIST_FORMAT_LEFT, width=150)
         sizer_1.Add(self.node_list, 1, wx.EXPAND, 0)
 
@@ -53,6 +60,18 @@ class LccNodesViewerTemplate(wx.Frame):
         sizer_5 = wx.BoxSizer(wx.HORIZONTAL)
         sizer_2.Add(sizer_5, 0, wx.ALIGN_RIGHT, 0)
 
+        self.button_find_event = wx.Button(self.node_detail_panel, wx.ID_ANY, "Find event...")
+        sizer_5.Add(self.button_find_event, 0, wx.ALL, 5)
+
+        self.button_save_template = wx.Button(self.node_detail_panel, wx.ID_ANY, "Save template...")
+        sizer_5.Add(self.button_save_template, 0, wx.ALL, 5)
+
+        self.button_apply_template = wx.Button(self.node_detail_panel, wx.ID_ANY, "Apply template...")
+        sizer_5.Add(self.button_apply_template, 0, wx.ALL, 5)
+
+        self.button_map_events = wx.Button(self.node_detail_panel, wx.ID_ANY, "Map events")
+        sizer_5.Add(self.button_map_events, 0, wx.ALL, 5)
+
         self.button_refresh = wx.Button(self.node_detail_panel, wx.ID_ANY, "Refresh all fields")
         sizer_5.Add(self.button_refresh, 0, wx.ALL, 5)
 
@@ -9,6 +9,7 @@ import wx
 # end wxGlade
 
 # begin wxGlade: extracode
+from lcc_browser.wx_controls.log_list import LogList
 # end wxGlade
 
 
@@ -24,8 +25,8 @@ class LogViewerTemplate(wx.Frame):
 
         sizer_1 = wx.BoxSizer(wx.VERTICAL)
 
-        self.log_text = wx.TextCtrl(self.panel_1, wx.ID_ANY, "", style=wx.TE_DONTWRAP | wx.TE_MULTILINE | wx.TE_READONLY)
-        sizer_1.Add(self.log_text, 1, wx.EXPAND, 0)
+        self.log_list = LogList(self.panel_1, wx.ID_ANY, style=wx.LC_HRULES | wx.LC_REPORT | wx.LC_VIRTUAL)
+        sizer_1.Add(self.log_list, 1, wx.EXPAND, 0)
 
         self.panel_1.SetSizer(sizer_1)
 
@@ -47,6 +47,9 @@ class SettingsDialogTemplate(wx.Dialog):
         self.auto_connect = wx.CheckBox(self.panel_1, wx.ID_ANY, "Auto connect CAN bus on program start")
         sizer_4.Add(self.auto_connect, 0, wx.TOP, 10)
 
+        self.single_threaded = wx.CheckBox(self.panel_1, wx.ID_ANY, "Handle CAN bus traffic in the GUI thread (needs restart)")
+        sizer_4.Add(self.single_threaded, 0, wx.TOP, 5)
+
         sizer_2 = wx.StdDialogButtonSizer()
         sizer_1.Add(sizer_2, 0, wx.ALIGN_RIGHT | wx.ALL, 5)
 
@@ -0,0 +1,85 @@
+""" Delivery of updates from the connection thread to the GUI in rate-limited batches."""
+import wx
+import time
+from threading import Lock
+from collections import deque
+
+class UiBridge:
+    # collects updates on any thread and hands them to the GUI thread at most rate times per second
+    # channels deliver all their items of a batch in one call, the oldest items are dropped when a channel is full
+    # calls with a key are coalesced, only the latest call per key is made
+    def __init__(self, rate=20):
+        self.rate = rate
+        self.lock = Lock()
+        self.channels = {} # name -> (handler, max_items)
+        self.pending_items = {} # name -> deque of items
+        self.pending_calls = {} # key -> (func, args), insertion ordered
+        self.flush_scheduled = False
+        self.last_flush = 0
+        self.stats_callback = None # called in the GUI thread when stats changed
+        self.stats = {"batches": 0, "items": 0, "calls": 0, "coalesced": 0, "dropped": 0}
+
+    def add_channel(self, name, handler, max_items=10000):
+        # handler(items) is called in the GUI thread
+        with self.lock:
+            self.channels[name] = (handler, max_items)
+            self.pending_items[name] = deque()
+
+    def put(self, name, item):
+        with self.lock:
+            handler, max_items = self.channels[name]
+            items = self.pending_items[name]
+            if len(items) >= max_items:
+                items.popleft()
+                self.stats["dropped"] += 1
+            items.append(item)
+            self.schedule()
+
+    def call(self, key, func, *args):
+        # like wx.CallAfter, replaces a pending call with the same key
+        with self.lock:
+            if self.pending_calls.pop(key, None) is not None:
+                self.stats["coalesced"] += 1
+            self.pending_calls[key] = (func, args)
+            self.schedule()
+
+    def schedule(self):
+        # lock is held
+        if self.flush_scheduled: return
+        self.flush_scheduled = True
+        wx.CallAfter(self.schedule_flush)
+
+    def schedule_flush(self):
+        delay = self.last_flush + 1 / self.rate - time.monotonic()
+        if delay > 0:
+            wx.CallLater(int(delay * 1000) + 1, self.flush)
+        else:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.flush_scheduled = False
+            self.last_flush = time.monotonic()
+            batches = []
+            for name, items in self.pending_items.items():
+                if items:
+                    batches.append((self.channels[name][0], list(items)))
+                    items.clear()
+            calls = list(self.pending_calls.values())
+            self.pending_calls = {}
+            self.stats["batches"] += 1
+            self.stats["items"] += sum(len(x[1]) for x in batches)
+            self.stats["calls"] += len(calls)
+        for handler, items in batches:
+            try:
+                handler(items)
+            except Exception as e:
+                print("Error in UI update:", e)
+        for func, args in calls:
+            try:
+                func(*args)
+            except Exception as e:
+                print("Error in UI update:", e)
+        if self.stats_callback: self.stats_callback(dict(self.stats))
+
+ui_bridge = UiBridge()
@@ -0,0 +1,17 @@
+""" Runs the wx main loop as an asyncio task, so the GUI and the CAN connection share one thread."""
+import wx
+import asyncio
+
+async def main_loop(interval=.002, idle_interval=.02):
+    # dispatches wx events in between asyncio callbacks until all top level windows are closed
+    # polls quickly while there are wx events, slower when the GUI is idle, asyncio wakes up for CAN frames on its own
+    # modal dialogs run their own wx loop, the connection pauses while they're shown
+    event_loop = wx.GUIEventLoop()
+    with wx.EventLoopActivator(event_loop):
+        while wx.GetTopLevelWindows():
+            busy = False
+            while event_loop.Pending():
+                event_loop.Dispatch()
+                busy = True
+            if event_loop.ProcessIdle(): busy = True # more idle processing requested
+            await asyncio.sleep(interval if busy else idle_interval)
@@ -2,6 +2,7 @@ import wx
 import re
 from lcc_browser.lcc.lcc_protocol import id_to_bytes
 from lcc_browser.wx_controls.tool_button import ToolButton
+from lcc_browser.event_id_index import event_id_index
 
 def validate_partial(text):
     is_match = re.match("^[0-9a-fA-F\.]+$", text)
@@ -56,13 +57,26 @@ class EventIdInput(wx.Panel):
             self.input.SetBackgroundColour(wx.LIGHT_GREY)
         else:
             if self.GetValue() != self.initial_value:
-                self.GetToolTip().SetTip("Ready for upload to node")
+                tip = "Ready for upload to node"
                 self.input.SetBackgroundColour(wx.YELLOW)
             else:
-                self.GetToolTip().SetTip("Value present on node")
+                tip = "Value present on node"
                 self.input.SetBackgroundColour(wx.NullColour)
+            self.GetToolTip().SetTip(tip + self.get_event_users())
         self.Refresh()
 
+    def get_event_users(self):
+        # producers and consumers of this event according to the event map
+        entry = getattr(self, "cdi_entry", None)
+        if entry is None: return ""
+        event_map = entry.registry.lcc.event_map
+        event_id = int.from_bytes(self.GetValue(), "big")
+        producers = ", ".join(event_map.who_produces(event_id)) or "none known"
+        consumers = ", ".join(event_map.who_consumes(event_id)) or "none known"
+        fields = [f"{node_id} {path}" for node_id, path, indices in event_id_index.lookup(event_id)]
+        configured = "\n  ".join([""] + fields[:10]) if fields else " nowhere known"
+        return f"\nProducers: {producers}\nConsumers: {consumers}\nConfigured in:{configured}"
+
     def SetValue(self, text):
         self.input.SetValue(text)
         self.initial_value = self.GetValue()
@@ -86,6 +86,4 @@ class IntInput(wx.Panel):
     def set_raw_value(self, val):
         assert len(val) == self.cdi_entry.size
         val = int.from_bytes(val, byteorder="big")
-        self.initial_value = val
-        wx.CallAfter(self.SetValue, val)
-        wx.CallAfter(self.on_change)
+        self.SetValue(val)
@@ -0,0 +1,62 @@
+import wx
+import time
+from lcc_browser.ring_buffer import RingBuffer
+
+class LogList(wx.ListCtrl):
+    # virtual list of log entries stored in a ring buffer
+    # entries are (timestamp, get_log_entry) records and only rows that are shown get formatted
+    capacity = 100000
+    cache_size = 1000 # formatted rows that are kept, more than fit on a screen
+
+    def __init__(self, *args, **kwds):
+        kwds["style"] = kwds.get("style", 0) | wx.LC_REPORT | wx.LC_VIRTUAL
+        super().__init__(*args, **kwds)
+        self.AppendColumn("Time", width=100)
+        self.AppendColumn("Entry", width=2000)
+        self.buffer = RingBuffer(self.capacity)
+        self.text_cache = {} # sequence number -> formatted entry
+        self.refresh_pending = False
+
+    def append(self, get_log_entry):
+        self.extend([get_log_entry])
+
+    def extend(self, get_log_entries):
+        now = time.time()
+        for get_log_entry in get_log_entries:
+            self.buffer.append((now, get_log_entry))
+        if get_log_entries and not self.refresh_pending:
+            # many entries arriving at once are shown with a single refresh
+            self.refresh_pending = True
+            wx.CallLater(50, self.refresh)
+
+    def clear(self):
+        self.buffer.clear()
+        self.text_cache = {}
+        self.SetItemCount(0)
+
+    def refresh(self):
+        self.refresh_pending = False
+        count = len(self.buffer)
+        # follow new entries if the last row was visible
+        at_end = self.GetItemCount() == 0 or self.GetTopItem() + self.GetCountPerPage() >= self.GetItemCount() - 1
+        self.SetItemCount(count)
+        if count == self.buffer.capacity:
+            # rows shift when old entries are dropped
+            top = self.GetTopItem()
+            self.RefreshItems(top, min(count - 1, top + self.GetCountPerPage()))
+        if at_end and count:
+            self.EnsureVisible(count - 1)
+
+    def OnGetItemText(self, item, column):
+        if item >= len(self.buffer): return ""
+        timestamp, get_log_entry = self.buffer[item]
+        if column == 0:
+            return time.strftime("%H:%M:%S", time.localtime(timestamp)) + f".{int(timestamp * 1000) % 1000:03d}"
+        key = self.buffer.sequence_number(item)
+        text = self.text_cache.get(key)
+        if text is None:
+            text = get_log_entry()
+            if len(self.text_cache) >= self.cache_size:
+                self.text_cache = {}
+            self.text_cache[key] = text
+        return text
@@ -0,0 +1,90 @@
+import wx
+from lcc_browser.node_table import NodeTable
+
+class NodeList(wx.ListCtrl):
+    # virtual list of the rows of a NodeTable
+    # nodes that haven't been seen in this session are greyed out
+    def __init__(self, *args, **kwds):
+        kwds["style"] = kwds.get("style", 0) | wx.LC_REPORT | wx.LC_VIRTUAL
+        super().__init__(*args, **kwds)
+        self.table = NodeTable()
+        self.absent_attr = wx.ItemAttr()
+        self.absent_attr.SetTextColour(wx.SystemSettings.GetColour(wx.SYS_COLOUR_GRAYTEXT))
+        self.moving_selection = False
+        self.Bind(wx.EVT_LIST_COL_CLICK, self.on_column_click)
+        self.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_item_selected)
+
+    def selected_node_id(self):
+        return self.table.node_id(self.GetNextSelected(-1))
+
+    def update_nodes(self, nodes, is_present=None):
+        # nodes: {node_id: info}
+        selected = self.selected_node_id()
+        first = last = None
+        for node_id, info in nodes.items():
+            rows = self.table.update(node_id, info, is_present)
+            if rows is None: continue
+            first = rows[0] if first is None else min(first, rows[0])
+            last = rows[1] if last is None else max(last, rows[1])
+        self.refresh_rows(first, last, selected)
+
+    def set_present(self, node_ids, is_present):
+        selected = self.selected_node_id()
+        for node_id in node_ids:
+            rows = self.table.set_present(node_id, is_present)
+            if rows: self.refresh_rows(rows[0], rows[1], selected)
+
+    def expire(self, node_ids):
+        selected = self.selected_node_id()
+        first = last = None
+        for node_id in node_ids:
+            rows = self.table.expire(node_id)
+            if rows is None: continue
+            first = rows[0] if first is None else min(first, rows[0])
+            last = rows[1] if last is None else max(last, rows[1])
+        # following rows moved up, the last one is dropped by the item count
+        if first is not None: last = min(last, len(self.table) - 1)
+        self.refresh_rows(first, last, selected)
+
+    def clear(self):
+        self.table.clear()
+        self.SetItemCount(0)
+
+    def set_filter(self, text):
+        selected = self.selected_node_id()
+        self.table.set_filter(text)
+        self.refresh_rows(0, len(self.table) - 1, selected)
+
+    def on_column_click(self, evt):
+        # a second click on the sorted column reverses the order
+        column = evt.GetColumn()
+        ascending = column != self.table.sort_column or not self.table.ascending
+        selected = self.selected_node_id()
+        self.table.set_sort(column, ascending)
+        self.refresh_rows(0, len(self.table) - 1, selected)
+
+    def refresh_rows(self, first, last, selected=None):
+        if self.GetItemCount() != len(self.table):
+            self.SetItemCount(len(self.table))
+        if first is not None and first <= last < len(self.table):
+            self.RefreshItems(first, last)
+        # the selection follows the node when its row moved
+        row = self.GetNextSelected(-1)
+        new_row = self.table.row(selected) if selected else None
+        if row == (-1 if new_row is None else new_row): return
+        self.moving_selection = True
+        try:
+            if row != -1: self.Select(row, False)
+            if new_row is not None: self.Select(new_row)
+        finally:
+            self.moving_selection = False
+
+    def on_item_selected(self, evt):
+        # selection changes that follow a moved node aren't reported
+        if not self.moving_selection: evt.Skip()
+
+    def OnGetItemText(self, item, column):
+        return self.table.text(item, column)
+
+    def OnGetItemAttr(self, item):
+        return None if self.table.is_present(item) else self.absent_attr
@@ -28,5 +28,9 @@ setuptools.setup(
         "PyYAML >= 6.0",
         "setuptools >= 62.6.0",
     ],
+    extras_require={
+        # vectorised decoding of replicated CDI groups
+        "numpy": ["numpy >= 1.23"],
+    },
     python_requires=">=3.10"
 )